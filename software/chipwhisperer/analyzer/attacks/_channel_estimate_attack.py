@@ -30,25 +30,71 @@ from operator import itemgetter
 
 
 class ChannelEstimateAttackOneSubkey(object):
-    """ Redos entire attack """
+    """
+    Channel estimation attack on one subkey, for all key guesses at once.
+
+    For every guess a linear channel mapping the trace points to the hypothesis is fitted by least squares on a
+    'fitting set' of traces, and the guess is scored by the squared error of that channel on a separate 'test set'.
+
+    Traces can be added progressively (addFitTraces()/addTestTraces()), in which case only the Gram matrices of the
+    traces and their products with the (traces x guesses) hypothesis matrix are kept, so data sets larger than memory
+    can be used. oneSubkey() redoes the entire attack from the given arrays.
+    """
 
     def __init__(self):        
         self.clearStats()
         
     def clearStats(self):
-        pass
-    
+        self.fitGram = None     # sum of t^T t over the fitting set (points x points)
+        self.fitCross = None    # sum of t^T h over the fitting set (points x guesses)
+        self.testGram = None
+        self.testCross = None
+        self.testHq = None      # sum of h^2 over the test set, per guess
+
+    @staticmethod
+    def hypotheses(model, bnum, plaintexts):
+        """Hypothesis matrix (traces x guesses) of the model for subkey bnum"""
+        return np.asarray(model.leakageBatch(plaintexts, None, bnum), dtype=np.float64)
+
+    def addFitTraces(self, bnum, traces, plaintexts, model):
+        """Add a block of traces to the set the channels are fitted on"""
+        traces = np.asarray(traces, dtype=np.float64)
+        hyp = self.hypotheses(model, bnum, plaintexts)
+        if self.fitGram is None:
+            self.fitGram = np.zeros((traces.shape[1], traces.shape[1]))
+            self.fitCross = np.zeros((traces.shape[1], hyp.shape[1]))
+        self.fitGram += np.dot(traces.T, traces)
+        self.fitCross += np.dot(traces.T, hyp)
+
+    def addTestTraces(self, bnum, traces, plaintexts, model):
+        """Add a block of traces to the set the channels are tested on"""
+        traces = np.asarray(traces, dtype=np.float64)
+        hyp = self.hypotheses(model, bnum, plaintexts)
+        if self.testGram is None:
+            self.testGram = np.zeros((traces.shape[1], traces.shape[1]))
+            self.testCross = np.zeros((traces.shape[1], hyp.shape[1]))
+            self.testHq = np.zeros(hyp.shape[1])
+        self.testGram += np.dot(traces.T, traces)
+        self.testCross += np.dot(traces.T, hyp)
+        self.testHq += np.sum(np.square(hyp), axis=0)
+
+    def channels(self):
+        """Least-squares channel of every guess (points x guesses) fitted on the traces added so far"""
+        # pinv(T) = pinv(T^T T) T^T, so this is the same minimum-norm solution as pinv(T) h
+        return np.dot(np.linalg.pinv(self.fitGram), self.fitCross)
+
+    def errors(self, channels=None):
+        """Sum of squared errors of every guess's channel over the test traces added so far"""
+        if channels is None:
+            channels = self.channels()
+        # sum((T c - h)^2) = c^T (T^T T) c - 2 c^T (T^T h) + h^T h, for each column c of channels
+        return np.sum(channels * np.dot(self.testGram, channels), axis=0) - 2 * np.sum(channels * self.testCross, axis=0) + self.testHq
+
     def oneSubkey(self, bnum, traces_fit, traces_test, plaintexts_fit, plaintexts_test,
                   model, modeltype="Hamming Weight",
                   key=None, printData=False, aroundStartEnd=False, useSVD=True, tracefitPInv=False,
                   progressBar=None, pbcnt=0):
 
-        if tracefitPInv:
-            ntracesfit = len(traces_fit[0,:])
-        else:
-            ntracesfit = len(traces_fit[:,0])
-        ntracestry = len(traces_test[:,0])
-
         if printData:
             print " Key %d = %2x"%(bnum, key[bnum])
 
@@ -65,46 +111,31 @@ class ChannelEstimateAttackOneSubkey(object):
         if end > 256:
             end = 256
 
-        result = []
+        hwlst = self.hypotheses(model, bnum, plaintexts_fit)[:, start:end]
+        hwtry = self.hypotheses(model, bnum, plaintexts_test)[:, start:end]
 
-        diffs = [1E99]*256
-
-        for guess in range(start, end):
-            if printData:
-                print "  %2x "%guess,
-                
-            hwlst = np.zeros( (ntracesfit, 1) )
-
-            for i,t in enumerate(plaintexts_fit):
-                hwlst[i][0] = AES128_8bit.HypHW(t, None, guess, bnum)
-    
-            if useSVD:
-                if tracefitPInv:
-                    #traces_fit already a pseudoinverse
-                    channel = np.dot(traces_fit, hwlst)
-                else:
-                    #Use pseudo-inverse which is fairly fast, as NumPY uses a SVD decomposition
-                    channel = np.dot(np.linalg.pinv(traces_fit), hwlst) 
+        if useSVD:
+            if tracefitPInv:
+                #traces_fit already a pseudoinverse
+                channel = np.dot(traces_fit, hwlst)
             else:
-                #Classic but VERY SLOW least-squares
-                channel = np.linalg.lstsq(traces_fit, hwlst)[0]           
-
-            hwtry = np.zeros( (ntracestry, 1) )
-            for i,t in enumerate(plaintexts_test):
-                hwtry[i][0] = AES128_8bit.HypHW(t, None, guess, bnum)
+                #Use pseudo-inverse which is fairly fast, as NumPY uses a SVD decomposition
+                channel = np.dot(np.linalg.pinv(traces_fit), hwlst)
+        else:
+            #Classic least-squares, solved for all guesses at once
+            channel = np.linalg.lstsq(traces_fit, hwlst, rcond=-1)[0]
 
-            res = np.dot(traces_test,channel)
-            res = ((res-hwtry)**2).sum()   
+        res = np.dot(traces_test, channel)
+        res = ((res - hwtry)**2).sum(axis=0)
 
-            diffs[guess] = res
+        diffs = np.array([1E99]*256)
+        diffs[start:end] = res
 
-            if printData:
-                print "%E"%res
-                result.append({'sse':res, 'guess':guess, 'csi':channel})
-    
-        if printData:        
-            sortedresult = sorted(result, key=itemgetter('sse'))
-            print "answer @ rank %d"%map(itemgetter('guess'), sortedresult).index(key[bnum])
+        if printData:
+            for guess in range(start, end):
+                print "  %2x %E"%(guess, diffs[guess])
+            ranks = list(np.argsort(diffs[start:end], kind='mergesort') + start)
+            print "answer @ rank %d"%ranks.index(key[bnum])
 
         return (diffs, pbcnt)
 
@@ -112,9 +143,9 @@ class ChannelEstimateAttackOneSubkey(object):
 #Hacks for main()
 sys.path.append('../../common')
 sys.path.append('../.')
-import models.AES128_8bit as AES128_8bit
+from models.AES128_8bit import AES128_8bit
 
-def main(tracedir, fitrange, tryrange):    
+def main(tracedir, fitrange, tryrange, blockSize=1000):
     preflist = []
 
     files = os.listdir(tracedir)
@@ -128,33 +159,30 @@ def main(tracedir, fitrange, tryrange):
 
     prefix = preflist[0]
 
-    traces = np.load(tracedir + prefix + "traces.npy")
+    #Traces are memory-mapped and added blockSize at a time, so the sets don't need to fit in memory
+    traces = np.load(tracedir + prefix + "traces.npy", mmap_mode='r')
     textin = np.load(tracedir + prefix + "textin.npy")
     key = np.load(tracedir + prefix + "knownkey.npy")
-    
-    #Majority of traces used in generating estimated channel
-    tracesfit = traces[fitrange[0]:fitrange[1],:]
-    textinfit = textin[fitrange[0]:fitrange[1],:]
-
-    #Select a few traces to use a test
-    tracestry = traces[tryrange[0]:tryrange[1],:]
-    textintry = textin[tryrange[0]:tryrange[1],:]
-
-    tracesfit = np.linalg.pinv(tracesfit)
 
-    cea = ChannelEstimateAttackOneSubkey()
-
-    diffs = [0]*16
+    model = AES128_8bit()
     blist = range(0, 16)
+    cea = [ChannelEstimateAttackOneSubkey() for bnum in blist]
 
-    for bnum in blist:
-        print "Attacking byte %d"%bnum
-        cea.clearStats()
+    #Majority of traces used in generating estimated channel
+    print "Fitting channels"
+    for bstart in range(fitrange[0], fitrange[1], blockSize):
+        bend = min(bstart + blockSize, fitrange[1])
+        for bnum in blist:
+            cea[bnum].addFitTraces(bnum, traces[bstart:bend, :], textin[bstart:bend, :], model)
+
+    #Select a few traces to use a test
+    print "Testing channels"
+    for bstart in range(tryrange[0], tryrange[1], blockSize):
+        bend = min(bstart + blockSize, tryrange[1])
+        for bnum in blist:
+            cea[bnum].addTestTraces(bnum, traces[bstart:bend, :], textin[bstart:bend, :], model)
 
-        #Example running an attack, don't set 'aroundStartEnd' if you want
-        #the full attack and not quick cheater
-        diffs[bnum] = cea.oneSubkey(bnum, tracesfit, tracestry, textinfit, textintry, AES128_8bit,
-                      key=key, printData=False, aroundStartEnd=False, tracefitPInv=True)[0]
+    diffs = [cea[bnum].errors() for bnum in blist]
 
     #Sort Output
     output = [0]*16
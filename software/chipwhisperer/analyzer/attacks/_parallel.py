@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2016, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import logging
+import multiprocessing
+import traceback
+
+import numpy as np
+
+
+def modelDescription(model):
+    """
+    Picklable description of a leakage model: its class, the key of its hardware model and its bitmask.
+
+    The model itself holds parameter tree (Qt) state, which can't be sent to a process started by spawn (Windows).
+    """
+    hwModel = getattr(model, "modelobj", None)
+    if hwModel is None:
+        hwModel = model.model
+    kwargs = {}
+    if hasattr(model, "_mask"):
+        kwargs["bitmask"] = model._mask
+    return (model.__class__, hwModel.name, kwargs)
+
+
+def buildModel(description):
+    """Create a new leakage model from modelDescription()"""
+    modelClass, hwModelKey, kwargs = description
+    if hwModelKey not in modelClass.hwModels:
+        raise ValueError("Hardware model %s is not registered in %s" % (hwModelKey, modelClass.__name__))
+    return modelClass(modelClass.hwModels[hwModelKey], **kwargs)
+
+
+def _subkeyWorker(conn, sharedtraces, oneSubkeyClass, modeldesc, bnums):
+    """Worker process: keeps the progressive state for subkeys bnums and processes every block it is sent"""
+    model = buildModel(modeldesc)
+    cpa = dict((bnum, oneSubkeyClass(model)) for bnum in bnums)
+    buf = np.frombuffer(sharedtraces, dtype=np.float64)
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+
+        (numtraces, numpoints), textins, textouts, knownkeys, pointRanges = msg
+        traces = buf[:numtraces * numpoints].reshape((numtraces, numpoints))
+
+        for bnum in bnums:
+            try:
+                (data, _) = cpa[bnum].oneSubkey(bnum, pointRanges[bnum], traces, numtraces, textins, textouts,
+                                                knownkeys, None, cpa[bnum].modelstate, 0)
+                conn.send((bnum, data, None))
+            except Exception:
+                conn.send((bnum, None, traceback.format_exc()))
+
+    conn.close()
+
+
+class SubkeyProcessPool(object):
+    """
+    Runs the per-subkey engines of a progressive attack in worker processes.
+
+    Subkeys are dealt round-robin to the workers, and each worker keeps the running state of its subkeys for
+    the whole attack. Trace blocks are published once in shared memory, so only the (small) text/key data
+    and the per-subkey results go through the pipes. The workers rebuild the leakage model from its
+    modelDescription().
+    """
+
+    def __init__(self, numjobs, oneSubkeyClass, model, brange, maxtraces, numpoints):
+        self.brange = list(brange)
+        self.maxtraces = maxtraces
+        self.numpoints = numpoints
+
+        self._shared = multiprocessing.RawArray('d', maxtraces * numpoints)
+        self._traces = np.frombuffer(self._shared, dtype=np.float64)
+
+        numjobs = max(1, min(numjobs, len(self.brange)))
+        modeldesc = modelDescription(model)
+        self._owner = {}
+        self._workers = []
+        for job in range(numjobs):
+            bnums = self.brange[job::numjobs]
+            conn, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_subkeyWorker, args=(child, self._shared, oneSubkeyClass, modeldesc, bnums))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self._workers.append((proc, conn))
+            for bnum in bnums:
+                self._owner[bnum] = conn
+
+        logging.debug('Started %d attack worker processes for subkeys %s' % (numjobs, str(self.brange)))
+
+    def processBlock(self, traces, textins, textouts, knownkeys, pointRanges):
+        """
+        Run one block of traces through every subkey.
+
+        Yields (bnum, diffs) in brange order, as soon as each result is ready. The whole generator must be consumed
+        (or the pool closed) before the next block is sent.
+        """
+        numtraces, numpoints = np.shape(traces)
+        if numtraces > self.maxtraces or numpoints != self.numpoints:
+            raise ValueError("Block of %dx%d traces does not fit attack pool (%dx%d)" % (numtraces, numpoints, self.maxtraces, self.numpoints))
+
+        self._traces[:numtraces * numpoints] = np.ravel(traces)
+
+        for proc, conn in self._workers:
+            conn.send(((numtraces, numpoints), textins, textouts, knownkeys, pointRanges))
+
+        for bnum in self.brange:
+            rbnum, data, err = self._owner[bnum].recv()
+            if err is not None:
+                raise RuntimeError("Attack on subkey %d failed in worker process:\n%s" % (rbnum, err))
+            yield (rbnum, data)
+
+    def close(self):
+        """Stop all worker processes"""
+        for proc, conn in self._workers:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+
+        for proc, conn in self._workers:
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+
+        self._workers = []
+        self._owner = {}
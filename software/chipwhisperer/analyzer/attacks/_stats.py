@@ -28,12 +28,108 @@
 import numpy as np
 
 
+class HistoryBuffer(object):
+    """
+    Table of records (one NumPy structured array row each) appended one at a time.
+
+    The rows live in a preallocated array which is doubled in size when full, so appending is amortized O(1) and the
+    whole history can be read back as one array (with a field per column) without any copy.
+
+    If maxRows is given the table never grows past it. Every distinct value of the key field (or every row, without
+    a key) gets a sequence number in order of appearance, and when the table is full only the values whose number is
+    a multiple of a stride are kept, along with the latest one. The stride is doubled as often as needed to free half
+    of the table, so the history keeps covering its whole range at a regular (if coarser) step.
+    """
+
+    def __init__(self, dtype, capacity=64, maxRows=None, key=None):
+        if maxRows is not None:
+            capacity = min(capacity, maxRows)
+        self._rows = np.zeros(max(1, capacity), dtype=dtype)
+        self._len = 0
+        self.maxRows = maxRows
+        self.key = key
+        self._seq = np.zeros(len(self._rows), dtype=np.int64)
+        self._seqOfKey = {}
+        self._nextSeq = 0
+        self._stride = 1
+
+    def __len__(self):
+        return self._len
+
+    def append(self, *fields):
+        if self.maxRows is not None and self._len >= self.maxRows:
+            self.downsample()
+        if self._len >= len(self._rows):
+            size = 2 * len(self._rows)
+            if self.maxRows is not None:
+                size = min(size, self.maxRows)
+            rows = np.zeros(size, dtype=self._rows.dtype)
+            rows[:self._len] = self._rows
+            self._rows = rows
+            seq = np.zeros(size, dtype=np.int64)
+            seq[:self._len] = self._seq[:self._len]
+            self._seq = seq
+        self._rows[self._len] = fields
+        if self.maxRows is not None:
+            self._seq[self._len] = self._sequence(self._rows[self._len])
+        self._len += 1
+
+    def _sequence(self, row):
+        if self.key is None:
+            self._nextSeq += 1
+            return self._nextSeq - 1
+        k = row[self.key].item()
+        if k not in self._seqOfKey:
+            self._seqOfKey[k] = self._nextSeq
+            self._nextSeq += 1
+        return self._seqOfKey[k]
+
+    def downsample(self):
+        """Thin out the table to at most half of maxRows, doubling the stride as needed"""
+        seq = self._seq[:self._len]
+        keep = (seq % self._stride == 0) | (seq == self._nextSeq - 1)
+        while np.count_nonzero(keep) > self.maxRows // 2 and self._stride < self._nextSeq:
+            self._stride *= 2
+            keep = (seq % self._stride == 0) | (seq == self._nextSeq - 1)
+        if keep.all():
+            # All rows have the same key, thin the rows themselves
+            keep[1:-1:2] = False
+
+        n = np.count_nonzero(keep)
+        self._rows[:n] = self._rows[:self._len][keep]
+        self._seq[:n] = seq[keep]
+        self._len = n
+        if self.key is not None:
+            kept = set(self._rows[self.key][:n].tolist())
+            self._seqOfKey = dict((k, v) for k, v in self._seqOfKey.items() if k in kept)
+
+    def data(self):
+        """All rows appended so far (a view)"""
+        return self._rows[:self._len]
+
+    def last(self):
+        """The last row appended, or None"""
+        if self._len == 0:
+            return None
+        return self._rows[self._len - 1]
+
+    def clear(self):
+        self._len = 0
+        self._seqOfKey = {}
+        self._nextSeq = 0
+        self._stride = 1
+
+
 class DataTypeDiffs(object):
     """
     Data type used for attacks generating peaks indicating the 'best' success. Examples include
     standard DPA & CPA attacks.
     """
 
+    #Size limits of the histories (rows), older entries are downsampled past these
+    maxPGEHistory = 1 << 16
+    maxMaxesHistory = 2048
+
     def __init__(self, numSubkeys=16, numPerms=256):
         self.numSubkeys = numSubkeys
         self.numPerms = numPerms
@@ -53,11 +149,41 @@ class DataTypeDiffs(object):
         self.maxValid = [False]*self.numSubkeys
         self.pge = [255]*self.numSubkeys
         self.diffs_tnum = [None]*self.numSubkeys
-        self.pge_total = []
-        self.maxes_list = [list() for i in range(0, self.numSubkeys)]
+
+        #PGE of every subkey each time its maximums were found: columns trace, subkey, pge
+        self.pgeHistory = HistoryBuffer([('trace', 'i8'), ('subkey', 'i4'), ('pge', 'i4')],
+                                        maxRows=self.maxPGEHistory, key='trace')
+
+        #Maximum value of every hypothesis (indexed by hypothesis, not rank) each time the maximums were found
+        self.maxesHistory = [HistoryBuffer([('trace', 'i8'), ('value', 'f8', (self.numPerms,))],
+                                           maxRows=self.maxMaxesHistory, key='trace')
+                             for i in range(0, self.numSubkeys)]
 
         #TODO: Ensure this gets called by attack algorithms when rerunning
 
+    @property
+    def pge_total(self):
+        """pgeHistory as the list of {'trace', 'subkey', 'pge'} dicts it replaced (read-only, kept for old scripts)"""
+        return [{'trace':None if t < 0 else t, 'subkey':s, 'pge':p} for t, s, p in self.pgeHistory.data().tolist()]
+
+    @property
+    def maxes_list(self):
+        """
+        maxesHistory as the per-subkey lists of {'trace', 'maxes'} dicts it replaced (read-only, kept for old scripts).
+        The maxes are sorted like self.maxes, but their points aren't kept in the history and are all 0.
+        """
+        ret = []
+        for i in range(0, self.numSubkeys):
+            entries = []
+            for row in self.maxesHistory[i].data():
+                order = self._rankOrder(row['value'], None)
+                maxes = np.zeros(self.numPerms, dtype=self.maxes[i].dtype)
+                maxes['hyp'] = order
+                maxes['value'] = row['value'][order]
+                entries.append({'trace':None if row['trace'] < 0 else int(row['trace']), 'maxes':maxes})
+            ret.append(entries)
+        return ret
+
     def simplePGE(self, bnum):
         if self.maxValid[bnum] == False:
             #TODO: should sort
@@ -78,62 +204,96 @@ class DataTypeDiffs(object):
                 self.diffs[bnum] = data
                 self.diffs_tnum[bnum] = tnum
 
-    def findMaximums(self, bytelist=None, useAbsolute=True, useSingle=False):
+    @staticmethod
+    def _rowMaximums(diffs, useAbsolute):
+        """Return (point, value) of the maximum of every row of diffs, ignoring NaNs (value NaN if all are)"""
+        diffs = np.asarray(diffs, dtype=np.float64)
+        if useAbsolute:
+            diffs = np.fabs(diffs)
+        nans = np.isnan(diffs)
+        if nans.any():
+            diffs = np.where(nans, -np.inf, diffs)
+        points = np.argmax(diffs, axis=1)
+        values = diffs[np.arange(diffs.shape[0]), points]
+        if nans.any():
+            values[nans.all(axis=1)] = np.nan
+        return points, values
+
+    def _rankOrder(self, values, topk):
+        """Hypotheses sorted by decreasing value (NaNs last, ties by hypothesis), or only the first topk of them"""
+        key = np.where(np.isnan(values), np.inf, -values)
+        if topk is not None and topk < len(values):
+            part = np.argpartition(key, topk - 1)[:topk]
+            part = part[np.lexsort((part, key[part]))]
+            rest = np.setdiff1d(np.arange(len(values)), part, assume_unique=True)
+            return np.concatenate((part, rest))
+        return np.argsort(key, kind='mergesort')
+
+    def _rank(self, values, hyp):
+        """Rank of hypothesis hyp with the ordering of _rankOrder()"""
+        v = values[hyp]
+        if np.isnan(v):
+            return self.numPerms // 2
+        valid = ~np.isnan(values)
+        with np.errstate(invalid='ignore'):
+            return int(np.count_nonzero(valid & (values > v)) + np.count_nonzero(valid[:hyp] & (values[:hyp] == v)))
+
+    def findMaximums(self, bytelist=None, useAbsolute=True, useSingle=False, topk=None):
+        """
+        Find the maximum of every hypothesis of the subkeys in bytelist and rank them.
+
+        self.maxes[i] is left sorted by decreasing value (NaNs last). If topk is given only its first topk entries are
+        sorted, the others follow in no particular order; the PGE is found the same way in both cases.
+        """
         if bytelist is None:
             bytelist = range(0, self.numSubkeys)
 
-        # print useAbsolute
-
         for i in bytelist:
             if self.diffs[i] is None:
                 self.maxValid[i] = False
                 continue
 
-            if self.maxValid[i] == False:
-                for hyp in range(0, self.numPerms):
-                    if useAbsolute:
-                        v = np.nanmax(np.fabs(self.diffs[i][hyp]))
-                    else:
-                        v = np.nanmax(self.diffs[i][hyp])
-
-                    mvalue = v
-
-                    #Get maximum value for this hypothesis
-                    try:
-                        mindex = np.amin(np.where(v == mvalue))
-                    except ValueError:
-                        mindex = self.numPerms-1
-                    self.maxes[i][hyp]['hyp'] = hyp
-                    self.maxes[i][hyp]['point'] = mindex
-                    self.maxes[i][hyp]['value'] = mvalue
-
-                #TODO: why does this fail?
-                #self.maxes[i][np.isnan(self.maxes[i]['value'])]['value'] = 0
-                #TODO: workaround for PGE, as NaN's get ranked first
-                numnans = np.isnan(self.maxes[i]['value']).sum()
-
-                if useSingle:
-                    #All table values are taken from same point MAX is taken from
-                    where = self.maxes[i][0]['point']
-                    for j in range(0, self.numPerms):
-                        self.maxes[i][j]['point'] = where
-                        self.maxes[i][j]['value'] = self.diffs[i][self.maxes[i][j]['hyp']][where]
-
-                self.maxes[i][::-1].sort(order='value') # sorts nunpy array in place and in reverse order
-                self.maxValid[i] = True
-
-                if self.knownkey is not None:
-                    try:
-                        self.pge[i] = np.where(self.maxes[i]['hyp'] == self.knownkey[i])[0][0] - numnans
-                        if self.pge[i] < 0:
-                            self.pge[i] = self.numPerms/2
-                    except IndexError:
-                        self.pge[i] = self.numPerms-1
+            if self.maxValid[i]:
+                continue
+
+            diffs = np.asarray(self.diffs[i])
+            numhyps = diffs.shape[0]
+            points, values = self._rowMaximums(diffs, useAbsolute)
+
+            if useSingle:
+                #All table values are taken from same point MAX is taken from
+                valid = ~np.isnan(values)
+                if valid.any():
+                    where = points[np.flatnonzero(valid)[np.argmax(values[valid])]]
+                    points[:] = where
+                    values = diffs[:, where].astype(np.float64)
+
+            order = self._rankOrder(values, topk)
+            maxes = self.maxes[i][:numhyps]
+            maxes['hyp'] = order
+            maxes['point'] = points[order]
+            maxes['value'] = values[order]
+            self.maxValid[i] = True
+
+            if self.knownkey is not None:
+                try:
+                    hyp = self.knownkey[i]
+                except IndexError:
+                    hyp = None
+                if hyp is not None and 0 <= hyp < numhyps:
+                    self.pge[i] = self._rank(values, hyp)
+                else:
+                    self.pge[i] = self.numPerms-1
 
             tnum = self.diffs_tnum[i]
-            self.pge_total.append({'trace':tnum, 'subkey':i, 'pge':self.pge[i]})
-            
-            if len(self.maxes_list[i]) == 0 or self.maxes_list[i][-1]['trace'] != tnum:
-                self.maxes_list[i].append({'trace':tnum, 'maxes':np.array(self.maxes[i])})
+            if tnum is None:
+                tnum = -1
+            self.pgeHistory.append(tnum, i, self.pge[i])
+
+            last = self.maxesHistory[i].last()
+            if last is None or last['trace'] != tnum:
+                row = np.full(self.numPerms, np.nan)
+                row[:numhyps] = values
+                self.maxesHistory[i].append(tnum, row)
 
         return self.maxes
@@ -37,6 +37,7 @@ class AlgorithmsBase(Parameterized, AutoScript):
         self.sr = None
         self.stats = None
         self._project = None
+        self._parallelJobs = 1
 
     def setProject(self, proj):
         self._project = proj
@@ -56,6 +57,13 @@ class AlgorithmsBase(Parameterized, AutoScript):
     def setReportingInterval(self, ri):
         self._reportingInterval = ri
 
+    def setParallelJobs(self, jobs):
+        """Number of worker processes to spread the subkeys over (1 = run everything in this process)"""
+        self._parallelJobs = jobs
+
+    def getParallelJobs(self):
+        return self._parallelJobs
+
     def setModel(self, model):
         self.model = model
         if model:
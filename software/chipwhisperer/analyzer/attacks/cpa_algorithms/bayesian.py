@@ -27,180 +27,45 @@
 
 import numpy as np
 
-from ..algorithmsbase import AlgorithmsBase
+from .progressive import CPAProgressive
+from .progressive_batched import CPAProgressiveBatchedOneSubkey
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
 
-class AttackCPA_Bayesian(AlgorithmsBase):
+class BayesianOneSubkey(CPAProgressiveBatchedOneSubkey):
     """
-    Bayesian CPA. NOT WORKING!!
-    """
-    _name = "Bayesian CPA"
-
-    def __init__(self):
-        AlgorithmsBase.__init__(self)
-        self.updateScript()
-
-    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None, algo="log", tracesLoop=None):
-        keyround=self.keyround
-        modeltype=self.modeltype
-        brange=self.brange
-
-        # foundkey = []
-
-        self.all_diffs = range(0,16)
-
-        pbcnt = 0
-        if progressBar:
-            progressBar.setStatusMask("Byte %02d: Hyp=%02x")
-            progressBar.setMaximum(len(brange) * 256)
-
-        # Load all traces
-        data = []
-        textins = []
-        textouts = []
-        knownkeys = []
-        for i in range(tracerange[0], tracerange[1]):
-            # Handle Offset
-            tnum = i + tracerange[0]
-            try:
-                data.append(traceSource.getTrace(tnum))
-                textins.append(traceSource.getTextin(tnum))
-                textouts.append(traceSource.getTextout(tnum))
-                knownkeys.append(traceSource.getKnownKey(tnum))
-            except Exception, e:
-                progressBar.abort(e.message)
-                return
-
-        traces = np.array(data)
-        textins = np.array(textins)
-        textouts = np.array(textouts)
-
-        #For all bytes of key
-        for bnum in brange:
-            diffs = [0]*256
-
-            #For each 0..0xFF possible value of the key byte
-            for key in range(0, 256):
-                #Initialize arrays & variables to zero
-                sumstd = np.zeros(len(traces[0,:]), dtype=np.float64)
-                hyp = [0] * len(traces[:, 0])
-
-                #Generate hypotheticals
-                for tnum in range(len(traces[:,0])):
-
-                    if len(textins) > 0:
-                        pt = textins[tnum]
-
-                    if len(textouts) > 0:
-                        ct = textouts[tnum]
-
-                    if keyround == "first":
-                        ct = None
-                    elif keyround == "last":
-                        pt = None
-                    else:
-                        raise ValueError("keyround invalid")
-
-                    #Generate the output of the SBOX
-                    if modeltype == "Hamming Weight":
-                        hypint = self.model.HypHW(pt, ct, key, bnum)
-                    elif modeltype == "Hamming Distance":
-                        hypint = self.model.HypHD(pt, ct, key, bnum)
-                    else:
-                        raise ValueError("modeltype invalid")
+    Progressive Bayesian CPA on one subkey, for all key guesses at once.
 
-                    hyp[tnum] = hypint
+    For each guess the score is built from the sum over the traces of (hn - tn)^2, where hn and tn are the hypothesis
+    and the trace point scaled to zero mean and unit variance. Expanding the square, this sum is 2 * q * (1 - r) for
+    q traces, where r is the correlation of the hypothesis with the trace point - so it comes straight from the
+    running sums of the batched progressive CPA.
 
-                hyp = np.array(hyp)
-
-                #Mean & STD-DEV of hypothesis
-                meanh = np.mean(hyp, dtype=np.float64)
-                stddevh = np.std(hyp, dtype=np.float64)
-
-                #Mean & STD-DEV of all points in trace
-                meant = np.mean(traces, axis=0, dtype=np.float64)
-                stddevt = np.std(traces, axis=0, dtype=np.float64)
-
-                #For each trace, do the following
-                for tnum in range(len(traces[:,0])):
-                    #Make both zero-mean
-                    hdiff = np.float64(hyp[tnum]) - meanh
-                    tdiff = np.array((np.array(traces[tnum,:], dtype=np.float64) - meant), dtype=np.float64)
-
-                    #Scale by std-dev
-                    hdiff = hdiff / np.float64(stddevh)
-                    tdiff = tdiff / np.array(stddevt, dtype=np.float64)
-
-                    # Calculate error term
-                    error = (hdiff - tdiff)
-                    sumstd = sumstd + pow(error, 2)
-
-                q = len(traces[:,0])
-
-                if algo == "original":
-                    #Original Algorithm
-                    sumstd = pow(np.sqrt((sumstd/q)), -q)
-                elif algo == "log":
-                    #LOG Algorithm
-                    sumstd = -q * ( (0.5*np.log(sumstd)) - np.log(q))
-                else:
-                    raise RuntimeError("algo not defined")
-
-                diffs[key] = sumstd
-
-                if progressBar:
-                    progressBar.updateStatus(pbcnt, (bnum, key))
-                    if progressBar and progressBar.wasAborted():
-                        return
-                pbcnt = pbcnt + 1
-
-            #Gotten all stddevs - now process algorithm
-
-            #Original algorithm
-            if algo == "original":
-                sums = np.sum(diffs, axis=0, dtype=np.float64)
-                for key in range(0, 256):
-                    diffs[key] = diffs[key] / sums
+    The per-guess likelihoods sumstd^-q are normalized over the guesses, and the result is the probability of each
+    guess at each point. This is done in the log domain, as sumstd^-q overflows for more than a few traces.
+    """
 
-            elif algo == "log":
-            #Logarithm Algorithm
-                summation = np.zeros(len(traces[0,:]), dtype=np.float64)
-                for key in range(1, 256):
-                    diff = diffs[key] - diffs[0]
-                    summation = summation + np.exp(diff)
-                summation = summation + 1
-                summation = np.log(summation)
-                summation = summation + diffs[0]
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        (corr, pbcnt) = CPAProgressiveBatchedOneSubkey.oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts,
+                                                                 ciphertexts, knownkeys, progressBar, state, pbcnt)
+        q = float(self.totalTraces)
 
-                for key in range(0, 256):
-                    diffs[key] = diffs[key] - summation
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sumstd = 2 * q * np.maximum(1 - corr, 0)
+            loglike = -q * ((0.5 * np.log(sumstd)) - np.log(q))
 
-            else:
-                raise RuntimeError("algo not defined")
+            #Normalize over the guesses: log(sum(exp(loglike))), offset by the largest term so exp() can't overflow
+            top = np.max(loglike, axis=0)
+            lognorm = top + np.log(np.sum(np.exp(loglike - top), axis=0))
+            diffs = np.exp(loglike - lognorm)
 
-            self.all_diffs[bnum] = diffs
-        self.algo = algo
-            #From all the key candidates, select the largest difference as most likely
-            #foundbyte = diffs.index(max(diffs))
-            #foundkey.append(foundbyte)
-#            print "%2x "%foundbyte,
+        return (diffs, pbcnt)
 
-    def _getResult(self, bnum, hyprange=None):
-        if hyprange == None:
-            hyprange = range(0,256)
-        return [self.all_diffs[bnum][i] for i in hyprange]
 
-    def getDiff(self, bnum, hyprange=None):
-        if self.algo == "original":
-            return self._getResult(bnum, hyprange)
-        elif self.algo == "log":
-            return np.exp(self._getResult(bnum, hyprange))
-        else:
-            raise RuntimeError("algo not defined")
+class AttackCPA_Bayesian(CPAProgressive, Plugin):
+    """
+    Bayesian CPA, done progressively: reports the probability of every key guess given the traces so far
+    """
+    _name = "Bayesian CPA"
 
-    def getStatistics(self):
-        t = [0]*16
-        for i in self.brange:
-            t[i] = self.getDiff(i)
-        return t
+    oneSubkeyClass = BayesianOneSubkey
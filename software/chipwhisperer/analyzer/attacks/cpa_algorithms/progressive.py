@@ -27,8 +27,10 @@
 
 import numpy as np
 import math
+import multiprocessing
 
 from ..algorithmsbase import AlgorithmsBase
+from .._parallel import SubkeyProcessPool
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
 
@@ -86,7 +88,7 @@ class CPAProgressiveOneSubkey(object):
                 if len(ciphertexts) > 0:
                     ct = ciphertexts[tnum]
 
-                if knownkeys and len(knownkeys) > 0:
+                if knownkeys is not None and len(knownkeys) > 0:
                     nk = knownkeys[tnum]
                 else:
                     nk = None
@@ -154,15 +156,28 @@ class CPAProgressive(AlgorithmsBase, Plugin):
     """
     _name = "Progressive"
 
+    #Per-subkey engine, subclasses can swap in a different implementation of the same interface
+    oneSubkeyClass = CPAProgressiveOneSubkey
+
     def __init__(self):
         AlgorithmsBase.__init__(self)
 
         self.getParams().addChildren([
             {'name':'Iteration Mode', 'key':'itmode', 'type':'list', 'values':{'Depth-First':'df', 'Breadth-First':'bf'}, 'value':'bf', 'action':self.updateScript},
             {'name':'Skip when PGE=0', 'key':'checkpge', 'type':'bool', 'value':False, 'action':self.updateScript},
+            {'name':'Parallel Jobs', 'key':'njobs', 'type':'int', 'limits':(1, multiprocessing.cpu_count()), 'value':1, 'action':self.updateScript,
+             'help':'Number of worker processes the attacked subkeys are spread over. 1 runs the attack in the analyzer process.\n\n'
+                    'Only used in Breadth-First mode, Depth-First always runs in the analyzer process.'},
         ])
         self.updateScript()
 
+    def updateScript(self, ignored=None):
+        njobs = self.findParam('njobs').getValue()
+        if njobs > 1:
+            self.addFunction("init", "setParallelJobs", "%d" % njobs)
+        else:
+            self.delFunction("init", "setParallelJobs")
+
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         numtraces = tracerange[1] - tracerange[0] + 1
         if progressBar:
@@ -173,7 +188,7 @@ class CPAProgressive(AlgorithmsBase, Plugin):
         pbcnt = 0
         cpa = [None]*(max(self.brange)+1)
         for bnum in self.brange:
-            cpa[bnum] = CPAProgressiveOneSubkey(self.model)
+            cpa[bnum] = self.oneSubkeyClass(self.model)
 
         brangeMap = [None]*(max(self.brange)+1)
         i = 1
@@ -194,67 +209,98 @@ class CPAProgressive(AlgorithmsBase, Plugin):
             brange_bf = [0]
             brange_df = self.brange
 
-        for bnum_df in brange_df:
-            tstart = 0
-            tend = self._reportingInterval
+        #In parallel mode the subkeys are spread over worker processes, which keep their own copy of the
+        #progressive state. Only breadth-first iteration is supported there.
+        pool = None
+        parallel = bf and (self.getParallelJobs() > 1) and (len(self.brange) > 1)
 
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
+        try:
+            for bnum_df in brange_df:
+                tstart = 0
+                tend = self._reportingInterval
 
-                if tstart > numtraces:
-                    tstart = numtraces
+                while tstart < numtraces:
+                    if tend > numtraces:
+                        tend = numtraces
 
-                data = []
-                textins = []
-                textouts = []
-                knownkeys = []
-                for i in range(tstart, tend):
-                    # Handle Offset
-                    tnum = i + tracerange[0]
+                    if tstart > numtraces:
+                        tstart = numtraces
 
+                    # Handle Offset
                     try:
-                        data.append(traceSource.getTrace(tnum))
-                        textins.append(traceSource.getTextin(tnum))
-                        textouts.append(traceSource.getTextout(tnum))
-                        knownkeys.append(traceSource.getKnownKey(tnum))
-                    except Exception, e:
-                        progressBar.abort(e.message)
+                        traces = traceSource.getTraces(tstart + tracerange[0], tend + tracerange[0])
+                        textins = traceSource.getTextins(tstart + tracerange[0], tend + tracerange[0])
+                        textouts = traceSource.getTextouts(tstart + tracerange[0], tend + tracerange[0])
+                        knownkeys = traceSource.getKnownKeys(tstart + tracerange[0], tend + tracerange[0])
+                    except Exception as e:
+                        if progressBar:
+                            progressBar.abort(str(e))
                         return
 
-                traces = np.array(data)
-                textins = np.array(textins)
-                textouts = np.array(textouts)
-                # knownkeys = np.array(knownkeys)
-
-                for bnum_bf in brange_bf:
-                    if bf:
-                        bnum = bnum_bf
-                    else:
-                        bnum = bnum_df
-
-                    skip = False
-                    if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
-                        if isinstance(pointRange, list):
-                            bptrange = pointRange[bnum]
-                        else:
-                            bptrange = pointRange
-                        (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum].modelstate, pbcnt)
-                        self.stats.updateSubkey(bnum, data, tnum=tend)
+                    # Drop traces rejected by the preprocessing
+                    valid = ~np.isnan(traces[:, 0])
+                    if not valid.all():
+                        traces, textins, textouts, knownkeys = traces[valid], textins[valid], textouts[valid], knownkeys[valid]
+
+                    if not valid.any():
+                        #Nothing left to add from this block, only move the progress on
+                        pbcnt = pbcnt + len(brange_bf) * self.model.getPermPerSubkey()
+                        if progressBar:
+                            progressBar.updateStatus(pbcnt, (tstart + tracerange[0], tend + tracerange[0] - 1, brange_bf[-1] if bf else bnum_df))
+                            if progressBar.wasAborted():
+                                return
+                    elif parallel:
+                        if pool is None:
+                            pool = SubkeyProcessPool(self.getParallelJobs(), self.oneSubkeyClass, self.model, self.brange,
+                                                     self._reportingInterval, np.shape(traces)[1])
+
+                        bptranges = {}
+                        for bnum in self.brange:
+                            if isinstance(pointRange, list):
+                                bptranges[bnum] = pointRange[bnum]
+                            else:
+                                bptranges[bnum] = pointRange
+
+                        for (bnum, data) in pool.processBlock(traces, textins, textouts, knownkeys, bptranges):
+                            self.stats.updateSubkey(bnum, data, tnum=tend)
+
+                            pbcnt = pbcnt + self.model.getPermPerSubkey()
+                            if progressBar:
+                                progressBar.updateStatus(pbcnt, (tstart + tracerange[0], tend + tracerange[0] - 1, bnum))
+                                if progressBar.wasAborted():
+                                    return
                     else:
-                        skip = True
-
-                    if skip:
-                        pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
-
-                        if bf is False:
-                            tstart = numtraces
-
-                    if progressBar and progressBar.wasAborted():
-                        return
-
-                tend += self._reportingInterval
-                tstart += self._reportingInterval
-
-                if self.sr:
-                    self.sr()
+                        for bnum_bf in brange_bf:
+                            if bf:
+                                bnum = bnum_bf
+                            else:
+                                bnum = bnum_df
+
+                            skip = False
+                            if (self.stats.simplePGE(bnum) != 0) or (skipPGE == False):
+                                if isinstance(pointRange, list):
+                                    bptrange = pointRange[bnum]
+                                else:
+                                    bptrange = pointRange
+                                (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, traces, len(traces), textins, textouts, knownkeys, progressBar, cpa[bnum].modelstate, pbcnt)
+                                self.stats.updateSubkey(bnum, data, tnum=tend)
+                            else:
+                                skip = True
+
+                            if skip:
+                                pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+
+                                if bf is False:
+                                    tstart = numtraces
+
+                            if progressBar and progressBar.wasAborted():
+                                return
+
+                    tend += self._reportingInterval
+                    tstart += self._reportingInterval
+
+                    if self.sr:
+                        self.sr()
+        finally:
+            if pool is not None:
+                pool.close()
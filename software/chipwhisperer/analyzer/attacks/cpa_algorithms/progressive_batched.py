@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2016, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import numpy as np
+
+from .progressive import CPAProgressive
+from chipwhisperer.common.utils.pluginmanager import Plugin
+
+
+class CPAProgressiveBatchedOneSubkey(object):
+    """
+    Progressive CPA on one subkey, processing all key guesses at once.
+
+    Keeps the same running sums as CPAProgressiveOneSubkey, but stores the per-guess sums as arrays
+    (sumh, sumhq are numguesses long, sumht is numguesses x numpoints) so a block of traces is added
+    with one hypothesis matrix and one matrix multiply.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.clearStats()
+        self.modelstate = {'knownkey':None}
+
+    def clearStats(self):
+        self.sumhq = None
+        self.sumtq = None
+        self.sumt = None
+        self.sumh = None
+        self.sumht = None
+        self.totalTraces = 0
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        numguesses = self.model.getPermPerSubkey()
+        self.totalTraces += numtraces
+
+        if pointRange == None:
+            traces = traces_all
+        else:
+            traces = traces_all[:, pointRange[0] : pointRange[1]]
+
+        if self.sumht is None:
+            npoints = traces.shape[1]
+            self.sumhq = np.zeros(numguesses, dtype=np.float64)
+            self.sumh = np.zeros(numguesses, dtype=np.float64)
+            self.sumht = np.zeros((numguesses, npoints), dtype=np.float64)
+            self.sumtq = np.zeros(npoints, dtype=np.float64)
+            self.sumt = np.zeros(npoints, dtype=np.float64)
+
+        #Formula for CPA & description found in "Power Analysis Attacks"
+        # by Mangard et al, page 124, formula 6.2, in the progressive form used by CPAProgressiveOneSubkey
+        hyp = self.model.leakageBatch(plaintexts, ciphertexts, bnum, knownkeys).astype(np.float64)
+
+        self.sumt += np.sum(traces, axis=0, dtype=np.float64)
+        self.sumtq += np.sum(np.square(traces), axis=0, dtype=np.float64)
+        self.sumh += np.sum(hyp, axis=0)
+        self.sumhq += np.sum(np.square(hyp), axis=0)
+        self.sumht += np.dot(hyp.T, traces)
+
+        sumnum = self.totalTraces * self.sumht - np.outer(self.sumh, self.sumt)
+        sumden1 = np.square(self.sumh) - self.totalTraces * self.sumhq
+        sumden2 = np.square(self.sumt) - self.totalTraces * self.sumtq
+        diffs = sumnum / np.sqrt(np.outer(sumden1, sumden2))
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + numguesses
+
+        return (diffs, pbcnt)
+
+
+class CPAProgressiveBatched(CPAProgressive, Plugin):
+    """
+    Progressive CPA attack computing the correlation of all key guesses with a single matrix multiply per block
+    """
+    _name = "Progressive-Batched"
+
+    oneSubkeyClass = CPAProgressiveBatchedOneSubkey
@@ -82,7 +82,7 @@ class CPASimpleLoop(AlgorithmsBase, Plugin):
                 else:
                     ct = []
 
-                if knownkeys and len(knownkeys) > 0:
+                if knownkeys is not None and len(knownkeys) > 0:
                     nk = knownkeys[tnum]
                 else:
                     nk = None
@@ -133,27 +133,16 @@ class CPASimpleLoop(AlgorithmsBase, Plugin):
             progressBar.setText("Attacking traces: from %d to %d (total = %d)" % (tracerange[0], tracerange[1], numtraces))
             progressBar.setMaximum(len(brange) * self.model.getPermPerSubkey())
 
-        # Load all traces
-        data = []
-        textins = []
-        textouts = []
-        knownkeys = []
-        for i in range(tracerange[0], tracerange[1]+1):
-            # Handle Offset
-            tnum = i + tracerange[0]
-
-            d = traceSource.getTrace(tnum)
-            if d is None:
-                continue
-
-            data.append(d)
-            textins.append(traceSource.getTextin(tnum))
-            textouts.append(traceSource.getTextout(tnum))
-            knownkeys.append(traceSource.getKnownKey(tnum))
-
-        traces = np.array(data)
-        textins = np.array(textins)
-        textouts = np.array(textouts)
+        # Load all traces, skipping the ones rejected by the preprocessing
+        traces = traceSource.getTraces(tracerange[0], tracerange[1] + 1)
+        textins = traceSource.getTextins(tracerange[0], tracerange[1] + 1)
+        textouts = traceSource.getTextouts(tracerange[0], tracerange[1] + 1)
+        knownkeys = traceSource.getKnownKeys(tracerange[0], tracerange[1] + 1)
+
+        valid = ~np.isnan(traces[:, 0])
+        if not valid.all():
+            traces, textins, textouts, knownkeys = traces[valid], textins[valid], textouts[valid], knownkeys[valid]
+        numtraces = len(traces)
 
         pbcnt = 0
         for bnum in brange:
@@ -26,13 +26,41 @@
 
 from collections import OrderedDict
 import inspect
+import numpy as np
 
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox, subbytes, inv_subbytes, mixcolumns, inv_mixcolumns, shiftrows, inv_shiftrows
+from chipwhisperer.analyzer.attacks.models.aes.funcs import _gal2
 
-from base import ModelsBase
+from base import ModelsBase, byteMatrix
 from chipwhisperer.analyzer.attacks.models.aes.key_schedule import keyScheduleRounds
 from chipwhisperer.common.utils.pluginmanager import Plugin
 
+#Lookup tables used by the batched (NumPy) leakage functions
+_SBOX = np.array([sbox(i) for i in range(256)], dtype=np.uint8)
+_INV_SBOX = np.array([inv_sbox(i) for i in range(256)], dtype=np.uint8)
+_XTIME = np.array(_gal2, dtype=np.uint8)
+_SHIFTROWS = np.array(shiftrows(list(range(16))))
+_GUESSES = np.arange(256, dtype=np.uint8)
+
+
+def _batch_mixcolumns(state):
+    """mixcolumns() on the last axis of a uint8 array of states"""
+    cols = state.reshape(state.shape[:-1] + (4, 4))
+    allxor = np.bitwise_xor.reduce(cols, axis=-1)[..., np.newaxis]
+    out = cols ^ allxor ^ _XTIME[cols ^ np.roll(cols, -1, axis=-1)]
+    return out.reshape(state.shape)
+
+
+def _batch_round1key(key):
+    """Round-1 key of the AES-128 key schedule, on the last axis of a uint8 array of keys"""
+    rk = np.empty_like(key)
+    temp = _SBOX[key[..., [13, 14, 15, 12]]]
+    temp[..., 0] ^= 0x01
+    for i in range(0, 16, 4):
+        temp = key[..., i:i+4] ^ temp
+        rk[..., i:i+4] = temp
+    return rk
+
 class AESLeakageHelper(object):
 
     #Name of AES Model
@@ -106,11 +134,55 @@ class AESLeakageHelper(object):
         """
         raise NotImplementedError("ASKLeakageHelper does not implement leakage")
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        """
+        Batched version of leakage(), returning the intermediate value for every trace and every guess of byte bnum.
+
+        Args:
+            pt: (N x 16) uint8 array of plain-text inputs, or None
+            ct: (N x 16) uint8 array of cipher-text outputs, or None
+            key: (N x 16) uint8 array of known keys, or None. Byte 'bnum' is replaced by the guess.
+            bnum: Byte number we are trying to attack.
+
+        Returns:
+            (N x 256) uint8 array of intermediate values. This version loops over leakage() and is
+            the reference that the table-based overrides must match.
+        """
+        numtraces = len(pt) if pt is not None else len(ct)
+        out = np.zeros((numtraces, 256), dtype=np.uint8)
+        for tnum in range(numtraces):
+            tkey = list(key[tnum]) if key is not None else [None]*16
+            tpt = list(pt[tnum]) if pt is not None else None
+            tct = list(ct[tnum]) if ct is not None else None
+            for guess in range(0, 256):
+                tkey[bnum] = guess
+                out[tnum, guess] = self.leakage(tpt, tct, tkey, bnum)
+        return out
+
+    def guessedState(self, pt, key, bnum):
+        """Helper function: (N x 256 x 16) array of pt ^ key, with byte bnum of the key set to each guess"""
+        if key is None:
+            raise ValueError("%s requires known key" % self.name)
+        state = np.repeat((pt ^ key)[:, np.newaxis, :], 256, axis=1)
+        state[:, :, bnum] = pt[:, bnum, np.newaxis] ^ _GUESSES
+        return state
+
+    def guessedKey(self, key, bnum):
+        """Helper function: (N x 256 x 16) array of key, with byte bnum set to each guess"""
+        if key is None:
+            raise ValueError("%s requires known key" % self.name)
+        guessed = np.repeat(key[:, np.newaxis, :], 256, axis=1)
+        guessed[:, :, bnum] = _GUESSES
+        return guessed
+
 class PtKey_XOR(AESLeakageHelper):
     name = 'HW: AddRoundKey Output, First Round (Enc)'
     def leakage(self, pt, ct, key, bnum):
         return pt[bnum] ^ key[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return pt[:, bnum, np.newaxis] ^ _GUESSES
+
 class SBox_output(AESLeakageHelper):
     name = 'HW: AES SBox Output, First Round (Enc)'
     c_model_enum_value = 1
@@ -118,6 +190,9 @@ class SBox_output(AESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return self.sbox(pt[bnum] ^ key[bnum])
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return _SBOX[pt[:, bnum, np.newaxis] ^ _GUESSES]
+
 class InvSBox_output(AESLeakageHelper):
     name = 'HW: AES Inv SBox Output, First Round (Dec)'
     c_model_enum_value = 6
@@ -125,6 +200,9 @@ class InvSBox_output(AESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return self.inv_sbox(pt[bnum] ^ key[bnum])
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return _INV_SBOX[pt[:, bnum, np.newaxis] ^ _GUESSES]
+
 class LastroundStateDiff(AESLeakageHelper):
     name = 'HD: AES Last-Round State'
     c_model_enum_value = 2
@@ -136,6 +214,11 @@ class LastroundStateDiff(AESLeakageHelper):
         st9 = inv_sbox(ct[bnum] ^ key[bnum])
         return (st9 ^ st10)
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        st10 = ct[:, self.INVSHIFT_undo[bnum], np.newaxis]
+        st9 = _INV_SBOX[ct[:, bnum, np.newaxis] ^ _GUESSES]
+        return st9 ^ st10
+
     def processKnownKey(self, inpkey):
         return keyScheduleRounds(inpkey, 0, 10)
 
@@ -148,6 +231,10 @@ class SBoxInOutDiff(AESLeakageHelper):
         st2 = self.sbox(st1)
         return st1 ^ st2
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        st1 = pt[:, bnum, np.newaxis] ^ _GUESSES
+        return st1 ^ _SBOX[st1]
+
 class SBoxInputSuccessive(AESLeakageHelper):
     name = 'HD: AES SBox Input i to i+1'
     c_model_enum_name = 4
@@ -163,6 +250,16 @@ class SBoxInputSuccessive(AESLeakageHelper):
             st2 = 0
         return st1 ^ st2
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        st1 = pt[:, bnum, np.newaxis] ^ _GUESSES
+        if bnum > 0:
+            if key is None:
+                raise ValueError("Successive requires known key")
+            st2 = pt[:, bnum - 1, np.newaxis] ^ key[:, bnum - 1, np.newaxis]
+        else:
+            st2 = 0
+        return st1 ^ st2
+
 class SBoxOutputSuccessive(AESLeakageHelper):
     name = 'HD: AES SBox Output i to i+1'
     c_model_enum_value = 5
@@ -178,11 +275,24 @@ class SBoxOutputSuccessive(AESLeakageHelper):
             st2 = 0
         return st1 ^ st2
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        st1 = _SBOX[pt[:, bnum, np.newaxis] ^ _GUESSES]
+        if bnum > 0:
+            if key is None:
+                raise ValueError("Successive requires known key")
+            st2 = _SBOX[pt[:, bnum - 1, np.newaxis] ^ key[:, bnum - 1, np.newaxis]]
+        else:
+            st2 = 0
+        return st1 ^ st2
+
 class AfterKeyMixin(AESLeakageHelper):
     name = 'HW: AES After Key/PT Addition'
     def leakage(self, pt, ct, key, bnum):
         return pt[bnum] ^ key[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return pt[:, bnum, np.newaxis] ^ _GUESSES
+
 class Mixcolumns_output(AESLeakageHelper):
     name = 'HW: AES Mixcolumns Output'
     #This is mostly a nonsense leakage model for now, but added for completeness
@@ -193,6 +303,12 @@ class Mixcolumns_output(AESLeakageHelper):
         state = self.mixcolumns(state)
         return state[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        state = self.guessedState(pt, key, bnum)
+        state = _SBOX[state][..., _SHIFTROWS]
+        state = _batch_mixcolumns(state)
+        return state[:, :, bnum]
+
 class Round1Round2StateDiff_Text(AESLeakageHelper):
     name = 'HD: AES Round1/Round2 State diff for text'
     def leakage(self, pt, ct, key, bnum):
@@ -203,6 +319,12 @@ class Round1Round2StateDiff_Text(AESLeakageHelper):
         state = self.mixcolumns(state)
         return state[bnum] ^ state1[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        state = self.guessedState(pt, key, bnum)
+        state = _SBOX[state][..., _SHIFTROWS]
+        state = _batch_mixcolumns(state)
+        return state[:, :, bnum] ^ pt[:, bnum, np.newaxis]
+
 class Round1Round2StateDiff_KeyMix(AESLeakageHelper):
     name = 'HD: AES Round1/Round2 State diff for key addition'
     def leakage(self, pt, ct, key, bnum):
@@ -217,6 +339,16 @@ class Round1Round2StateDiff_KeyMix(AESLeakageHelper):
 
         return state[bnum] ^ state1[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        state1 = self.guessedState(pt, key, bnum)
+        state = _SBOX[state1][..., _SHIFTROWS]
+        state = _batch_mixcolumns(state)
+
+        key2 = _batch_round1key(self.guessedKey(key, bnum))
+        state ^= key2
+
+        return state[:, :, bnum] ^ state1[:, :, bnum]
+
 class Round1Round2StateDiff_SBox(AESLeakageHelper):
     name = 'HD: AES Round1/Round2 State diff for SBox'
     def leakage(self, pt, ct, key, bnum):
@@ -231,6 +363,14 @@ class Round1Round2StateDiff_SBox(AESLeakageHelper):
         state = subbytes(state)
         return state[bnum] ^ state1[bnum]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        state1 = _SBOX[self.guessedState(pt, key, bnum)]
+        state = _batch_mixcolumns(state1[..., _SHIFTROWS])
+
+        key2 = _batch_round1key(self.guessedKey(key, bnum))
+        state = _SBOX[state ^ key2]
+        return state[:, :, bnum] ^ state1[:, :, bnum]
+
 #List of all classes you can use
 enc_list = [SBox_output, PtKey_XOR, SBoxInputSuccessive, SBoxInOutDiff, LastroundStateDiff, SBoxOutputSuccessive, Mixcolumns_output, Round1Round2StateDiff_Text, Round1Round2StateDiff_KeyMix, Round1Round2StateDiff_SBox]
 dec_list = [InvSBox_output]
@@ -295,5 +435,11 @@ class AES128_8bit(ModelsBase, Plugin):
         #Return HW of guess
         return self.HW[intermediate_value]
 
+    def leakageBatch(self, textins, textouts, bnum, knownkeys=None):
+        #Same as leakage(), but for all traces & guesses at once using the model's table-based version
+        intermediate_values = self.modelobj.leakageBatch(byteMatrix(textins), byteMatrix(textouts), byteMatrix(knownkeys), bnum)
+        intermediate_values = np.uint8(self._mask) & intermediate_values
+        return self.HWArray[intermediate_values]
+
     def keyScheduleRounds(self, inputkey, inputround, desiredround):
         return keyScheduleRounds(inputkey, inputround, desiredround)
\ No newline at end of file
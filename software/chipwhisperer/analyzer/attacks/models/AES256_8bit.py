@@ -24,9 +24,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
-from base import ModelsBase
+import numpy as np
+
+from base import ModelsBase, byteMatrix
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox
 
+#Lookup tables used by the batched (NumPy) hypothesis functions
+_SBOX = np.array([sbox(i) for i in range(256)], dtype=np.uint8)
+_INV_SBOX = np.array([inv_sbox(i) for i in range(256)], dtype=np.uint8)
+_GUESSES = np.arange(256, dtype=np.uint8)
+
 
 class AES(object):
 
@@ -206,19 +213,41 @@ class AES256_8bit(ModelsBase):
         if pt != None:
             return self.HW[sbox(pt[bnum] ^ key)]
         elif ct != None:
-            knownkey = [0xae, 0x83, 0xc1, 0xa5, 0x6b, 0xcb, 0xc6, 0x46, 0x55, 0xa3, 0xbf, 0x8d, 0x58, 0xfa, 0x20, 0x6d]
-            a = AES()
-            xored = [knownkey[i] ^ ct[i] for i in range(0, 16)]
-            block = a.mapin(xored)
-            block = a.shiftRows(block, True)
-            block = a.subBytes(block, True)
-            block = a.mixColumns(block, True)
-            block = a.shiftRows(block, True)
-            result = a.mapout(block)
+            result = self.undoLastRound(ct)
             return self.HW[inv_sbox((result[bnum] ^ key))]
         else:
             raise ValueError("Must specify PT or CT")
 
+    def undoLastRound(self, ct):
+        """Undo the last round of the cipher with the known last round-key, returning the state before it"""
+        knownkey = [0xae, 0x83, 0xc1, 0xa5, 0x6b, 0xcb, 0xc6, 0x46, 0x55, 0xa3, 0xbf, 0x8d, 0x58, 0xfa, 0x20, 0x6d]
+        a = AES()
+        xored = [knownkey[i] ^ ct[i] for i in range(0, 16)]
+        block = a.mapin(xored)
+        block = a.shiftRows(block, True)
+        block = a.subBytes(block, True)
+        block = a.mixColumns(block, True)
+        block = a.shiftRows(block, True)
+        return a.mapout(block)
+
+    def HypHWBatch(self, pt, ct, bnum):
+        """Batched HypHW(): (N x 256) hypothetical hamming weights for every guess, given (N x 16) pt or ct arrays (not both)"""
+        if pt is not None:
+            return self.HWArray[_SBOX[pt[:, bnum, np.newaxis] ^ _GUESSES]]
+        elif ct is not None:
+            #The inverse round does not depend on the guess, so it is only done once per trace
+            result = np.array([self.undoLastRound([int(t) for t in c])[bnum] for c in ct], dtype=np.uint8)
+            return self.HWArray[_INV_SBOX[result[:, np.newaxis] ^ _GUESSES]]
+        else:
+            raise ValueError("Must specify PT or CT")
+
+    def leakageBatch(self, textins, textouts, bnum, knownkeys=None):
+        """Hypothetical hamming weights (N x 256) of HypHW(), from the plaintexts if there are any, else the ciphertexts"""
+        textins = byteMatrix(textins)
+        if textins is not None:
+            return self.HypHWBatch(textins, None, bnum)
+        return self.HypHWBatch(None, byteMatrix(textouts), bnum)
+
     def HypHWXtime(self, pt, keyguess, numguess, keyknown, bnumknown):
         """Given plaintext + a subkey guess + a known subkey + subkey numbers return xtime result"""
         a = sbox(pt[numguess] ^ keyguess)
@@ -240,3 +269,16 @@ class AES256_8bit(ModelsBase):
             return self.HW[st9 ^ st10]
         else:
             raise ValueError("Must specify PT or CT")
+
+    def HypHDBatch(self, pt, ct, bnum):
+        """Batched HypHD(): (N x 256) hypothetical hamming distances for every guess, given (N x 16) pt or ct arrays (not both)"""
+        if pt is not None:
+            st1 = pt[:, bnum, np.newaxis]
+            st2 = _SBOX[st1 ^ _GUESSES]
+            return self.HWArray[st1 ^ st2]
+        elif ct is not None:
+            st10 = ct[:, self.INVSHIFT[bnum], np.newaxis]
+            st9 = ct[:, bnum, np.newaxis] ^ _GUESSES
+            return self.HWArray[st9 ^ st10]
+        else:
+            raise ValueError("Must specify PT or CT")
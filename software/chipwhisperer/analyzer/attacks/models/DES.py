@@ -15,7 +15,7 @@
 #=================================================
 from collections import OrderedDict
 import inspect
-from base import ModelsBase
+from base import ModelsBase, byteMatrix
 import numpy as np
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.common.utils.util import binarylist2bytearray, bytearray2binarylist
@@ -216,6 +216,23 @@ class DESLeakageHelper(object):
         # Find the permutation value
         return self.sBox[bnum][(m << 4) + n]
 
+    def sbox_in_first_fbox_batch(self, pt, bnum):
+        """(N x 64) array of first-round SBox bnum inputs for every guess, pt is an (N x 8) uint8 array"""
+        bits = np.unpackbits(pt, axis=1)
+        # Position in the plaintext of each of the 6 bits of expanded R going into SBox bnum
+        positions = [self.__ip[32 + v] for v in self.__expansion_table[bnum*6:(1+bnum)*6]]
+        expR = np.zeros(len(pt), dtype=np.uint8)
+        for pos in positions:
+            expR = (expR << 1) | bits[:, pos]
+        return expR[:, np.newaxis] ^ np.arange(64, dtype=np.uint8)
+
+    def sbox_out_table(self, bnum):
+        """SBox bnum as a 64-entry NumPy table indexed directly by the 6-bit SBox input"""
+        B = np.arange(64)
+        m = ((B >> 5) << 1) + (B & 1)
+        n = (B >> 1) & 0x0F
+        return np.array(self.sBox[bnum], dtype=np.uint8)[(m << 4) + n]
+
     def leakage(self, pt, ct, key, bnum):
         """
         Override this function with specific leakage function (S-Box output, HD, etc).
@@ -231,6 +248,31 @@ class DESLeakageHelper(object):
         """
         raise NotImplementedError("ASKLeakageHelper does not implement leakage")
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        """
+        Batched version of leakage(), returning the intermediate value for every trace and every guess of subkey bnum.
+
+        Args:
+            pt: (N x 8) uint8 array of plain-text inputs, or None
+            ct: (N x 8) uint8 array of cipher-text outputs, or None
+            key: (N x 8) uint8 array of known subkeys, or None. Subkey 'bnum' is replaced by the guess.
+            bnum: Subkey number we are trying to attack.
+
+        Returns:
+            (N x 64) uint8 array of intermediate values. This version loops over leakage() and is
+            the reference that the table-based overrides must match.
+        """
+        numtraces = len(pt) if pt is not None else len(ct)
+        out = np.zeros((numtraces, 64), dtype=np.uint8)
+        for tnum in range(numtraces):
+            tkey = list(key[tnum]) if key is not None else [None]*8
+            tpt = list(pt[tnum]) if pt is not None else None
+            tct = list(ct[tnum]) if ct is not None else None
+            for guess in range(0, 64):
+                tkey[bnum] = guess
+                out[tnum, guess] = self.leakage(tpt, tct, tkey, bnum)
+        return out
+
 class SBox_output(DESLeakageHelper):
     name = 'HW: SBoxes Output, First Round'
     c_model_enum_value = 0
@@ -238,6 +280,9 @@ class SBox_output(DESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return self.sbox_out_first_fbox(pt, key[bnum], bnum)
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return self.sbox_out_table(bnum)[self.sbox_in_first_fbox_batch(pt, bnum)]
+
 class SBox_input(DESLeakageHelper):
     name = 'HW: SBoxes Input, First Round'
     c_model_enum_value = 1
@@ -245,6 +290,9 @@ class SBox_input(DESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return binarylist2bytearray(self.sbox_in_first_fbox(pt, key[bnum], bnum), 6)[0]
 
+    def leakageBatch(self, pt, ct, key, bnum):
+        return self.sbox_in_first_fbox_batch(pt, bnum)
+
 enc_list = [SBox_output, SBox_input]
 dec_list = []
 
@@ -306,6 +354,12 @@ class DES(ModelsBase, Plugin):
         # Return HW of guess
         return self.HW[intermediate_value]
 
+    def leakageBatch(self, textins, textouts, bnum, knownkeys=None):
+        # Same as leakage(), but for all traces & guesses at once using the model's table-based version
+        intermediate_values = self.modelobj.leakageBatch(byteMatrix(textins), byteMatrix(textouts), byteMatrix(knownkeys), bnum)
+        intermediate_values = np.uint8(self._mask) & intermediate_values
+        return self.HWArray[intermediate_values]
+
     def compare(self, correctKey, guessedKey):
         """Return the bits that are unknown and differ between the guessed key and the correct key"""
         unknown=[]
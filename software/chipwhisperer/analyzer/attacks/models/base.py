@@ -37,6 +37,15 @@ def getHW(byte):
     return _HW[byte]
 
 
+def byteMatrix(data):
+    """Convert a list of per-trace byte sequences into an (N x len) uint8 array, or None if any entry is unknown"""
+    if data is None or len(data) == 0:
+        return None
+    if any(d is None for d in data):
+        return None
+    return np.asarray(data, dtype=np.uint8)
+
+
 class ModelsBase(Parameterized):
     _name = 'Crypto Model'
 
@@ -60,6 +69,9 @@ class ModelsBase(Parameterized):
           5, 6, 4, 5, 5, 6, 5, 6, 6, 7, 4, 5, 5, 6, 5, 6, 6, 7, 5, 6, 6, 7, 6,
           7, 7, 8]
 
+    #Same table as a NumPy array, for indexing a whole hypothesis matrix at once
+    HWArray = np.array(HW, dtype=np.uint8)
+
     def __init__(self, numSubKeys=None, permPerSubkey=None, model=None):
         self.sigParametersChanged = util.Signal()
         self.numSubKeys = numSubKeys
@@ -95,6 +107,36 @@ class ModelsBase(Parameterized):
     def leakage(self, pt, ct, guess, bnum, state):
         pass
 
+    def leakageBatch(self, textins, textouts, bnum, knownkeys=None):
+        """
+        Batched counterpart of leakage(): hypothetical leakage of every trace for every guess of subkey bnum.
+
+        Args:
+            textins: (N x textlen) plain-text inputs, may be empty
+            textouts: (N x textlen) cipher-text outputs, may be empty
+            bnum: Subkey number we are trying to attack.
+            knownkeys: (N x keylen) known keys, or None if unknown
+
+        Returns:
+            (N x permPerSubkey) uint8 array. This version calls leakage() for every (trace, guess) pair,
+            models override it with table lookups.
+        """
+        if textins is None:
+            textins = []
+        if textouts is None:
+            textouts = []
+        numtraces = max(len(textins), len(textouts))
+        hyp = np.zeros((numtraces, self.getPermPerSubkey()), dtype=np.uint8)
+        state = {'knownkey':None}
+        for tnum in range(numtraces):
+            pt = textins[tnum] if len(textins) > 0 else None
+            ct = textouts[tnum] if len(textouts) > 0 else None
+            if knownkeys is not None and len(knownkeys) > 0:
+                state['knownkey'] = knownkeys[tnum]
+            for guess in range(0, self.getPermPerSubkey()):
+                hyp[tnum, guess] = self.leakage(pt, ct, guess, bnum, state)
+        return hyp
+
     def getNumSubKeys(self):
         return self.numSubKeys
 
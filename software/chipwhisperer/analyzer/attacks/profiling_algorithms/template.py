@@ -26,10 +26,10 @@
 #=================================================
 import logging
 import numpy as np
-import scipy
 import sys
 
 from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.analyzer.utils.moments import CovarianceAccumulator
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.analyzer.ui.CWAnalyzerGUI import CWAnalyzerGUI
@@ -42,8 +42,13 @@ class TemplateUsingMVS(object):
     """
 
     @staticmethod
-    def generate(traceSource, trange, poiList, partMethod, progressBar=None):
-        """Generate templates for all partitions over entire trace range"""
+    def accumulate(traceSource, trange, poiList, partMethod, accumulators=None, progressBar=None):
+        """
+        Add the traces of trange to the running statistics of every subkey's partitions, reading one block at a time.
+
+        Returns a list of one CovarianceAccumulator per subkey (the ones passed in, if any), which can be merged with
+        the accumulators of other trace ranges before calling fromAccumulators(). Returns None if aborted.
+        """
 
         # Number of subkeys
         subkeys = len(poiList)
@@ -53,61 +58,118 @@ class TemplateUsingMVS(object):
         tstart = trange[0]
         tend = trange[1]
 
-        templateTraces = [ [ [] for j in range(0, numPartitions) ] for i in range(0, subkeys) ]
+        if accumulators is None:
+            accumulators = [CovarianceAccumulator(numPartitions, len(poiList[i])) for i in range(0, subkeys)]
 
-        templateMeans = [ np.zeros((numPartitions, len(poiList[i]))) for i in range (0, subkeys) ]
-        templateCovs = [ np.zeros((numPartitions, len(poiList[i]), len(poiList[i]))) for i in range (0, subkeys) ]
+        # The POIs of all subkeys are read with a single fancy index, poiSlices gives each subkey's columns
+        allPois = np.concatenate([np.asarray(poiList[i], dtype=np.int64) for i in range(0, subkeys)])
+        poiEnds = np.cumsum([len(poiList[i]) for i in range(0, subkeys)])
+        poiSlices = [slice(e - len(poiList[i]), e) for i, e in enumerate(poiEnds)]
 
         if progressBar:
             progressBar.setText('Generating Trace Matrix:')
             progressBar.setMaximum(tend - tstart + subkeys)
 
-        for tnum in range(tstart, tend):
+        for bstart in range(tstart, tend, traceSource.blockSize):
+            bend = min(bstart + traceSource.blockSize, tend)
+            points = traceSource.getTraces(bstart, bend)[:, allPois]
             # partData = traceSource.getAuxData(tnum, self.partObject.attrDictPartition)["filedata"]
-            pnum = partMethod.getPartitionNum(traceSource, tnum)
-            t = traceSource.getTrace(tnum)
+            pnums = np.array([partMethod.getPartitionNum(traceSource, tnum) for tnum in range(bstart, bend)], dtype=np.int64)
+
             for bnum in range(0, subkeys):
-                templateTraces[bnum][pnum[bnum]].append(t[poiList[bnum]])
+                accumulators[bnum].addBlock(points[:, poiSlices[bnum]], pnums[:, bnum])
 
             if progressBar:
-                progressBar.updateStatus(tnum - tstart)
+                progressBar.updateStatus(bend - tstart)
                 if progressBar.wasAborted():
                     return None
 
-        if progressBar:
-            progressBar.setText('Generating Trace Covariance and Mean Matrices:')
+        return accumulators
 
-        for bnum in range(0, subkeys):
-            for i in range(0, numPartitions):
-                templateMeans[bnum][i] = np.mean(templateTraces[bnum][i], axis=0)
-                cov = np.cov(templateTraces[bnum][i], rowvar=0)
-                if __debug__: logging.debug('templateTraces[%d][%d] = %d' % (bnum, i, len(templateTraces[bnum][i])))
-
-                if len(templateTraces[bnum][i]) > 0:
-                    templateCovs[bnum][i] = cov
-                else:
-                    logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
-                    templateCovs[bnum][i] = np.zeros((len(poiList[bnum]), len(poiList[bnum])))
-
-            if progressBar:
-                progressBar.updateStatus(tend + bnum)
-                if progressBar.wasAborted():
-                    return None
+    @staticmethod
+    def fromAccumulators(accumulators, trange, poiList, partMethod):
+        """Generate the templates (mean + covariance matrix of every partition) from the accumulated statistics"""
+        templateMeans = []
+        templateCovs = []
+
+        for bnum, acc in enumerate(accumulators):
+            counts = acc.count()
+            means = acc.mean().copy()
+            covs = acc.covariance()
+            if __debug__: logging.debug('templateTraces[%d] = %s' % (bnum, str(list(counts))))
+
+            for i in np.flatnonzero(counts == 0):
+                logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
+            means[counts == 0] = np.nan
+            templateMeans.append(means)
+            templateCovs.append(covs)
 
         template = {
          "mean":templateMeans,
          "cov":templateCovs,
-         "trange":(tstart, tend),
+         "trange":(trange[0], trange[1]),
          "poi":poiList,
          "partitiontype":partMethod.__class__.__name__
         }
 
+        return template
+
+    @staticmethod
+    def generate(traceSource, trange, poiList, partMethod, progressBar=None):
+        """Generate templates for all partitions over entire trace range"""
+
+        accumulators = TemplateUsingMVS.accumulate(traceSource, trange, poiList, partMethod, progressBar=progressBar)
+        if accumulators is None:
+            return None
+
         if progressBar:
+            progressBar.setText('Generating Trace Covariance and Mean Matrices:')
+
+        template = TemplateUsingMVS.fromAccumulators(accumulators, trange, poiList, partMethod)
+
+        if progressBar:
+            progressBar.updateStatus(trange[1] + len(poiList) - 1)
             progressBar.close()
 
         return template
 
 
+class TemplateMatcher(object):
+    """
+    Scores traces against the templates (one multivariate normal per partition) of one subkey.
+
+    The Cholesky factor of every covariance matrix is inverted and its log-determinant computed once, so scoring a
+    block of traces is a few matrix products per partition instead of one scipy logpdf() call per trace.
+    """
+
+    def __init__(self, means, covs):
+        """means is (partitions x POIs), covs (partitions x POIs x POIs). Raises LinAlgError if a covariance matrix
+        isn't positive definite."""
+        self.means = np.asarray(means, dtype=np.float64)
+        covs = np.asarray(covs, dtype=np.float64)
+        npois = self.means.shape[1]
+
+        self.invchol = np.empty_like(covs)
+        logdet = np.empty(len(covs))
+        for i, cov in enumerate(covs):
+            chol = np.linalg.cholesky(cov)
+            self.invchol[i] = np.linalg.inv(chol)
+            logdet[i] = 2 * np.sum(np.log(np.diag(chol)))
+        self.offset = -0.5 * (npois * np.log(2 * np.pi) + logdet)
+
+    def numPartitions(self):
+        return len(self.means)
+
+    def logpdf(self, points):
+        """Log-likelihood of every trace (row of points, at the POIs) for every partition: (traces x partitions)"""
+        points = np.asarray(points, dtype=np.float64)
+        out = np.empty((len(points), len(self.means)))
+        for i in range(0, len(self.means)):
+            z = np.dot(points - self.means[i], self.invchol[i].T)
+            out[:, i] = self.offset[i] - 0.5 * np.sum(z * z, axis=1)
+        return out
+
+
 class ProfilingTemplate(AlgorithmsBase, Plugin):
     """
     Template Attack done as a loop, but using an algorithm which can progressively add traces & give output stats
@@ -226,83 +288,95 @@ class ProfilingTemplate(AlgorithmsBase, Plugin):
 
         return poiList
 
-    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
-        data = []
-        textins = []
-        textouts = []
-
-        for i in range(tracerange[0], tracerange[1]+1):
-            d = traceSource.getTrace(i)
-
-            if d is None:
-                continue
-
-            startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
-            d = d[startingPoint:endingPoint]
-
-            data.append(d)
-            textins.append(traceSource.getTextin(i))
-            textouts.append(traceSource.getTextout(i))
+    def partitionTable(self, ptype, textins, textouts, bnum):
+        """Return the (traces x guesses) array of the partition each trace falls in, for every guess of subkey bnum"""
+        guesses = np.arange(self.model.getPermPerSubkey())
+
+        if ptype == "PartitionHWIntermediate":
+            self.model.setHwModel(self.model.hwModels['HW: AES SBox Output, First Round (Enc)'])
+            return self.model.leakageBatch(textins, textouts, bnum)
+        elif ptype == "PartitionHDLastRound":
+            self.model.setHwModel(self.model.hwModels['HD: AES Last-Round State'])
+            return self.model.leakageBatch(textins, textouts, bnum)
+        # TODO Temp
+        elif ptype == "PartitionHDRounds":
+            textins = np.asarray(textins, dtype=np.uint8)
+            state = textins[:, bnum, np.newaxis] ^ guesses.astype(np.uint8)
+            if bnum != 0:
+                knownkey = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
+                state = state ^ (textins[:, bnum - 1, np.newaxis] ^ np.uint8(knownkey[bnum - 1]))
+            return self.model.HWArray[state]
+        else:
+            return np.tile(guesses, (len(textins), 1))
 
-        try:
-            from scipy.stats import multivariate_normal
-        except ImportError:
-            raise Warning("Version of SciPy too old, require >= 0.14, have %s. "
-                          "Update to support this attack" % (scipy.version.version))
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
+        tstart, tend = tracerange[0], tracerange[1] + 1
 
         # Hack for now - just use last template found
         template = self.loadTemplatesFromProject()[-1]
         pois = template["poi"]
-        numparts = len(template['mean'][0])
+        ptype = str(template["partitiontype"])
+
+        # Templates are applied with the variances only (diagonal covariance matrix)
+        matchers = {}
+        for bnum in self.brange:
+            try:
+                matchers[bnum] = TemplateMatcher(template['mean'][bnum], [np.diag(np.diag(c)) for c in template['cov'][bnum]])
+            except np.linalg.LinAlgError as e:
+                logging.warning('Error in applying template, probably template is poorly formed or POI incorrect. Byte %d skipped.' % bnum)
+                logging.debug(e)
+                matchers[bnum] = None
+
         results = np.zeros((self.model.getNumSubKeys(), self.model.getPermPerSubkey()))
 
         if progressBar:
             progressBar.setStatusMask("Current Trace = %d Current Subkey = %d", (0, 0))
-            progressBar.setMaximum(self.model.getNumSubKeys() * len(data))
+            progressBar.setMaximum(self.model.getNumSubKeys() * (tend - tstart))
         pcnt = 0
 
-        for tnum in range(0, len(data)):
-            for bnum in self.brange:
-                try:
-                    newresultsint = [multivariate_normal.logpdf(data[tnum][pois[bnum]], mean=template['mean'][bnum][i], cov=np.diag(template['cov'][bnum][i])) for i in range(0, numparts)]
-                except np.linalg.LinAlgError as e:
-                    logging.warning('Error in applying template, probably template is poorly formed or POI incorrect. Byte %d for tnum %d skipped.' % (bnum, tnum))
-                    logging.debug(e)
-                    newresultsint = [0] * self.model.getPermPerSubkey()
-
-                ptype = template["partitiontype"]
+        # Traces are read and scored blockSize at a time, the running sum after every trace of a block is taken from
+        # the cumulative sum of its scores. tnum counts the traces not rejected by the preprocessing.
+        tnum = 0
+        for bstart in range(tstart, tend, traceSource.blockSize):
+            bend = min(bstart + traceSource.blockSize, tend)
+            data = traceSource.getTraces(bstart, bend)
+            textins = traceSource.getTextins(bstart, bend)
+            textouts = traceSource.getTextouts(bstart, bend)
+
+            # Skip traces rejected by the preprocessing
+            valid = ~np.isnan(data[:, 0])
+            data = data[valid, startingPoint:endingPoint]
+            textins = textins[valid]
+            textouts = textouts[valid]
+            numtraces = len(data)
+            if numtraces == 0:
+                continue
 
-                newresults = []
+            cumulative = {}
+            for bnum in self.brange:
+                if matchers[bnum] is None:
+                    # Nothing is added for a subkey whose template can't be applied
+                    cumulative[bnum] = np.tile(results[bnum], (numtraces, 1))
+                    continue
+                scores = matchers[bnum].logpdf(data[:, pois[bnum]])
+                parts = self.partitionTable(ptype, textins, textouts, bnum)
                 # Map to key guess format
-                for i in range(0, self.model.getPermPerSubkey()):
-                    if ptype == "PartitionHWIntermediate":
-                        self.model.setHwModel(self.model.hwModels['HW: AES SBox Output, First Round (Enc)'])
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    elif ptype == "PartitionHDLastRound":
-                        self.model.setHwModel(self.model.hwModels['HD: AES Last-Round State'])
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    # TODO Temp
-                    elif ptype == "PartitionHDRounds":
-                        if bnum == 0:
-                            hypint = self.model.getHW(textins[tnum][bnum] ^ i)
-                        else:
-                            knownkey = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
-                            s1 = textins[tnum][bnum - 1] ^ knownkey[bnum - 1]
-                            s2 = textins[tnum][bnum] ^ i
-                            hypint = self.model.getHW(s1 ^ s2)
-                    else:
-                        hypint = i
-                    newresults.append(newresultsint[hypint])
-
-                results[bnum] += newresults
-                self.stats.updateSubkey(bnum, results[bnum], tnum=(tnum + 1))
-
-                pcnt += 1
-                if progressBar:
-                    progressBar.updateStatus(pcnt, (tnum, bnum))
-                    if progressBar.wasAborted():
-                        return
-
-            # Do plotting if required
-            if (tnum % self._reportingInterval) == 0 and self.sr:
-                self.sr()
+                guessscores = scores[np.arange(numtraces)[:, np.newaxis], parts]
+                cumulative[bnum] = results[bnum] + np.cumsum(guessscores, axis=0)
+                results[bnum] = cumulative[bnum][-1]
+
+            for i in range(0, numtraces):
+                for bnum in self.brange:
+                    self.stats.updateSubkey(bnum, cumulative[bnum][i], tnum=(tnum + 1))
+
+                    pcnt += 1
+                    if progressBar:
+                        progressBar.updateStatus(pcnt, (tnum, bnum))
+                        if progressBar.wasAborted():
+                            return
+
+                # Do plotting if required
+                if (tnum % self._reportingInterval) == 0 and self.sr:
+                    self.sr()
+                tnum += 1
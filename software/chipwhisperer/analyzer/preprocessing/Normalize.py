@@ -52,13 +52,19 @@ class NormBase(object):
 class NormMean(NormBase):
     """Normalize by mean (e.g. make traces zero-mean)"""
     def processTrace(self, t, tindex):
-        return t - np.mean(t)
+        return self.processBlock(np.asarray(t)[np.newaxis, :], tindex)[0]
+
+    def processBlock(self, traces, start):
+        return traces - np.mean(traces, axis=1)[:, np.newaxis]
 
 
 class NormMeanStd(NormBase):
     """Normalize by mean & std-dev """
     def processTrace(self, t, tindex):
-        return (t - np.mean(t)) / np.std(t)
+        return self.processBlock(np.asarray(t)[np.newaxis, :], tindex)[0]
+
+    def processBlock(self, traces, start):
+        return (traces - np.mean(traces, axis=1)[:, np.newaxis]) / np.std(traces, axis=1)[:, np.newaxis]
 
 
 class Normalize(PreprocessingBase):
@@ -110,14 +116,5 @@ class Normalize(PreprocessingBase):
             raise ValueError("Unrecognized mode; expected one of 'mean', 'mean_stddev'", mode)
 
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-
-            if trace is None:
-                return None
-            proc = self._norm.processTrace(trace, n)
-
-            return proc
-        else:
-            return self._traceSource.getTrace(n)
\ No newline at end of file
+    def processBlock(self, traces, start):
+        return self._norm.processBlock(traces, start)
\ No newline at end of file
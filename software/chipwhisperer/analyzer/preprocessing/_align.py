@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import numpy as np
+
+
+def _nextPow2(n):
+    return 1 << int(max(0, n - 1)).bit_length()
+
+
+class SlidingReference(object):
+    """
+    A reference waveform slid over a window of every trace in a block, as done by the resync modules.
+
+    All methods take a 2D block of traces and return one row per trace, where column k is the match of the reference
+    with trace[start + k:start + k + len(ref)], for k in range(count).
+    """
+
+    #FFT blocks are at most this many times the reference length, longer windows are split (overlap-save)
+    maxFFTRatio = 8
+
+    #Number of points processed at a time by sad()
+    sadChunkSize = 16384
+
+    def __init__(self, ref):
+        self.ref = np.array(ref, dtype=np.float64)
+        self.energy = np.dot(self.ref, self.ref)
+        self._spectra = {}
+
+    def __len__(self):
+        return len(self.ref)
+
+    def _spectrum(self, fftlen):
+        """Conjugate spectrum of the reference for FFTs of fftlen points, computed once per length"""
+        spec = self._spectra.get(fftlen)
+        if spec is None:
+            spec = np.conj(np.fft.rfft(self.ref, fftlen))
+            self._spectra[fftlen] = spec
+        return spec
+
+    def dot(self, traces, start, count):
+        """Dot product of the reference with every window (cross-correlation), by FFT overlap-save"""
+        traces = np.asarray(traces)
+        reflen = len(self.ref)
+        fftlen = _nextPow2(min(max(count, 1) + reflen - 1, self.maxFFTRatio * reflen))
+        step = fftlen - reflen + 1
+        spec = self._spectrum(fftlen)
+
+        out = np.empty((traces.shape[0], count))
+        for k in range(0, count, step):
+            n = min(step, count - k)
+            seg = traces[:, start + k:start + k + n + reflen - 1]
+            out[:, k:k + n] = np.fft.irfft(np.fft.rfft(seg, fftlen, axis=1) * spec, fftlen, axis=1)[:, :n]
+        return out
+
+    def ssd(self, traces, start, count):
+        """Sum of squared differences with every window, from cumulative sums of the squared traces and dot()"""
+        traces = np.asarray(traces, dtype=np.float64)
+        reflen = len(self.ref)
+        seg = traces[:, start:start + count + reflen - 1]
+        csum = np.zeros((seg.shape[0], seg.shape[1] + 1))
+        np.cumsum(seg * seg, axis=1, out=csum[:, 1:])
+        winenergy = csum[:, reflen:reflen + count] - csum[:, :count]
+        return np.maximum(winenergy - 2 * self.dot(traces, start, count) + self.energy, 0)
+
+    def sad(self, traces, start, count):
+        """
+        Sum of absolute differences with every window. Loops over the shorter of the window and the reference, a few
+        traces at a time so the temporary arrays stay in the CPU cache.
+        """
+        traces = np.asarray(traces)
+        reflen = len(self.ref)
+        out = np.zeros((traces.shape[0], count))
+        width = min(count, reflen)
+        rows = max(1, self.sadChunkSize // max(1, max(count, reflen)))
+        tmp = np.empty((rows, max(count, reflen)))
+        for r in range(0, traces.shape[0], rows):
+            block = traces[r:r + rows]
+            o = out[r:r + rows]
+            if count <= reflen:
+                t = tmp[:len(block), :reflen]
+                for k in range(0, width):
+                    np.subtract(block[:, start + k:start + k + reflen], self.ref, out=t)
+                    np.abs(t, out=t)
+                    o[:, k] = np.sum(t, axis=1)
+            else:
+                t = tmp[:len(block), :count]
+                for j in range(0, width):
+                    np.subtract(block[:, start + j:start + j + count], self.ref[j], out=t)
+                    np.abs(t, out=t)
+                    o += t
+        return out
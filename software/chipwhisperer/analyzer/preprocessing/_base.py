@@ -26,6 +26,8 @@
 #=================================================
 import logging
 
+import numpy as np
+
 from chipwhisperer.common.api.autoscript import AutoScript
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.common.utils.tracesource import TraceSource, ActiveTraceObserver
@@ -33,6 +35,21 @@ from chipwhisperer.common.utils.parameter import setupSetParam
 from chipwhisperer.common.utils import util
 
 
+def shiftTraces(traces, shifts):
+    """
+    Shift each row of traces left by the matching entry of shifts (right if negative), padding with zeros.
+
+    Row i of the result is traces[i, shifts[i]:] followed by zeros for a positive shift, the same way the resync
+    modules line up each trace with the reference.
+    """
+    traces = np.asarray(traces)
+    npoints = traces.shape[1]
+    idx = np.arange(npoints) + np.asarray(shifts)[:, np.newaxis]
+    valid = (idx >= 0) & (idx < npoints)
+    out = traces[np.arange(len(traces))[:, np.newaxis], np.clip(idx, 0, npoints - 1)]
+    return np.where(valid, out, 0.0)
+
+
 class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
     """
     Base Class for all preprocessing modules
@@ -91,26 +108,69 @@ class PreprocessingBase(TraceSource, ActiveTraceObserver, AutoScript, Plugin):
         self._setEnabled(en)
 
     def getTrace(self, n):
-        """Get trace number n"""
-        if self.enabled:
+        """Get trace number n, processed as a block of one trace"""
+        if self.enabled and self._hasBlockProcessing():
             trace = self._traceSource.getTrace(n)
-            # Do your preprocessing here
+            if trace is None:
+                return None
+            trace = self.processBlock(np.asarray(trace)[np.newaxis, :], n)[0]
+            if np.isnan(trace[0]):
+                return None
             return trace
         else:
             return self._traceSource.getTrace(n)
 
+    def getTraces(self, start, end):
+        """Get traces start to end-1 as a 2D array"""
+        if not self.enabled:
+            return self._traceSource.getTraces(start, end)
+        if self._hasBlockProcessing():
+            traces = self._traceSource.getTraces(start, end)
+            rejected = np.isnan(traces[:, 0])
+            traces = self.processBlock(traces, start)
+            # Keep the traces rejected upstream rejected
+            if np.any(rejected):
+                traces[rejected] = np.nan
+            return traces
+        return TraceSource.getTraces(self, start, end)
+
+    def processBlock(self, traces, start):
+        """
+        Preprocess a block of traces (one per row, the first one being trace number start) and return the result.
+
+        Modules overriding this get block reads with one call up the chain, and getTrace() runs through it with a
+        block of one trace. Modules which only override getTrace() are read trace by trace. Traces the module rejects
+        must be returned as rows of NaN.
+        """
+        raise NotImplementedError
+
+    def _hasBlockProcessing(self):
+        return type(self).processBlock != PreprocessingBase.processBlock
+
     def getTextin(self, n):
         """Get text-in number n"""
         return self._traceSource.getTextin(n)
 
+    def getTextins(self, start, end):
+        """Get text-ins start to end-1"""
+        return self._traceSource.getTextins(start, end)
+
     def getTextout(self, n):
         """Get text-out number n"""
         return self._traceSource.getTextout(n)
 
+    def getTextouts(self, start, end):
+        """Get text-outs start to end-1"""
+        return self._traceSource.getTextouts(start, end)
+
     def getKnownKey(self, n=None):
         """Get known-key number n"""
         return self._traceSource.getKnownKey(n)
 
+    def getKnownKeys(self, start, end):
+        """Get known-keys start to end-1"""
+        return self._traceSource.getKnownKeys(start, end)
+
     def getSampleRate(self):
         """Get the Sample Rate"""
         return self._traceSource.getSampleRate()
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import glob
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+
+def _hashText(h, text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    h.update(text)
+
+
+def chainKey(traceSource):
+    """
+    Return a key (hex SHA-1) identifying the output of traceSource.
+
+    The key covers the class and parameters of every enabled preprocessing module up the chain, and the identity of the
+    trace segments at its root, so it only changes when the traces coming out of the chain can change.
+    """
+    h = hashlib.sha1()
+    src = traceSource
+    while src is not None:
+        _hashText(h, src.__class__.__name__)
+        if hasattr(src, "_traceSource"):
+            if getattr(src, "enabled", True):
+                _hashText(h, str(src.getParams()))
+            src = src._traceSource
+        else:
+            if hasattr(src, "traceSegments"):
+                for seg in src.traceSegments:
+                    if seg.enabled:
+                        _hashText(h, "%s %s %d" % (seg.config.configFilename(), seg.mappedRange, seg.numTraces()))
+            else:
+                _hashText(h, "%s %d" % (src.name, src.numTraces()))
+            break
+    return h.hexdigest()
+
+
+def chainParameters(traceSource):
+    """Return every parameter (including sub-parameters) of the preprocessing modules the key of traceSource covers"""
+    ret = []
+    src = traceSource
+    while src is not None and hasattr(src, "_traceSource"):
+        todo = [src.getParams()]
+        while todo:
+            param = todo.pop()
+            ret.append(param)
+            todo.extend(param.childs)
+        src = src._traceSource
+    return ret
+
+
+class TraceCacheEntry(object):
+    """
+    One cache entry: the output of a chain over its whole trace range, and one flag per trace telling if that trace
+    has been stored yet. Both arrays are memory-mapped .npy files.
+    """
+
+    def __init__(self, path, shape=None, dtype=None):
+        self.path = path
+        if shape is None:
+            self.traces = np.load(path + "-traces.npy", mmap_mode='r+')
+            self.valid = np.load(path + "-valid.npy", mmap_mode='r+')
+        else:
+            self.traces = np.lib.format.open_memmap(path + "-traces.npy", mode='w+', dtype=dtype, shape=shape)
+            self.valid = np.lib.format.open_memmap(path + "-valid.npy", mode='w+', dtype=np.uint8, shape=(shape[0],))
+
+    def numTraces(self):
+        return self.traces.shape[0]
+
+    def numPoints(self):
+        return self.traces.shape[1]
+
+    def store(self, start, traces, mask):
+        """Store the rows of traces selected by mask, the first row being trace number start"""
+        idx = np.nonzero(mask)[0]
+        self.traces[start + idx] = traces[idx]
+        self.valid[start + idx] = 1
+
+    def close(self):
+        for arr in (self.traces, self.valid):
+            if arr is not None:
+                arr.flush()
+        self.traces = None
+        self.valid = None
+
+
+class TraceCache(object):
+    """
+    Content-addressed disk cache of preprocessed traces.
+
+    Entries live in one directory and are looked up by the key of the chain which produced them (see chainKey), so
+    several configurations of the same chain can be cached side by side. The least recently opened entries are deleted
+    once the cache grows over maxBytes.
+    """
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """Open the existing entry for key, or return None"""
+        path = self._path(key)
+        if not (os.path.isfile(path + "-traces.npy") and os.path.isfile(path + "-valid.npy")):
+            return None
+        try:
+            entry = TraceCacheEntry(path)
+        except (IOError, ValueError) as e:
+            logging.warning("Dropping unreadable trace cache entry %s: %s" % (key, str(e)))
+            self.remove(key)
+            return None
+        os.utime(path + "-valid.npy", None)
+        return entry
+
+    def create(self, key, numTraces, numPoints, dtype):
+        """Create an entry for key, evicting older entries to make room. Returns None if it can never fit."""
+        size = numTraces * numPoints * np.dtype(dtype).itemsize + numTraces
+        if size > self.maxBytes:
+            logging.warning("Trace cache entry of %d MB doesn't fit in the cache size limit, not caching" % (size / 2**20))
+            return None
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.evict(self.maxBytes - size, keep=key)
+        return TraceCacheEntry(self._path(key), (numTraces, numPoints), dtype)
+
+    def entries(self):
+        """Return a list of (key, size in bytes, last use time) of all entries, least recently used first"""
+        ret = []
+        for vfile in glob.glob(os.path.join(self.directory, "*-valid.npy")):
+            key = os.path.basename(vfile)[:-len("-valid.npy")]
+            tfile = self._path(key) + "-traces.npy"
+            size = os.path.getsize(vfile)
+            if os.path.isfile(tfile):
+                size += os.path.getsize(tfile)
+            ret.append((key, size, os.path.getmtime(vfile)))
+        ret.sort(key=lambda e: e[2])
+        return ret
+
+    def diskUsage(self):
+        return sum([e[1] for e in self.entries()])
+
+    def evict(self, maxBytes=None, keep=None):
+        """Delete least recently used entries (except keep) until the cache takes at most maxBytes"""
+        if maxBytes is None:
+            maxBytes = self.maxBytes
+        entries = self.entries()
+        total = sum([e[1] for e in entries])
+        for key, size, _ in entries:
+            if total <= maxBytes:
+                break
+            if key == keep:
+                continue
+            logging.info("Evicting trace cache entry %s (%d MB)" % (key, size / 2**20))
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        for suffix in ("-traces.npy", "-valid.npy"):
+            try:
+                os.remove(self._path(key) + suffix)
+            except OSError:
+                pass
+
+    def clear(self, keep=None):
+        for key, _, _ in self.entries():
+            if key != keep:
+                self.remove(key)
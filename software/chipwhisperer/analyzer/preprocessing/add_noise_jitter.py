@@ -25,9 +25,8 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
-import random
 import numpy as np
-from ._base import PreprocessingBase
+from ._base import PreprocessingBase, shiftTraces
 from chipwhisperer.common.utils.parameter import setupSetParam
 
 
@@ -71,56 +70,6 @@ class AddNoiseJitter(PreprocessingBase):
             raise TypeError("Expected int; got %s" % type(jit), jit)
         self._setJitter(jit)
    
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            
-            jit = random.randint(-self._maxJitter, self._maxJitter)
-
-            return roll_zeropad(trace, jit)
-        else:
-            return self._traceSource.getTrace(n)
-
-        
-# This function stolen from: http://stackoverflow.com/questions/2777907/python-numpy-roll-with-padding
-def roll_zeropad(a, shift, axis=None):
-    """
-    Roll array elements along a given axis. Elements rolled off the end of the array are treated as zeros.
-
-    :param a: Input Array
-    :type a: array_like
-    
-    :param shift: The number of places by which elements are shifted.
-    :type shift: int
-
-    :param axis: The axis along which elements are shifted.  By default, the array
-                 is flattened before shifting, after which the original
-                 shape is restored.
-    :type axis: int, optional      
-
-    :rtype: ndarray, with the same shape as ``a``
-
-    """
-    a = np.asanyarray(a)
-    if shift == 0: return a
-    if axis is None:
-        n = a.size
-        reshape = True
-    else:
-        n = a.shape[axis]
-        reshape = False
-    if np.abs(shift) > n:
-        res = np.zeros_like(a)
-    elif shift < 0:
-        shift += n
-        zeros = np.zeros_like(a.take(np.arange(n - shift), axis))
-        res = np.concatenate((a.take(np.arange(n - shift, n), axis), zeros), axis)
-    else:
-        zeros = np.zeros_like(a.take(np.arange(n - shift, n), axis))
-        res = np.concatenate((zeros, a.take(np.arange(n - shift), axis)), axis)
-    if reshape:
-        return res.reshape(a.shape)
-    else:
-        return res
+    def processBlock(self, traces, start):
+        jit = np.random.randint(-self._maxJitter, self._maxJitter + 1, size=len(traces))
+        return shiftTraces(traces, -jit)
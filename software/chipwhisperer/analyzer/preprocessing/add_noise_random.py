@@ -67,15 +67,8 @@ class AddNoiseRandom(PreprocessingBase):
             raise TypeError("Expected number; got %s" % type(std_dev), std_dev)
         self._setNoise(std_dev)
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-
-            if self._noise_std_dev == 0:
-                return trace
-            else:
-                return trace + np.random.normal(scale=self._noise_std_dev, size=len(trace))
+    def processBlock(self, traces, start):
+        if self._noise_std_dev == 0:
+            return traces
         else:
-            return self._traceSource.getTrace(n)
+            return traces + np.random.normal(scale=self._noise_std_dev, size=np.shape(traces))
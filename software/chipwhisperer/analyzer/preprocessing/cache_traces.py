@@ -25,71 +25,136 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 import numpy as np
-import os.path
 from ._base import PreprocessingBase
+from ._cache import TraceCache, chainKey, chainParameters
 from chipwhisperer.common.api import CWCoreAPI
+from chipwhisperer.common.utils.parameter import setupSetParam
 
 class CacheTraces(PreprocessingBase):
     """
     Automatically Caches Traces to Speed Up Preprocessing
+
+    The output of the chain above this module is stored on disk, in an entry keyed by the chain settings and the
+    trace segments it reads from. Switching between settings reuses the entries stored before, and the least recently
+    used entries are deleted when the cache goes over its size limit.
     """
     _name = "Trace Cache"
-    _description = "Caches traces into giant file."
+    _description = "Caches preprocessed traces on disk, one entry per preprocessing setting."
 
     def __init__(self, traceSource=None, name=None):
         #TODO: Where is project file?
-        self.trace_cache_file = CWCoreAPI.CWCoreAPI.getInstance().project().getDataFilepath("tempcache.npy")['abs']
-        self.tracehash_cache_file = CWCoreAPI.CWCoreAPI.getInstance().project().getDataFilepath("tempcachehash.npy")['abs']
-        self.cache_shape = (-1, -1)
+        cachedir = CWCoreAPI.CWCoreAPI.getInstance().project().getDataFilepath("tracecache")['abs']
+        self._maxSize = 1024
+        self._cache = TraceCache(cachedir, self._maxSize * 2**20)
+        self._entry = None
+        self._entryKey = None
+        self._uncachedKey = None
+        self._chainKey = None
+        self._watchedParams = []
+        self._hits = 0
+        self._misses = 0
 
         PreprocessingBase.__init__(self, traceSource, name=name)
+        self.params.addChildren([
+            {'name':'Max Disk Usage (MB)', 'key':'maxsize', 'type':'int', 'limits':(1, 1000000), 'get':self._getMaxSize, 'set':self._setMaxSize},
+            {'name':'Cache Hits', 'key':'hits', 'type':'int', 'readonly':True, 'get':self._getHits},
+            {'name':'Cache Misses', 'key':'misses', 'type':'int', 'readonly':True, 'get':self._getMisses},
+            {'name':'Disk Usage (MB)', 'key':'usage', 'type':'float', 'readonly':True, 'get':self._getDiskUsage},
+            {'name':'Clear Cache', 'key':'clear', 'type':'action', 'action':lambda _: self.clearCache()},
+        ])
         self.updateScript()
 
-    def recalculateHash(self):
-        parent = self
-        settinghash = 0
-        while hasattr(parent, "_traceSource"):
-            parent = parent._traceSource
-            #print "Parent: %s" % str(parent)
+    @setupSetParam("Max Disk Usage (MB)")
+    def _setMaxSize(self, size):
+        self._maxSize = size
+        self._cache.maxBytes = size * 2**20
+        self._cache.evict(keep=self._entryKey)
 
-            if hasattr(parent, "attrSettings"):
-                #print "   params: %s"%str(parent.attrSettings())
-                #Hash?
-                settinghash ^= hash(str(parent.attrSettings()))
-            else:
-                #print "Found trace manager"
-                pass
+    def _getMaxSize(self):
+        return self._maxSize
 
-        return settinghash
+    def _getHits(self):
+        return self._hits
 
-    def processTraces(self):
-        #Settings changed - has hash changed?
-        self.settingshash =  self.recalculateHash()
-       #print self.settingshash
+    def _getMisses(self):
+        return self._misses
 
-        #Get number of trace + points, make cache now
-        if self.cache_shape != (self.numTraces(), self.numPoints()):
+    def _getDiskUsage(self):
+        return self._cache.diskUsage() / float(2**20)
 
-            if os.path.isfile(self.trace_cache_file):
-                fmode = "r+"
-            else:
-                fmode = "w+"
+    def clearCache(self):
+        """Delete all cache entries and reset the hit/miss counts"""
+        self._closeEntry()
+        self._cache.clear()
+        self._hits = 0
+        self._misses = 0
 
-            self.trace_cache = np.memmap(self.trace_cache_file, dtype="float32", mode=fmode, shape=(self.numTraces(), self.numPoints()))
-            self.tracehash_cache = np.memmap(self.tracehash_cache_file, dtype="int64", mode=fmode, shape=(self.numTraces(), 1))
+    def _closeEntry(self):
+        if self._entry is not None:
+            self._entry.close()
+        self._entry = None
+        self._entryKey = None
+
+    def processTraces(self):
+        #Input changed - pick the cache entry again on next read
+        self._closeEntry()
+        self._chainChanged()
+
+    def _chainChanged(self, *args, **kwargs):
+        self._chainKey = None
+
+    def _getChainKey(self):
+        """Key of the chain above, only computed again after one of its parameters changed"""
+        if self._chainKey is None:
+            for param in self._watchedParams:
+                param.sigValueChanged.disconnect(self._chainChanged)
+            self._watchedParams = chainParameters(self._traceSource)
+            for param in self._watchedParams:
+                param.sigValueChanged.connect(self._chainChanged)
+            self._chainKey = chainKey(self._traceSource)
+        return self._chainKey
 
     def getTrace(self, n):
         """Get trace number n"""
-        if self.enabled and self.settingshash:
-            #Check the hash list?
-            if self.tracehash_cache[n] == self.settingshash:
-                trace = self.trace_cache[n]
-                #print "Trace %d: cache hit"%n
-            else:
-                #print "Trace %d: cache miss"%n
-                trace = self._traceSource.getTrace(n)
-                self.tracehash_cache[n] = self.settingshash
-                self.trace_cache[n] = trace
+        if self.enabled:
+            trace = self.getTraces(n, n + 1)[0]
+            if np.isnan(trace[0]):
+                return None
             return trace
         else:
             return self._traceSource.getTrace(n)
+
+    def getTraces(self, start, end):
+        """Get traces start to end-1, from the cache entry of the current settings where they are stored already"""
+        if not self.enabled:
+            return self._traceSource.getTraces(start, end)
+
+        key = self._getChainKey()
+        if key != self._entryKey:
+            self._closeEntry()
+            self._entry = self._cache.open(key)
+            self._entryKey = key
+
+        if self._entry is not None and self._entry.numTraces() >= end:
+            miss = self._entry.valid[start:end] == 0
+            nmiss = np.count_nonzero(miss)
+            self._hits += (end - start) - nmiss
+            self._misses += nmiss
+            if nmiss == 0:
+                return self._entry.traces[start:end]
+        else:
+            self._misses += end - start
+            miss = None
+
+        traces = self._traceSource.getTraces(start, end)
+
+        if self._entry is None and key != self._uncachedKey:
+            self._entry = self._cache.create(key, self.numTraces(), np.shape(traces)[1], traces.dtype)
+            if self._entry is None:
+                self._uncachedKey = key
+            miss = np.ones(end - start, dtype=bool)
+
+        if self._entry is not None and miss is not None and np.shape(traces)[1] == self._entry.numPoints():
+            self._entry.store(start, traces, miss)
+
+        return traces
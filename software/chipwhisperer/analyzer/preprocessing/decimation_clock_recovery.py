@@ -29,8 +29,8 @@ import logging
 from ._base import PreprocessingBase
 import scipy
 import scipy.fftpack
+import scipy.signal
 import numpy as np
-from matplotlib.mlab import find
 
 
 def fft(signal, freq=None):
@@ -100,55 +100,48 @@ class DecimationClockRecovery(PreprocessingBase):
 
         logging.info('Designing filter for passband: %f-%f' % (freq[0], freq[1]))
 
-        b, a = sp.signal.butter(order, freq, form)
+        b, a = scipy.signal.butter(order, freq, form)
         self.b = b
         self.a = a
    
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            
-            if self.a is None:
-                self.setFilterParams(useCached=True)
-                
-            if self._recalcPerTrace:
-                self.setFilterParams(tnum=n, useCached=True)
-
-            # Filter Trace
-            inputtrace = sp.signal.lfilter(self.b, self.a, trace)
-            
-            if self._enableZeroCrossing:
-
-                # Problem: the filter has some start-up time, so we can't use data right away. But
-                #         if you only api a waveform AFTER the trigger, this means you need to
-                #         throw away data from the api until the filter is running. If the system
-                #         clock frequency changes, you've now thrown away a differing amount of clock
-                #         cycles and syncronization is lost.
-                #
-                # For now we just throw away a fixed number of samples, but it doesn't work for varying
-                # clock frequencies.
-                for i in range(0, 250):
-                    inputtrace[i] = 0
-
-                indices = find((inputtrace[1:] >= 0) & (inputtrace[:-1] < 0))
-                filttrace = np.zeros(len(inputtrace))
-
-                if self._enableDecimation:
-                    for idx, val in enumerate(indices):
-                        filttrace[idx] = trace[val]
-                else:
-                    for i in indices:
-                        filttrace[i] = 1
-            else:
-                filttrace = inputtrace
-
-            #print len(trace)
-            #print len(filttrace)
-            return filttrace
+    def processBlock(self, traces, start):
+        if self.a is None:
+            self.setFilterParams(useCached=True)
+
+        # Filter Traces
+        if self._recalcPerTrace:
+            inputtraces = np.zeros(np.shape(traces))
+            for i, trace in enumerate(traces):
+                self.setFilterParams(tnum=start + i, useCached=True)
+                inputtraces[i] = scipy.signal.lfilter(self.b, self.a, trace)
         else:
-            return self._traceSource.getTrace(n)
+            inputtraces = scipy.signal.lfilter(self.b, self.a, traces, axis=1)
+
+        if not self._enableZeroCrossing:
+            return inputtraces
+
+        # Problem: the filter has some start-up time, so we can't use data right away. But
+        #         if you only api a waveform AFTER the trigger, this means you need to
+        #         throw away data from the api until the filter is running. If the system
+        #         clock frequency changes, you've now thrown away a differing amount of clock
+        #         cycles and syncronization is lost.
+        #
+        # For now we just throw away a fixed number of samples, but it doesn't work for varying
+        # clock frequencies.
+        inputtraces[:, 0:250] = 0
+
+        crossings = (inputtraces[:, 1:] >= 0) & (inputtraces[:, :-1] < 0)
+        filttraces = np.zeros(np.shape(inputtraces))
+
+        if self._enableDecimation:
+            # Sample of the n-th zero crossing of each trace goes to point n
+            rows, cols = np.nonzero(crossings)
+            nth = np.cumsum(crossings, axis=1) - 1
+            filttraces[rows, nth[rows, cols]] = traces[rows, cols]
+        else:
+            filttraces[:, :-1][crossings] = 1
+
+        return filttraces
 
     def getSampleRate(self):
         return 0  # TODO: it is not zero!
@@ -63,20 +63,8 @@ class DecimationFixed(PreprocessingBase):
             raise TypeError("Expected int; got %s" % type(dec), dec)
         self._setDecFactor(dec)
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-
-            outtrace = np.zeros(len(range(0, len(trace), self._dec_factor)))
-
-            for idx, val in enumerate(range(0, len(trace), self._dec_factor)):
-                outtrace[idx] = trace[val]
-
-            return outtrace
-        else:
-            return self._traceSource.getTrace(n)
+    def processBlock(self, traces, start):
+        return np.array(traces[:, ::self._dec_factor], dtype=np.float64)
 
     def numPoints(self):
         if self.enabled:
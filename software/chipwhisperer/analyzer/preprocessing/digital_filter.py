@@ -180,11 +180,5 @@ class Filter(PreprocessingBase):
         self._setFilterForm()
         self._setFilterParams(self._type, freqs, self._order)
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            return signal.lfilter(self.b, self.a, trace)
-        else:
-            return self._traceSource.getTrace(n)
+    def processBlock(self, traces, start):
+        return signal.lfilter(self.b, self.a, traces, axis=1)
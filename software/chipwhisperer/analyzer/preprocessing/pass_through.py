@@ -38,5 +38,5 @@ class PassThrough(PreprocessingBase):
         PreprocessingBase.__init__(self, traceSource, name=name)
         self.findParam('Enabled').hide()
 
-    def getTrace(self, n):
-        return self._traceSource.getTrace(n)
+    def processBlock(self, traces, start):
+        return traces
@@ -26,10 +26,10 @@
 #=================================================
 
 import numpy as np
-import scipy as sp
 
 from chipwhisperer.common.results.base import ResultsBase
-from ._base import PreprocessingBase
+from ._base import PreprocessingBase, shiftTraces
+from ._align import SlidingReference
 from chipwhisperer.common.utils.parameter import setupSetParam
 
 
@@ -47,6 +47,7 @@ class ResyncCrossCorrelation(PreprocessingBase):
         self._debugReturnCorr = False
         self._ccStart = 0
         self._ccEnd = 0
+        self._ref = None
 
         self.params.addChildren([
             {'name':'Ref Trace', 'key':'reftrace', 'type':'int', 'get':self._getRefTrace, 'set':self._setRefTrace},
@@ -105,44 +106,42 @@ class ResyncCrossCorrelation(PreprocessingBase):
             raise TypeError("Expected int; got %s" % type(win[1]), win[1])
         self._setWindow(win)
    
-    def getTrace(self, n):
-        if self.enabled:
-            #TODO: fftconvolve
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            cross = sp.signal.fftconvolve(trace, self._reftrace, mode='valid')
-            if self._debugReturnCorr:
-                return cross
-            newmaxloc = np.argmax(cross[self._ccStart:self._ccEnd])
-            # maxval = max(cross[self.ccStart:self.ccEnd])
-            # if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
-            #    return None
-            
-            diff = newmaxloc-self._refmaxloc
-            if diff < 0:
-                trace = np.append(np.zeros(-diff), trace[:diff])
-            elif diff > 0:
-                trace = np.append(trace[diff:], np.zeros(diff))
-            return trace
-            
-        else:
-            return self._traceSource.getTrace(n)
-   
-    def _calculateRef(self):
-        try:
+    def processBlock(self, traces, start):
+        if self._ref is None:
             self.calcRefTrace(self._rtrace)
-        except ValueError:
-            self.findParam('enabled').setValue(False)
-        
+        if self._debugReturnCorr:
+            return self._crossCorrelate(traces)
+        newmaxloc = np.argmax(self._crossCorrelate(traces, self._ccStart, self._ccEnd), axis=1)
+        # maxval = max(cross[self.ccStart:self.ccEnd])
+        # if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
+        #    return None
+
+        return shiftTraces(traces, newmaxloc - self._refmaxloc)
+
+    def _crossCorrelate(self, traces, start=0, end=None):
+        """
+        Columns start to end-1 of fftconvolve(trace, self._reftrace, mode='valid') for every row of traces, i.e. the
+        correlation of the reference with the trace shifted by each of these offsets. Only this part is transformed.
+        """
+        numoffsets = np.shape(traces)[1] - len(self._ref) + 1
+        if end is None or end > numoffsets:
+            end = numoffsets
+        return self._ref.dot(traces, start, max(0, end - start))
+
+    def _calculateRef(self):
+        # The reference is only found when traces are processed, so changing several settings doesn't read and
+        # process the reference trace every time
+        self._ref = None
+
     def calcRefTrace(self, tnum):
         # If not enabled stop
         if self.enabled == False:
             return
 
-        self._reftrace = self._traceSource.getTrace(tnum)[self._ccStart:self._ccEnd]
+        trace = np.asarray(self._traceSource.getTrace(tnum))
+        self._reftrace = trace[self._ccStart:self._ccEnd]
         self._reftrace = self._reftrace[::-1]
-        #TODO: fftconvolve
-        cross = sp.signal.fftconvolve(self._traceSource.getTrace(tnum), self._reftrace, mode='valid')
-        self._refmaxloc = np.argmax(cross[self._ccStart:self._ccEnd])
-        self._refmaxsize = max(cross[self._ccStart:self._ccEnd])
+        self._ref = SlidingReference(trace[self._ccStart:self._ccEnd])
+        cross = self._crossCorrelate(trace[np.newaxis, :], self._ccStart, self._ccEnd)[0]
+        self._refmaxloc = np.argmax(cross)
+        self._refmaxsize = max(cross)
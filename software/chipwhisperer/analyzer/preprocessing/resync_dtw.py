@@ -25,10 +25,41 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
+import atexit
+import multiprocessing
+
+import numpy as np
+
 from ._base import PreprocessingBase
-from chipwhisperer.analyzer.utils.fasterdtw import fastdtw
+from chipwhisperer.analyzer.utils.fasterdtw import warp_traces
 from chipwhisperer.common.utils.parameter import setupSetParam
 
+# Reference trace and radius of the worker processes, set once per pool by _initWorker()
+_workerRef = None
+_workerRadius = None
+
+
+# Pools not closed yet, terminated at exit if their module was never torn down
+_openPools = set()
+
+
+@atexit.register
+def _terminatePools():
+    for pool in list(_openPools):
+        pool.terminate()
+    _openPools.clear()
+
+
+def _initWorker(ref, radius):
+    global _workerRef, _workerRadius
+    _workerRef = ref
+    _workerRadius = radius
+
+
+def _warpWorker(traces):
+    return warp_traces(_workerRef, traces, _workerRadius)
+
+
 class ResyncDTW(PreprocessingBase):
     """Align traces using the Dynamic Time Warp algorithm. Doesn't play well
     with noisy traces, but can remove random per-trace delays and synchronize
@@ -37,19 +68,28 @@ class ResyncDTW(PreprocessingBase):
     _name = "Resync: Dynamic Time Warp"
     _description = "Aligns traces to match a reference trace using the Fast Dynamic Time Warp algorithm."
 
+    #Number of traces warped together by one call of warp_traces()
+    batchSize = 32
+
     def __init__(self, traceSource=None, name=None):
         PreprocessingBase.__init__(self, traceSource, name=name)
         self._rtrace = 0
         self._radius = 3
+        self._jobs = 1
+        self._ref = None
+        self._pool = None
 
         self.params.addChildren([
             {'name':'Ref Trace', 'key':'reftrace', 'type':'int', 'get':self._getRefTrace, 'set':self._setRefTrace},
-            {'name':'Radius', 'key':'radius', 'type':'int', 'get':self._getRadius, 'set':self._setRadius}
+            {'name':'Radius', 'key':'radius', 'type':'int', 'get':self._getRadius, 'set':self._setRadius},
+            {'name':'Parallel Jobs', 'key':'jobs', 'type':'int', 'limits':(1, multiprocessing.cpu_count()), 'get':self._getJobs, 'set':self._setJobs}
         ])
+        self.sigTracesChanged.connect(self._resetRef)
 
     @setupSetParam("Ref Trace")
     def _setRefTrace(self, num):
         self._rtrace = num
+        self._resetRef()
 
     def _getRefTrace(self):
         return self._rtrace
@@ -70,6 +110,7 @@ class ResyncDTW(PreprocessingBase):
     @setupSetParam("Radius")
     def _setRadius(self, radius):
         self._radius = radius
+        self._resetRef()
 
     def _getRadius(self):
         return self._radius
@@ -89,33 +130,57 @@ class ResyncDTW(PreprocessingBase):
         if not isinstance(radius, (int, long)):
             raise TypeError("Expected int; got %s" % type(radius), radius)
         self._setRadius(radius)
-   
-    def getTrace(self, n):
-        if not self.enabled:
-            return self._traceSource.getTrace(n)
-
-        trace = self._traceSource.getTrace(n)
-        ref_trace = self._traceSource.getTrace(self._rtrace)
-        if trace is None or ref_trace is None:
-            return None
-
-        aligned = self._alignTraces(ref_trace, trace)
-        return aligned
-        
-    def _alignTraces(self, ref, trace):
-        N = self._traceSource.numPoints()
-        r = self._radius
-        #try:
-        dist, path = fastdtw(ref, trace, radius=r, dist=None)
-        #except:
-        #    return None
-        px = [x for x, y in path]
-        py = [y for x, y in path]
-        n = [0] * N
-        s = [0.0] * N
-        for x, y in path:
-            s[x] += trace[y]
-            n[x] += 1
-
-        ret = [s[i] / n[i] for i in range(N)]
-        return ret
\ No newline at end of file
+
+    @setupSetParam("Parallel Jobs")
+    def _setJobs(self, jobs):
+        self._jobs = jobs
+        self._closePool()
+
+    def _getJobs(self):
+        return self._jobs
+
+    @property
+    def jobs(self):
+        """The number of worker processes warping the traces of each block.
+
+        With 1 (default) the traces are warped in this process.
+
+        Setter raises TypeError unless value is an integer."""
+        return self._getJobs()
+
+    @jobs.setter
+    def jobs(self, jobs):
+        if not isinstance(jobs, (int, long)):
+            raise TypeError("Expected int; got %s" % type(jobs), jobs)
+        self._setJobs(jobs)
+
+    def _resetRef(self):
+        self._ref = None
+        self._closePool()
+
+    def _closePool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            _openPools.discard(self._pool)
+            self._pool = None
+
+    def deregister(self):
+        """Module removed from the chain: stop the worker processes"""
+        self._closePool()
+        PreprocessingBase.deregister(self)
+
+    def processBlock(self, traces, start):
+        if self._ref is None:
+            self._ref = self._traceSource.getTrace(self._rtrace)
+        if self._ref is None or len(traces) == 0:
+            return np.nan * np.ones(np.shape(traces))
+
+        batches = [traces[i:i + self.batchSize] for i in range(0, len(traces), self.batchSize)]
+        if self._jobs > 1 and len(batches) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self._jobs, _initWorker, (np.asarray(self._ref), self._radius))
+                _openPools.add(self._pool)
+            warped = self._pool.map(_warpWorker, batches)
+        else:
+            warped = [warp_traces(self._ref, batch, self._radius) for batch in batches]
+        return np.concatenate(warped)
@@ -28,7 +28,7 @@
 import numpy as np
 
 from chipwhisperer.common.results.base import ResultsBase
-from ._base import PreprocessingBase
+from ._base import PreprocessingBase, shiftTraces
 from chipwhisperer.common.utils.parameter import setupSetParam
 
 
@@ -184,30 +184,21 @@ class ResyncPeakDetect(PreprocessingBase):
         self._ccEnd = refrange[1]
         self.init()
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            if str.lower(self._type) == 'max':
-                newmaxloc = np.argmax(trace[self._ccStart:self._ccEnd])
-                maxval = max(trace[self._ccStart:self._ccEnd])
-            else:
-                newmaxloc = np.argmin(trace[self._ccStart:self._ccEnd])
-                maxval = min(trace[self._ccStart:self._ccEnd])
-
-            if self._limit:
-                if (maxval > self._refmaxsize * (1.0 + self._limit)) | (maxval < self._refmaxsize * (1.0 - self._limit)):
-                    return None
-
-            diff = newmaxloc-self._refmaxloc
-            if diff < 0:
-                trace = np.append(np.zeros(-diff), trace[:diff])
-            elif diff > 0:
-                trace = np.append(trace[diff:], np.zeros(diff))
-            return trace
+    def processBlock(self, traces, start):
+        window = traces[:, self._ccStart:self._ccEnd]
+        if str.lower(self._type) == 'max':
+            newmaxloc = np.argmax(window, axis=1)
+            maxval = np.max(window, axis=1)
         else:
-            return self._traceSource.getTrace(n)
+            newmaxloc = np.argmin(window, axis=1)
+            maxval = np.min(window, axis=1)
+
+        out = shiftTraces(traces, newmaxloc - self._refmaxloc)
+
+        if self._limit:
+            out[(maxval > self._refmaxsize * (1.0 + self._limit)) | (maxval < self._refmaxsize * (1.0 - self._limit))] = np.nan
+
+        return out
 
     def _calculateRef(self):
         try:
@@ -44,6 +44,7 @@ class ResyncResampleZC(PreprocessingBase):
         self._rtrace = 0
         self._zcoffset = 0.0
         self._binlen = 0
+        self._reflen = None
 
         self.params.addChildren([
             {'name':'Ref Trace', 'key':'reftrace', 'type':'int', 'get':self._getRefTrace, 'set':self._setRefTrace},
@@ -119,18 +120,17 @@ class ResyncResampleZC(PreprocessingBase):
             raise TypeError("Expected float; got %s" % type(len), len)
         self._setBinLength(len)
 
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            
-            trace = trace - self._zcoffset
-    
-            ind = self._findZerocrossing(trace)
-            return self._resampleResize(trace, ind, self._binlen)
-        else:
-            return self._traceSource.getTrace(n)
+    def processBlock(self, traces, start):
+        if self._reflen is None:
+            self.calcRefTrace(self._rtrace)
+        traces = traces - self._zcoffset
+
+        # The number of bins differs from trace to trace: rows are cut or zero-padded to the resampled reference
+        block = np.zeros((len(traces), self._reflen))
+        for i, t in enumerate(traces):
+            out = self._resampleResize(t, self._findZerocrossing(t), self._binlen)[:self._reflen]
+            block[i, :len(out)] = out
+        return block
    
     def _calculateRef(self):
         try:
@@ -145,10 +145,11 @@ class ResyncResampleZC(PreprocessingBase):
         if self.enabled == False:
             return
         
+        self._reftrace = self._traceSource.getTrace(tnum) - self._zcoffset
+        ind = self._findZerocrossing(self._reftrace)
         if self._binlen == 0:
-            self._reftrace = self._traceSource.getTrace(tnum) - self._zcoffset
-            ind = self._findZerocrossing(self._reftrace)
             self._binlen = self._findAvgLength(ind)
+        self._reflen = self._binlen * len(ind)
 
     def _findZerocrossing(self, a):
         indices = find((a[1:] >= 0) & (a[:-1] < 0))
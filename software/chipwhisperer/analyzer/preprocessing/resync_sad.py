@@ -28,7 +28,8 @@
 import numpy as np
 
 from chipwhisperer.common.results.base import ResultsBase
-from ._base import PreprocessingBase
+from ._base import PreprocessingBase, shiftTraces
+from ._align import SlidingReference
 from chipwhisperer.common.utils.parameter import setupSetParam
 from collections import OrderedDict
 
@@ -49,6 +50,8 @@ class ResyncSAD(PreprocessingBase):
         self._ccEnd = 1
         self._wdStart = 0
         self._wdEnd = 1
+        self._metric = "sad"
+        self._ref = None
 
         if connectTracePlot:
             traceplot = ResultsBase.registeredObjects["Trace Output Plot"]
@@ -59,6 +62,10 @@ class ResyncSAD(PreprocessingBase):
             {'name':'Ref Trace', 'key':'reftrace', 'type':'int', 'get':self._getRefTrace, 'set':self._setRefTrace},
             {'name':'Reference Points', 'key':'refpts', 'type':'rangegraph', 'graphwidget':traceplot, 'get':self._getRefPoints, 'set':self._setRefPoints},
             {'name':'Input Window', 'key':'windowpt', 'type':'rangegraph', 'graphwidget':traceplot, 'get':self._getWindow, 'set':self._setWindow},
+            {'name':'Difference', 'key':'metric', 'type':'list', 'values':OrderedDict([('Absolute (SAD)', 'sad'), ('Squared (SSD, faster)', 'ssd')]),
+             'get':self._getMetric, 'set':self._setMetric,
+             'help':'Absolute differences (SAD) is the classic criteria. Squared differences are computed with FFTs, which '
+                    'is much faster with wide input windows, but may pick slightly different shifts.'},
              #{'name':'Valid Limit', 'type':'float', 'value':0, 'step':0.1, 'limits':(0, 10), 'set':self.setValidLimit},
             # {'name':'Output SAD (DEBUG)', 'type':'bool', 'value':False, 'set':self.setOutputSad}
         ])
@@ -144,6 +151,29 @@ class ResyncSAD(PreprocessingBase):
             raise TypeError("Expected int; got %s" % type(win[1]), win[1])
         self._setWindow(win)
 
+    @setupSetParam("Difference")
+    def _setMetric(self, metric):
+        if metric not in ("sad", "ssd"):
+            raise ValueError("Invalid difference metric: %s" % metric)
+        self._metric = metric
+        self._calculateRef()
+
+    def _getMetric(self):
+        return self._metric
+
+    @property
+    def metric(self):
+        """How the reference is compared with the input window: 'sad' (sum of absolute differences) or 'ssd' (sum of
+        squared differences).
+
+        Setter raises ValueError for any other value.
+        """
+        return self._getMetric()
+
+    @metric.setter
+    def metric(self, metric):
+        self._setMetric(metric)
+
     def updateLimits(self):
         if self._traceSource:
             self.findParam('refpts').setLimits((0, self._traceSource.numPoints()-1))
@@ -153,61 +183,51 @@ class ResyncSAD(PreprocessingBase):
     def setOutputSad(self, enabled):
         self._debugReturnSad = enabled
    
-    def getTrace(self, n):
-        if self.enabled:
-            trace = self._traceSource.getTrace(n)
-            if trace is None:
-                return None
-            sad = self._findSAD(trace)
-            
-            if self._debugReturnSad:
-                return sad
-            
-            if len(sad) == 0:
-                return None            
-            
-            newmaxloc = np.argmin(sad)
-            maxval = min(sad)
-            #if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
-            #    return None
-            
-            if maxval > self.maxthreshold:
-                return None
-            
-            diff = newmaxloc-self.refmaxloc
-            if diff < 0:
-                trace = np.append(np.zeros(-diff), trace[:diff])
-            elif diff > 0:
-                trace = np.append(trace[diff:], np.zeros(diff))
-            return trace
-        else:
-            return self._traceSource.getTrace(n)
+    def processBlock(self, traces, start):
+        if self._ref is None:
+            self.calcRefTrace(self._rtrace)
+        sad = self._findSAD(traces)
+
+        if self._debugReturnSad:
+            return sad
+
+        if sad.shape[1] == 0:
+            return np.nan * np.ones(np.shape(traces))
+
+        newmaxloc = np.argmin(sad, axis=1)
+        maxval = np.min(sad, axis=1)
+        #if (maxval > self.refmaxsize * 1.01) | (maxval < self.refmaxsize * 0.99):
+        #    return None
+
+        traces = shiftTraces(traces, newmaxloc - self.refmaxloc)
+        traces[maxval > self.maxthreshold] = np.nan
+        return traces
    
     def _calculateRef(self):
-        try:
-            self.calcRefTrace(self._rtrace)
-        #Probably shouldn't do this, but deals with user enabling preprocessing
-        #before trace management setup
-        except ValueError:
-            pass
-        
-    def _findSAD(self, inputtrace):
+        # The reference is only found when traces are processed, so changing several settings doesn't read and
+        # process the reference trace every time
+        self._ref = None
+
+    def _findSAD(self, inputtraces):
+        """SAD of the reference at every position of the input window, one row per input trace"""
         reflen = self._ccEnd - self._ccStart
-        sadlen = self._wdEnd - self._wdStart
-        sadarray = np.empty(sadlen-reflen)
-        
-        for ptstart in range(self._wdStart, self._wdEnd-reflen):
-            #Find SAD        
-            sadarray[ptstart - self._wdStart] = np.sum(np.abs(inputtrace[ptstart:(ptstart + reflen)] - self.reftrace))
-            
-        return sadarray
-        
+        count = max(0, self._wdEnd - self._wdStart - reflen)
+        if self._metric == "ssd":
+            return self._ref.ssd(inputtraces, self._wdStart, count)
+        return self._ref.sad(inputtraces, self._wdStart, count)
+
     def calcRefTrace(self, tnum):
         if self.enabled == False:
             return
-        
-        self.reftrace = self._traceSource.getTrace(tnum)[self._ccStart:self._ccEnd]
-        sad = self._findSAD(self._traceSource.getTrace(tnum))
+
+        trace = np.asarray(self._traceSource.getTrace(tnum))
+        self.reftrace = trace[self._ccStart:self._ccEnd]
+        self._ref = SlidingReference(self.reftrace)
+        sad = self._findSAD(trace[np.newaxis, :])[0]
+        if len(sad) == 0:
+            # Input window not wider than the reference, processBlock() rejects every trace
+            self.refmaxloc = self.refmaxsize = self.maxthreshold = 0
+            return
         self.refmaxloc = np.argmin(sad)
         self.refmaxsize = min(sad)
         self.maxthreshold = np.mean(sad)
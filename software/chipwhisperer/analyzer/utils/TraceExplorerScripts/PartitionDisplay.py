@@ -33,6 +33,7 @@ from PySide.QtGui import *
 import chipwhisperer.common.utils.qt_tweaks as QtFixes
 import pyqtgraph as pg
 from chipwhisperer.analyzer.utils.Partition import Partition
+from chipwhisperer.analyzer.utils.moments import MomentAccumulator, welchT
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.api.autoscript import AutoScript
 from chipwhisperer.common.api.CWCoreAPI import CWCoreAPI
@@ -70,12 +71,8 @@ class DifferenceModeTTest(object):
                     return SADSeg
 
             if means[bnum][i] is not None and means[bnum][j] is not None:
-                ttest = np.subtract(means[bnum][i], means[bnum][j])
-                ttest /= np.sqrt((var[bnum][i]/num[bnum][i]) + (var[bnum][j]/num[bnum][j]))
-
-                # if t-test is NaN indicates perhaps exact same data
-                ttest = np.nan_to_num(ttest)
-
+                # if t-test is NaN indicates perhaps exact same data, welchT() sets it to 0
+                ttest = welchT(means[bnum][i], var[bnum][i], num[bnum][i], means[bnum][j], var[bnum][j], num[bnum][j])
                 SADSeg[bnum] = np.add(SADSeg[bnum], np.abs(ttest))
 
         if pbDialog:
@@ -405,27 +402,14 @@ class PartitionDisplay(Parameterized, AutoScript):
             fname = self.api.project().convertDataFilepathAbs(foundsecs[0]["filename"])
             stats = np.load(fname)
         else:
-            # Array to hold average + stddev of all traces/partitions
-            A_k = []
-            A_j = []
-            Q_k = []
-            dataArrays = [A_k, A_j, Q_k]
-            ACnt = []
-            for bnum in range(0, self.numKeys):
-                for d in dataArrays:
-                    d.append([])
-                ACnt.append([])
-                for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                    for d in dataArrays:
-                        d[bnum].append(np.zeros(numPoints))
-                    ACnt[bnum].append(0)
+            numParts = self.partObject.partMethod.getNumPartitions()
 
             # Get segment list
             segList = traces.getSegmentList()
 
             if progressBar:
                 progressBar.setWindowTitle("Phase 1: Trace Statistics")
-                progressBar.setMaximum(bnum)  # len(segList['offsetList']) * self.numKeys)
+                progressBar.setMaximum(max(1, (tRange[1] - tRange[0] - 2) / traces.blockSize))  # len(segList['offsetList']) * self.numKeys)
                 progressBar.show()
 
             # TODO: Double-check this fix
@@ -437,42 +421,37 @@ class PartitionDisplay(Parameterized, AutoScript):
             # Require partition list
             partData = partitionData["partdata"]
 
-
-            # print "Calculating Average + Std-Dev"
-            # Std-Dev calculation:
-            # A[0] = 0
-            # A[k] = A[k-1] + (x[k] - A[k-1]) / k
-            # Q[0] = 0
-            # Q[k] = Q[k-1] + (x[k] - A[k-1])(x[k] - A[k])
+            # Partition number of every trace for each subkey (-1 = not in range), so each block of traces is
+            # only read once and added to the running mean/variance of all subkeys (see MomentAccumulator)
+            tbase = tRange[0] + 1
+            tracePart = np.full((self.numKeys, max(0, tRange[1] - tbase)), -1, dtype=np.int64)
             for bnum in range(0, self.numKeys):
-                progressBar.updateStatus(tsegn * self.numKeys + bnum)
+                for i in range(0, numParts):
+                    tnums = np.asarray(partData[bnum][i], dtype=np.int64)
+                    tnums = tnums[(tnums > tRange[0]) & (tnums < tRange[1])]
+                    tracePart[bnum][tnums - tbase] = i
+
+            accs = [MomentAccumulator(numParts, numPoints) for _ in range(0, self.numKeys)]
+            for bstart in range(tbase, tRange[1], traces.blockSize):
+                progressBar.updateStatus((bstart - tbase) / traces.blockSize)
                 if progressBar.wasAborted():
                     break
-                for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                    util.updateUI()
-                    tlist = partData[bnum][i]
-                    if len(tlist) > 0:
-                        for tnum in tlist:
-                            if tnum > tRange[0] and tnum < tRange[1]:
-                                t = traces.getTrace(tnum)
-                                ACnt[bnum][i] += 1
-                                A_k[bnum][i] = A_k[bnum][i] + (t - A_j[bnum][i]) / ACnt[bnum][i]
-                                Q_k[bnum][i] = Q_k[bnum][i] + ((t - A_j[bnum][i]) * (t - A_k[bnum][i]))
-                                A_j[bnum][i] = A_k[bnum][i]
+                util.updateUI()
+                bend = min(bstart + traces.blockSize, tRange[1])
+                block = traces.getTraces(bstart, bend)
+                for bnum in range(0, self.numKeys):
+                    accs[bnum].addBlock(block, tracePart[bnum][bstart - tbase:bend - tbase])
 
             if progressBar.wasAborted():
                 progressBar.hide()
                 return
 
-            # Finally get variance
-            for bnum in range(0, self.numKeys):
-                    for i in range(0, self.partObject.partMethod.getNumPartitions()):
-                        # TODO: Should be using population variance or sample variance (e.g. /n or /n-1)?
-                        #      Since this is taken over very large sample sizes I imagine it won't matter
-                        #      ultimately.
-                        Q_k[bnum][i] = Q_k[bnum][i] / max(ACnt[bnum][i] - 1, 1)
-
-            # Average is in A_k
+            # TODO: Should be using population variance or sample variance (e.g. /n or /n-1)?
+            #      Since this is taken over very large sample sizes I imagine it won't matter
+            #      ultimately.
+            A_k = [list(acc.mean()) for acc in accs]
+            Q_k = [list(acc.variance(ddof=1)) for acc in accs]
+            ACnt = [list(acc.count()) for acc in accs]
             stats = {"mean":A_k, "variance":Q_k, "number":ACnt}
 
             # Wasn't cancelled - save this to project file for future use if requested
@@ -242,4 +242,153 @@ def __expand_window(path, len_x, len_y, radius):
                 break
         start_j = new_start_j
 
-    return window
\ No newline at end of file
+    return window
+
+
+# NumPy implementation of the same FastDTW algorithm, used by the DTW resync preprocessing to warp a whole block of
+# traces onto one reference. The search window of every row of the cost matrix is one contiguous range of columns, so
+# the DP is done one row at a time for all traces at once, in preallocated arrays, and the paths are walked back for
+# all traces at once too.
+
+def warp_traces(ref, traces, radius=1):
+    ''' warp every row of traces onto the time base of ref with FastDTW, using abs(ref[i] - trace[j]) as distance
+
+        Point i of each result is the average of the trace points matched with ref[i], as found by
+        fastdtw(ref, trace, radius). Equal costs may be broken differently than fastdtw() due to rounding.
+
+        Parameters
+        ----------
+        ref : array_like
+            reference trace
+        traces : array_like
+            2D array, one trace per row
+        radius : int
+            size of neighborhood when expanding the path, see fastdtw()
+
+        Returns
+        -------
+        array
+            2D array of len(traces) x len(ref) warped traces
+    '''
+    ref = np.asarray(ref, dtype=np.float64)
+    traces = np.atleast_2d(np.asarray(traces, dtype=np.float64))
+    return _warp_level(ref, traces, radius, True)
+
+
+def _warp_level(x, Y, radius, average):
+    len_x, len_y = len(x), Y.shape[1]
+    if len_x < radius + 2 or len_y < radius + 2:
+        lo = np.zeros((len(Y), len_x), dtype=np.int64)
+        hi = np.full((len(Y), len_x), len_y - 1, dtype=np.int64)
+    else:
+        jmin, jmax = _warp_level(_reduce_by_half(x), _reduce_by_half(Y), radius, False)
+        lo, hi = _expand_windows(jmin, jmax, len_x, len_y, radius)
+    return _dtw_windows(x, Y, lo, hi, average)
+
+
+def _reduce_by_half(x):
+    n = x.shape[-1] - x.shape[-1] % 2
+    return (x[..., 0:n:2] + x[..., 1:n:2]) / 2
+
+
+def _expand_windows(jmin, jmax, len_x, len_y, radius):
+    ''' return the first and last column (lo, hi) of the search window of each row, for each trace, from the columns
+        spanned by the path at half the resolution grown by radius, as done by __expand_window()
+    '''
+    ncoarse = jmin.shape[1]
+    rows = np.arange((len_x + 1) // 2)
+    # The path is monotonic, so the neighbourhood of rows r-radius..r+radius starts and ends at these columns
+    lo = jmin[:, np.clip(rows - radius, 0, ncoarse - 1)] - radius
+    hi = jmax[:, np.clip(rows + radius, 0, ncoarse - 1)] + radius
+
+    # Each coarse cell covers 2x2 cells of the full matrix
+    lo = np.clip(np.repeat(2 * lo, 2, axis=1)[:, :len_x], 0, len_y - 1)
+    hi = np.clip(np.repeat(2 * hi + 1, 2, axis=1)[:, :len_x], 0, len_y - 1)
+    lo[:, 0] = 0
+    hi[:, -1] = len_y - 1
+    # Keep the window connected, so the last cell can always be reached
+    hi[:, :-1] = np.maximum(hi[:, :-1], lo[:, 1:] - 1)
+    return lo, hi
+
+
+def _dtw_windows(x, Y, lo, hi, average):
+    ''' DTW of x against every row of Y, with the window of row i of trace t limited to columns lo[t, i]..hi[t, i]
+
+        Returns the warped traces if average is True, otherwise the first and last column of the path in each row.
+    '''
+    ntraces, len_y = Y.shape
+    len_x = len(x)
+    tidx = np.arange(ntraces)[:, np.newaxis]
+    ybase = tidx * len_y
+    Yflat = Y.ravel()
+    width = (hi - lo).max(axis=0) + 1
+    steps = np.arange(width.max() + 1)
+    codetype = np.int16 if width.max() < 2**14 else np.int32
+
+    # For every cell, where the best path into it leaves the row: the path comes from the left up to column 'stop',
+    # which is reached from the row above (diagonally, or straight 'up'). Stored as stop * 2 + up, one ntraces x
+    # width[i] array per row, so the path can be walked back one row at a time.
+    codes = []
+
+    # D[i, j] = c[i, j] + min(D[i-1, j-1], D[i-1, j], D[i, j-1]). With a[j] = min(D[i-1, j-1], D[i-1, j]) and C the
+    # running sum of the costs of row i this is D[i, j] = C[j] + min(a[k] - C[k-1] for k <= j): one accumulate per row.
+    # Rows are kept with an extra inf column at the end, which is what reads outside the window return.
+    prev = np.array([[0.0, np.inf]] * ntraces)
+    prevlo = np.full(ntraces, -1, dtype=np.int64)
+    for i in range(len_x):
+        w = width[i]
+        cols = lo[:, i, np.newaxis] + steps[:w]
+
+        # D[i-1, j] for j = lo - 1 .. hi
+        pidx = cols - prevlo[:, np.newaxis]
+        pidx = np.concatenate((pidx[:, :1] - 1, pidx), axis=1)
+        pw = prev.shape[1] - 1
+        above = np.take(prev, tidx * (pw + 1) + np.where((pidx >= 0) & (pidx < pw), pidx, pw))
+        diag = above[:, :-1]
+        up = above[:, 1:]
+
+        c = np.abs(x[i] - np.take(Yflat, ybase + np.minimum(cols, len_y - 1)))
+        C = np.cumsum(c, axis=1)
+        row = np.empty((ntraces, w + 1))
+        row[:, :w] = C + np.minimum.accumulate(np.minimum(diag, up) - (C - c), axis=1)
+        row[:, :w][cols > hi[:, i, np.newaxis]] = np.inf
+        row[:, w] = np.inf
+
+        # row[:, -1] is inf, so row[:, k - 1] is the cell on the left (inf for k = 0)
+        left = row[:, np.arange(-1, w - 1)]
+        fromup = up < np.minimum(diag, left)
+        fromleft = (left < diag) & ~fromup
+        codes.append(np.maximum.accumulate(np.where(fromleft, -1, 2 * steps[:w] + fromup), axis=1).astype(codetype))
+
+        prev = row
+        prevlo = lo[:, i]
+
+    # Walk the paths back, one row at a time: in row i the path covers columns jstart to jend
+    tidx = tidx[:, 0]
+    jend = np.full(ntraces, len_y - 1, dtype=np.int64)
+    if average:
+        csum = np.zeros((ntraces, len_y + 1))
+        np.cumsum(Y, axis=1, out=csum[:, 1:])
+        out = np.empty((ntraces, len_x))
+    else:
+        jmin = np.empty((ntraces, len_x), dtype=np.int64)
+        jmax = np.empty((ntraces, len_x), dtype=np.int64)
+
+    for i in range(len_x - 1, -1, -1):
+        l = lo[:, i]
+        code = codes[i][tidx, np.clip(jend - l, 0, width[i] - 1)].astype(np.int64)
+        jstart = np.minimum(l + (code >> 1), jend)
+        if i == 0:
+            jstart[:] = 0
+        if average:
+            out[:, i] = (csum[tidx, jend + 1] - csum[tidx, jstart]) / (jend - jstart + 1)
+        else:
+            jmin[:, i] = jstart
+            jmax[:, i] = jend
+        if i > 0:
+            # Diagonal move to the previous column, or straight up (the diagonal is the only way at the edge)
+            jend = np.clip(jstart - 1 + (code & 1), lo[:, i - 1], hi[:, i - 1])
+
+    if average:
+        return out
+    return jmin, jmax
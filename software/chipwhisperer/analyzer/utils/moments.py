@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import numpy as np
+
+
+def _binomial(n, k):
+    ret = 1
+    for i in range(1, k + 1):
+        ret = ret * (n - k + i) // i
+    return ret
+
+
+def welchT(mean0, var0, num0, mean1, var1, num1):
+    """Welch's t-statistic between two groups given their mean, variance and size (NaN results are set to 0)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ttest = np.subtract(mean0, mean1)
+        ttest /= np.sqrt((var0 / num0) + (var1 / num1))
+    return np.nan_to_num(ttest)
+
+
+class MomentAccumulator(object):
+    """
+    Running statistics of traces split into groups (e.g. the partitions of a TVLA test).
+
+    For every group this keeps the number of traces, the mean and the sums of the central moments up to maxOrder
+    (M_p = sum((x - mean)^p)) at every point. Traces are added a block at a time along with the group number of each
+    trace; each block is reduced per group and combined with the running sums using the pairwise update of
+    Pebay ("Formulas for robust, one-pass parallel computation of covariances and arbitrary-order statistical
+    moments", 2008), which is also used by merge() to combine accumulators filled by separate workers.
+
+    maxOrder=2 gives mean and variance; an order d t-test needs maxOrder >= 2*d.
+    """
+
+    def __init__(self, numGroups, numPoints, maxOrder=2):
+        if maxOrder < 2:
+            raise ValueError("maxOrder must be at least 2, got %d" % maxOrder)
+        self.numGroups = numGroups
+        self.numPoints = numPoints
+        self.maxOrder = maxOrder
+        self.clear()
+
+    def clear(self):
+        self.n = np.zeros(self.numGroups, dtype=np.int64)
+        self.mu = np.zeros((self.numGroups, self.numPoints))
+        # M[p] holds the central moment sums of order p; M[0] and M[1] are unused (always n and 0)
+        self.M = np.zeros((self.maxOrder + 1, self.numGroups, self.numPoints))
+
+    def addBlock(self, traces, groups):
+        """
+        Add a block of traces (2D array, one trace per row) where trace i belongs to group groups[i].
+
+        Traces with a negative group number or which are NaN (rejected by preprocessing) are skipped.
+        """
+        traces = np.asarray(traces, dtype=np.float64)
+        groups = np.asarray(groups, dtype=np.int64)
+        keep = (groups >= 0) & ~np.isnan(traces[:, 0])
+        if not np.all(keep):
+            traces = traces[keep]
+            groups = groups[keep]
+        if len(groups) == 0:
+            return
+
+        # Sort by group so each group is one run of rows, then reduce every run
+        order = np.argsort(groups, kind='mergesort')
+        groups = groups[order]
+        traces = traces[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        gnums = groups[starts]
+        counts = np.diff(np.r_[starts, len(groups)])
+
+        block = MomentAccumulator(self.numGroups, self.numPoints, self.maxOrder)
+        block.n[gnums] = counts
+        block.mu[gnums] = np.add.reduceat(traces, starts, axis=0) / counts[:, None]
+        dev = traces - np.repeat(block.mu[gnums], counts, axis=0)
+        devp = dev * dev
+        for p in range(2, self.maxOrder + 1):
+            block.M[p][gnums] = np.add.reduceat(devp, starts, axis=0)
+            if p < self.maxOrder:
+                devp *= dev
+
+        self.merge(block)
+
+    def merge(self, other):
+        """Combine the statistics of other (same shape) into this accumulator"""
+        if (other.numGroups, other.numPoints, other.maxOrder) != (self.numGroups, self.numPoints, self.maxOrder):
+            raise ValueError("Can't merge accumulators of different shapes")
+
+        na = self.n.astype(np.float64)[:, None]
+        nb = other.n.astype(np.float64)[:, None]
+        n = na + nb
+        # Groups empty on either side are handled by the final np.where, avoid dividing by 0 meanwhile
+        safen = np.where(n > 0, n, 1)
+        safena = np.where(na > 0, na, 1)
+        safenb = np.where(nb > 0, nb, 1)
+        delta = other.mu - self.mu
+
+        M = np.zeros_like(self.M)
+        for p in range(2, self.maxOrder + 1):
+            M[p] = self.M[p] + other.M[p]
+            for k in range(1, p - 1):
+                M[p] += _binomial(p, k) * delta ** k * ((-nb / safen) ** k * self.M[p - k] + (na / safen) ** k * other.M[p - k])
+            M[p] += (na * nb / safen * delta) ** p * (1.0 / safenb ** (p - 1) - (-1.0 / safena) ** (p - 1))
+
+        mu = self.mu + delta * nb / safen
+
+        onlyA = (nb == 0)[None]
+        onlyB = (na == 0)[None]
+        self.M = np.where(onlyA, self.M, np.where(onlyB, other.M, M))
+        self.mu = np.where(nb == 0, self.mu, np.where(na == 0, other.mu, mu))
+        self.n = self.n + other.n
+
+    def count(self):
+        """Number of traces in each group"""
+        return self.n
+
+    def mean(self):
+        """Mean of each group (0 for empty groups)"""
+        return self.mu
+
+    def centralMoment(self, p):
+        """Central moment of order p of each group, E[(x - mean)^p]"""
+        if p == 1:
+            return np.zeros_like(self.mu)
+        return self.M[p] / np.maximum(self.n, 1)[:, None]
+
+    def variance(self, ddof=0):
+        """Variance of each group, with the divisor n - ddof (at least 1)"""
+        return self.M[2] / np.maximum(self.n - ddof, 1)[:, None]
+
+    def ttestStats(self, order=1):
+        """
+        Return (mean, variance) of the statistic compared by an order d univariate t-test, for each group.
+
+        Order 1 compares the traces, order 2 the squared centered traces and higher orders the standardized
+        traces ((x - mean) / std)^d, as described by Schneider and Moradi ("Leakage assessment methodology", 2015).
+        """
+        if 2 * order > self.maxOrder:
+            raise ValueError("Order %d t-test needs moments up to %d, accumulator has %d" % (order, 2 * order, self.maxOrder))
+        if order == 1:
+            return self.mu, self.variance()
+
+        cm = dict((p, self.centralMoment(p)) for p in set([2, order, 2 * order]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if order == 2:
+                return cm[2], cm[4] - cm[2] ** 2
+            return cm[order] / cm[2] ** (order / 2.0), (cm[2 * order] - cm[order] ** 2) / cm[2] ** order
+
+    def ttest(self, order=1, groups=(0, 1)):
+        """Welch's t-test of the given order between two groups"""
+        mean, var = self.ttestStats(order)
+        a, b = groups
+        return welchT(mean[a], var[a], self.n[a], mean[b], var[b], self.n[b])
+
+
+class CovarianceAccumulator(object):
+    """
+    Running mean and covariance matrix of traces split into groups (e.g. the partitions used to build templates).
+
+    For every group this keeps the number of traces, the mean and the sum of the outer products of the deviations
+    from the mean (the co-moment matrix). Blocks are reduced per group and combined with the running sums using the
+    pairwise update of Chan et al. ("Algorithms for computing the sample variance", 1979), which merge() also uses to
+    combine accumulators filled by separate workers or from separate captures.
+    """
+
+    def __init__(self, numGroups, numPoints):
+        self.numGroups = numGroups
+        self.numPoints = numPoints
+        self.clear()
+
+    def clear(self):
+        self.n = np.zeros(self.numGroups, dtype=np.int64)
+        self.mu = np.zeros((self.numGroups, self.numPoints))
+        self.C = np.zeros((self.numGroups, self.numPoints, self.numPoints))
+
+    def addBlock(self, traces, groups):
+        """
+        Add a block of traces (2D array, one trace per row) where trace i belongs to group groups[i].
+
+        Traces with a negative group number or which are NaN (rejected by preprocessing) are skipped.
+        """
+        traces = np.asarray(traces, dtype=np.float64)
+        groups = np.asarray(groups, dtype=np.int64)
+        keep = (groups >= 0) & ~np.isnan(traces[:, 0])
+        if not np.all(keep):
+            traces = traces[keep]
+            groups = groups[keep]
+        if len(groups) == 0:
+            return
+
+        order = np.argsort(groups, kind='mergesort')
+        groups = groups[order]
+        traces = traces[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        gnums = groups[starts]
+        counts = np.diff(np.r_[starts, len(groups)])
+
+        block = CovarianceAccumulator(self.numGroups, self.numPoints)
+        block.n[gnums] = counts
+        block.mu[gnums] = np.add.reduceat(traces, starts, axis=0) / counts[:, None]
+        dev = traces - np.repeat(block.mu[gnums], counts, axis=0)
+        block.C[gnums] = np.add.reduceat(dev[:, :, None] * dev[:, None, :], starts, axis=0)
+
+        self.merge(block)
+
+    def merge(self, other):
+        """Combine the statistics of other (same shape) into this accumulator"""
+        if (other.numGroups, other.numPoints) != (self.numGroups, self.numPoints):
+            raise ValueError("Can't merge accumulators of different shapes")
+
+        na = self.n.astype(np.float64)
+        nb = other.n.astype(np.float64)
+        n = np.where(na + nb > 0, na + nb, 1)
+        delta = other.mu - self.mu
+
+        self.C = self.C + other.C + (na * nb / n)[:, None, None] * delta[:, :, None] * delta[:, None, :]
+        self.mu = self.mu + delta * (nb / n)[:, None]
+        self.n = self.n + other.n
+
+    def count(self):
+        """Number of traces in each group"""
+        return self.n
+
+    def mean(self):
+        """Mean of each group (0 for empty groups)"""
+        return self.mu
+
+    def covariance(self, ddof=1):
+        """Covariance matrix of each group, with the divisor n - ddof (at least 1)"""
+        return self.C / np.maximum(self.n - ddof, 1)[:, None, None]
+
+
+class RegressionAccumulator(object):
+    """
+    Running simple linear regression of every point of the traces against one leakage value per trace.
+
+    tstat() returns, for every point, the t-statistic of the slope (slope divided by its standard error). The traces
+    are shifted by the mean of the first block before summing, which keeps the sums of squares well conditioned.
+    """
+
+    def __init__(self, numPoints):
+        self.numPoints = numPoints
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.sx = 0.0
+        self.sxx = 0.0
+        self.shift = None
+        self.sy = np.zeros(self.numPoints)
+        self.syy = np.zeros(self.numPoints)
+        self.sxy = np.zeros(self.numPoints)
+
+    def addBlock(self, x, traces):
+        """Add a block of traces (2D array, one trace per row) with leakage x[i] for trace i, skipping NaN traces"""
+        x = np.asarray(x, dtype=np.float64)
+        traces = np.asarray(traces, dtype=np.float64)
+        keep = ~np.isnan(traces[:, 0])
+        if not np.all(keep):
+            x = x[keep]
+            traces = traces[keep]
+        if len(x) == 0:
+            return
+
+        if self.shift is None:
+            self.shift = np.mean(traces, axis=0)
+        y = traces - self.shift
+        self.n += len(x)
+        self.sx += np.sum(x)
+        self.sxx += np.dot(x, x)
+        self.sy += np.sum(y, axis=0)
+        self.syy += np.sum(y * y, axis=0)
+        self.sxy += np.dot(x, y)
+
+    def tstat(self):
+        """t-statistic of the regression slope at every point (NaN if undefined)"""
+        if self.n < 3:
+            return np.full(self.numPoints, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sxx = self.sxx - self.sx ** 2 / self.n
+            syy = self.syy - self.sy ** 2 / self.n
+            sxy = self.sxy - self.sx * self.sy / self.n
+            slope = sxy / sxx
+            see = np.maximum(syy - slope * sxy, 0)
+            return slope / np.sqrt(see / (self.n - 2) / sxx)
@@ -26,6 +26,7 @@
 
 
 import numpy as np
+from chipwhisperer.analyzer.utils.moments import MomentAccumulator, welchT
 
 def partition_traces(tracemanager, ptool, start_trace=0, end_trace=None, index_only=False, key_guess=None, point_range=None):
     """
@@ -48,38 +49,84 @@ def partition_traces(tracemanager, ptool, start_trace=0, end_trace=None, index_o
 
     groups = [list() for _ in xrange(ptool.num_parts)]
 
-    for i in range(start_trace, end_trace):
-        gnum = ptool.get_partition(i, key_guess=key_guess)
-        if index_only:
-            data = i
-        else:
+    for bstart in range(start_trace, end_trace, tracemanager.blockSize):
+        bend = min(bstart + tracemanager.blockSize, end_trace)
+        if not index_only:
+            traces = tracemanager.getTraces(bstart, bend)
             if point_range:
-                data = tracemanager.getTrace(i)[point_range[0]:point_range[1]]
+                traces = traces[:, point_range[0]:point_range[1]]
+
+        for i in range(bstart, bend):
+            gnum = ptool.get_partition(i, key_guess=key_guess)
+            if index_only:
+                data = i
             else:
-                data = tracemanager.getTrace(i)
-        groups[gnum].append(data)
+                data = traces[i - bstart]
+            groups[gnum].append(data)
 
     return groups
 
 
-def wttest(groups, axis=0):
+def partition_stats(tracemanager, ptool, start_trace=0, end_trace=None, key_guess=None, point_range=None, order=1):
+    """
+    Partitions traces like partition_traces(), but only keeps running statistics of each group instead of the traces.
+
+    Args:
+        tracemanager: traceManager object.
+        ptool: partition tool object.
+        start_trace: Starting trace number.
+        end_trace: Ending trace number.
+        key_guess: Overrides known-key with specified guess, None if you want to use known-key for partition.
+        point_range: (start, end) of the points to keep, None for all points.
+        order: Highest t-test order the statistics will be used for.
+
+    Returns: MomentAccumulator with one group per partition, can be passed to wttest() and dpa().
+
+    """
+    ptool.new_run()
+    if end_trace is None:
+        end_trace = tracemanager.numTraces()
+
+    if point_range:
+        numpoints = point_range[1] - point_range[0]
+    else:
+        numpoints = tracemanager.numPoints()
+    stats = MomentAccumulator(ptool.num_parts, numpoints, max(2, 2 * order))
+
+    for bstart in range(start_trace, end_trace, tracemanager.blockSize):
+        bend = min(bstart + tracemanager.blockSize, end_trace)
+        traces = tracemanager.getTraces(bstart, bend)
+        if point_range:
+            traces = traces[:, point_range[0]:point_range[1]]
+        gnums = [ptool.get_partition(i, key_guess=key_guess) for i in range(bstart, bend)]
+        stats.addBlock(traces, gnums)
+
+    return stats
+
+
+def wttest(groups, axis=0, order=1):
     """
     Performs Welsch T-Test against two groups
     Args:
-        groups: List of groups (returned from partition_traces).
+        groups: List of groups (returned from partition_traces), or MomentAccumulator (returned from partition_stats).
         axis: 'axis' argument passed to numpy var() and mean() functions.
+        order: Order of the t-test, only supported with a MomentAccumulator.
 
     Returns: t-test data (same length of traces).
 
     """
+    if isinstance(groups, MomentAccumulator):
+        if groups.numGroups != 2:
+            raise AttributeError("Invalid number of groups for t-test, expecting 2, got %d" % groups.numGroups)
+        return groups.ttest(order)
+
     if len(groups) != 2:
         raise AttributeError( "Invalid number of groups for t-test, expecting 2, got %d" %len(groups))
+    if order != 1:
+        raise AttributeError("Higher order t-test needs the statistics from partition_stats()")
 
-    ttest = np.subtract(np.mean(groups[0], axis=axis), np.mean(groups[1], axis=axis))
-    ttest /= np.sqrt((np.var(groups[0] ,axis=axis ) /len(groups[0])) + (np.var(groups[1], axis=axis ) /len(groups[1])))
-    ttest = np.nan_to_num(ttest)
-
-    return ttest
+    return welchT(np.mean(groups[0], axis=axis), np.var(groups[0], axis=axis), len(groups[0]),
+                  np.mean(groups[1], axis=axis), np.var(groups[1], axis=axis), len(groups[1]))
 
 def dpa(groups, axis=0):
     """
@@ -92,6 +139,9 @@ def dpa(groups, axis=0):
 
     """
 
+    if isinstance(groups, MomentAccumulator):
+        return np.subtract(groups.mean()[1], groups.mean()[0])
+
     if len(groups) != 2:
         raise AttributeError("dpa only works between two groups")
 
@@ -239,6 +239,12 @@ class OpenADC(ScopeTemplate, Plugin, util.DisableNewAttr):
             self.setAutorefreshDCM(self.findParam('Auto-Refresh DCM Status'))
         return ret
 
+    def sampleScaling(self):
+        # Samples are the 10-bit ADC codes / 1024 - offset (see OpenADCInterface.processData())
+        if self.qtadc.sc is None:
+            return None
+        return (1 / 1024.0, self.qtadc.sc.offset)
+
     def getLastTrace(self):
         """Return the last trace captured with this scope.
         """
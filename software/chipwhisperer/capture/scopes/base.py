@@ -80,6 +80,13 @@ class ScopeTemplate(Parameterized):
         # raise NotImplementedError("Scope \"" + self.getName() + "\" does not implement method " + self.__class__.__name__ + ".arm()")
         pass
 
+    def sampleScaling(self):
+        """
+        Return (scale, offset) if the samples of this scope are integer ADC codes converted as code * scale - offset,
+        or None. Used by trace containers storing the raw codes instead of floats.
+        """
+        return None
+
     def capture(self):
         """Capture one trace and returns True if timeout has happened."""
 
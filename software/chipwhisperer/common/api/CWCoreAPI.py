@@ -380,6 +380,12 @@ class CWCoreAPI(Parameterized):
                             notes_str += "%s" % t + ", ".join([str(item) for item in aux_dict[t] if item])
                     currentTrace.config.setAttr("notes", notes_str)
                     currentTrace.setTraceHint(this_seg_size)
+                    if getattr(currentTrace, "getCompactStorage", None) and currentTrace.getCompactStorage():
+                        scaling = scope.sampleScaling() if scope is not None else None
+                        if scaling is not None:
+                            currentTrace.setSampleScaling(*scaling)
+                        else:
+                            logging.warning("Scope doesn't provide raw ADC samples, storing traces as floats")
 
                     if waveBuffer is not None:
                         currentTrace.setTraceBuffer(waveBuffer)
@@ -23,10 +23,15 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
 import ConfigParser
+import bisect
+import collections
+import json
 import logging
 import os.path
 import re
 
+import numpy as np
+
 from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.tracesource import TraceSource
@@ -37,8 +42,19 @@ class TraceManager(TraceSource):
     When using traces in ChipWhisperer, you may have remapped a bunch of trace files into one
     segment of traces. This class is used to handle the remapping and provide methods to save,
     load and manage the traces.
+
+    Saving a project also writes a segment index to its data directory, holding the attributes of every segment needed
+    to map the traces (see indexAttrs) along with the modification time and size of its config file. When the project is
+    opened again, segments whose config file hasn't changed take their attributes from the index, and their config file
+    is only parsed when something else is needed from it.
     """
 
+    #File name of the segment index, in the project data directory
+    segmentIndexName = "segmentindex.json"
+
+    #Segment config attributes kept in the segment index
+    indexAttrs = ("numTraces", "numPoints", "scopeSampleRate", "sampleScale", "sampleOffset", "prefix")
+
     def __init__(self, name = "Trace Management"):
         TraceSource.__init__(self, name)
         self.name = name
@@ -48,22 +64,91 @@ class TraceManager(TraceSource):
         self._sampleRate = 0
         self.lastUsedSegment = None
         self.traceSegments = []
+        self._enabledSegments = []
+        self._segmentStarts = []
+        self._openSegments = collections.OrderedDict()  # id(segment) -> segment, least recently used first
+        self.maxOpenSegments = 8
+        self.maxOpenBytes = None
+        self.segmentOpens = 0
+        self.segmentCloses = 0
         if __debug__: logging.debug('Created: ' + str(self))
 
     def newProject(self):
         """Create a new empty set of traces."""
         self.traceSegments = []
+        self._updateRanges()
         self.dirty.setValue(False)
         self.sigTracesChanged.emit()
 
     def saveProject(self, config, configfilename):
         """Save the trace segments information to a project file."""
         config[self.name].clear()
+        relnames = []
         for indx, t in enumerate(self.traceSegments):
-            config[self.name]['tracefile%d' % indx] = os.path.normpath(os.path.relpath(t.config.configFilename(), os.path.split(configfilename)[0]))
+            relname = os.path.normpath(os.path.relpath(t.config.configFilename(), os.path.split(configfilename)[0]))
+            config[self.name]['tracefile%d' % indx] = relname
             config[self.name]['enabled%d' % indx] = str(t.enabled)
+            relnames.append(relname)
+        self._saveSegmentIndex(configfilename, relnames)
         self.dirty.setValue(False)
 
+    @classmethod
+    def _segmentIndexFilename(cls, configfilename):
+        return os.path.join(os.path.splitext(configfilename)[0] + "_data", cls.segmentIndexName)
+
+    @staticmethod
+    def _fileStamp(fname):
+        st = os.stat(fname)
+        return [st.st_mtime, st.st_size]
+
+    @staticmethod
+    def _segmentDtype(t):
+        """dtype string of the traces of segment t, without loading it if possible (None if unknown)"""
+        if getattr(t.traces, "dtype", None) is not None:
+            return t.traces.dtype.str
+        if t.config.isDeferred() and t.tracedtype is not None:
+            return np.dtype(t.tracedtype).str
+        try:
+            prefix = t.config.attr("prefix")
+            return np.load(os.path.join(os.path.dirname(t.config.configFilename()), "%straces.npy" % prefix), mmap_mode='r').dtype.str
+        except (IOError, ValueError, TypeError):
+            return None
+
+    def _saveSegmentIndex(self, configfilename, relnames):
+        segments = {}
+        for relname, t in zip(relnames, self.traceSegments):
+            try:
+                stamp = self._fileStamp(t.config.configFilename())
+            except (OSError, TypeError):
+                continue
+            entry = {"stamp":stamp, "dtype":self._segmentDtype(t)}
+            for attr in self.indexAttrs:
+                entry[attr] = t.config.attr(attr)
+            segments[relname] = entry
+
+        fname = self._segmentIndexFilename(configfilename)
+        try:
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, "w") as f:
+                json.dump({"version":1, "segments":segments}, f)
+        except (IOError, OSError) as e:
+            logging.warning("Could not write segment index %s: %s" % (fname, str(e)))
+
+    def _loadSegmentIndex(self, configfilename):
+        fname = self._segmentIndexFilename(configfilename)
+        if not os.path.isfile(fname):
+            return {}
+        try:
+            with open(fname) as f:
+                index = json.load(f)
+            if index.get("version") != 1:
+                return {}
+            return index["segments"]
+        except (IOError, ValueError, KeyError, AttributeError) as e:
+            logging.warning("Ignoring unreadable segment index %s: %s" % (fname, str(e)))
+            return {}
+
     def loadProject(self, configfilename):
         """Load the trace segments information from a project file."""
         config = ConfigParser.RawConfigParser()
@@ -72,6 +157,7 @@ class TraceManager(TraceSource):
         self.newProject()
 
         fdir = os.path.split(configfilename)[0] + "/"
+        index = self._loadSegmentIndex(configfilename)
 
         for t in alltraces:
             if t[0].startswith("tracefile"):
@@ -79,10 +165,17 @@ class TraceManager(TraceSource):
                 fname = os.path.normpath(fname.replace("\\", "/"))
                 # print "Opening %s"%fname
                 ti = TraceContainerNative()
+                entry = index.get(t[1])
                 try:
-                    ti.config.loadTrace(fname)
+                    if entry is not None and entry.get("stamp") == self._fileStamp(fname):
+                        ti.config.deferLoad(fname, dict([(a, entry[a]) for a in self.indexAttrs]))
+                        if entry.get("dtype"):
+                            ti.tracedtype = np.dtype(str(entry["dtype"]))
+                        ti._readSampleScaling()
+                    else:
+                        ti.config.loadTrace(fname)
                 except Exception, e:
-                    logging.error(e.message)
+                    logging.error(str(e))
                 self.traceSegments.append(ti)
             if t[0].startswith("enabled"):
                 tnum = re.findall(r'[0-9]+', t[0])
@@ -123,23 +216,76 @@ class TraceManager(TraceSource):
 
     def getSegment(self, traceIndex):
         """Return the trace segment with the specified trace in the list with all enabled segments."""
-        if self.lastUsedSegment is not None:
-            if self.lastUsedSegment.mappedRange is not None and self.lastUsedSegment.mappedRange[0] <= traceIndex <= \
-                    self.lastUsedSegment.mappedRange[1]:
-                return self.lastUsedSegment
-            else:
-                # Only load one segment at a time for memory reasons
-                self.lastUsedSegment.unloadAllTraces()
-                self.lastUsedSegment = None
-
-        for traceSegment in self.traceSegments:
-            if traceSegment.mappedRange and traceSegment.mappedRange[0] <= traceIndex <= traceSegment.mappedRange[1]:
-                if not traceSegment.isLoaded():
-                    traceSegment.loadAllTraces(None, None)
-                self.lastUsedSegment = traceSegment
-                return traceSegment
-
-        raise ValueError("Error: Trace %d is not in mapped range." % traceIndex)
+        t = self.lastUsedSegment
+        if t is None or t.mappedRange is None or not (t.mappedRange[0] <= traceIndex <= t.mappedRange[1]):
+            i = bisect.bisect_right(self._segmentStarts, traceIndex) - 1
+            if i < 0 or traceIndex > self._enabledSegments[i].mappedRange[1]:
+                raise ValueError("Error: Trace %d is not in mapped range." % traceIndex)
+            t = self._enabledSegments[i]
+            self.lastUsedSegment = t
+
+        self._useSegment(t)
+        return t
+
+    def _useSegment(self, segment):
+        """Load segment if needed and mark it as most recently used, closing the least recently used ones over budget"""
+        key = id(segment)
+        if not segment.isLoaded():
+            #Also the case for pooled segments unloaded by someone else (e.g. after a capture)
+            segment.loadAllTraces(None, None)
+            self.segmentOpens += 1
+
+        if key in self._openSegments:
+            if next(reversed(self._openSegments)) != key:
+                del self._openSegments[key]
+                self._openSegments[key] = segment
+            return
+
+        self._openSegments[key] = segment
+        self._trimSegmentPool(keep=segment)
+
+    def _trimSegmentPool(self, keep=None):
+        def overBudget():
+            if len(self._openSegments) > max(1, self.maxOpenSegments):
+                return True
+            if self.maxOpenBytes is not None:
+                return sum([self._segmentBytes(t) for t in self._openSegments.values()]) > self.maxOpenBytes
+            return False
+
+        for key in list(self._openSegments.keys()):
+            if not overBudget():
+                break
+            t = self._openSegments[key]
+            if t is keep:
+                continue
+            self._closeSegment(key)
+
+    def _closeSegment(self, key):
+        t = self._openSegments.pop(key)
+        t.unloadAllTraces()
+        self.segmentCloses += 1
+        if t is self.lastUsedSegment:
+            self.lastUsedSegment = None
+
+    @staticmethod
+    def _segmentBytes(segment):
+        """Memory held by a loaded segment (the memory-mapped traces count for their full size)"""
+        size = 0
+        for arr in (segment.traces, segment.textins, segment.textouts, segment.keylist):
+            size += getattr(arr, 'nbytes', 0)
+        return size
+
+    def setSegmentPoolSize(self, maxSegments=None, maxBytes=None):
+        """Limit the open segments to maxSegments and/or maxBytes (None leaves that limit unchanged)"""
+        if maxSegments is not None:
+            self.maxOpenSegments = maxSegments
+        if maxBytes is not None:
+            self.maxOpenBytes = maxBytes
+        self._trimSegmentPool(keep=self.lastUsedSegment)
+
+    def getSegmentStats(self):
+        """Return the number of open segments and how many segment loads/unloads happened so far"""
+        return {'open':len(self._openSegments), 'opens':self.segmentOpens, 'closes':self.segmentCloses}
 
     def getAuxData(self, n, auxDic):
         """Return data about a segment"""
@@ -175,23 +321,76 @@ class TraceManager(TraceSource):
         except ValueError:
             return []
 
+    def _segmentBlocks(self, start, end, getter):
+        """Read traces start to end-1 with getter(segment, first, last + 1), one call per segment spanned"""
+        blocks = []
+        n = start
+        while n < end:
+            t = self.getSegment(n)
+            segend = min(end, t.mappedRange[1] + 1)
+            blocks.append(getter(t, n - t.mappedRange[0], segend - t.mappedRange[0]))
+            n = segend
+        return blocks
+
+    @staticmethod
+    def _joinBlocks(blocks):
+        if len(blocks) == 1:
+            return blocks[0]
+        if len(blocks) == 0:
+            return np.array([])
+        return np.concatenate(blocks)
+
+    def getTraces(self, start, end):
+        """Return traces start to end-1 of the enabled segments as a 2D array.
+
+        Inside one segment this is a view of the (memory-mapped) trace file; ranges spanning several segments are
+        copied into one array, trimmed to the common number of points.
+        """
+        blocks = self._segmentBlocks(start, end, lambda t, a, b: t.getTraces(a, b))
+        if len(blocks) == 1:
+            return blocks[0]
+        if len(blocks) == 0:
+            return np.zeros((0, self._numPoints))
+        npoints = min([np.shape(b)[1] for b in blocks])
+        return np.concatenate([b[:, :npoints] for b in blocks])
+
+    def getTextins(self, start, end):
+        """Return the input texts of traces start to end-1 of the enabled segments"""
+        blocks = self._segmentBlocks(start, end, lambda t, a, b: t.getTextins(a, b))
+        return self._joinBlocks(blocks)
+
+    def getTextouts(self, start, end):
+        """Return the output texts of traces start to end-1 of the enabled segments"""
+        blocks = self._segmentBlocks(start, end, lambda t, a, b: t.getTextouts(a, b))
+        return self._joinBlocks(blocks)
+
+    def getKnownKeys(self, start, end):
+        """Return the known encryption keys of traces start to end-1 of the enabled segments"""
+        blocks = self._segmentBlocks(start, end, lambda t, a, b: t.getKnownKeys(a, b))
+        return self._joinBlocks(blocks)
+
     def _updateRanges(self):
         """Update the trace range for each segments."""
         startTrace = 0
         self._sampleRate = 0
         self._numPoints = 0
+        self._enabledSegments = []
+        self._segmentStarts = []
         for t in self.traceSegments:
             if t.enabled:
                 tlen = t.numTraces()
                 t.mappedRange = [startTrace, startTrace+tlen-1]
+                if tlen > 0:
+                    self._enabledSegments.append(t)
+                    self._segmentStarts.append(startTrace)
                 startTrace = startTrace + tlen
-                np = int(t.config.attr("numPoints"))
-                if self._numPoints != np and np != 0:
+                npts = int(t.config.attr("numPoints"))
+                if self._numPoints != npts and npts != 0:
                     if self._numPoints == 0:
-                        self._numPoints = np
+                        self._numPoints = npts
                     else:
-                        logging.warning("Selected trace segments have different number of points: %d!=%d" % (self._numPoints, np))
-                        self._numPoints = min(self._numPoints, np)
+                        logging.warning("Selected trace segments have different number of points: %d!=%d" % (self._numPoints, npts))
+                        self._numPoints = min(self._numPoints, npts)
 
                 sr = int(float(t.config.attr("scopeSampleRate")))
                 if self._sampleRate != sr and sr != 0:
@@ -203,6 +402,12 @@ class TraceManager(TraceSource):
                 t.mappedRange = None
         self._numTraces = startTrace
 
+        # Close the segments which are no longer mapped
+        for key, t in list(self._openSegments.items()):
+            if t.mappedRange is None or not any(t is s for s in self.traceSegments):
+                self._closeSegment(key)
+        self.lastUsedSegment = None
+
     def numPoints(self):
         """Return the number of points in traces of the selected segments."""
         return self._numPoints
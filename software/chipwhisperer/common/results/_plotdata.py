@@ -30,6 +30,7 @@ from PySide.QtGui import *
 from chipwhisperer.analyzer.attacks._base import AttackObserver
 from .base import ResultsBase
 from chipwhisperer.common.ui.GraphWidget import GraphWidget
+from chipwhisperer.common.utils.envelope import EnvelopePyramid
 from chipwhisperer.common.utils.timer import Timer
 import pyqtgraph as pg
 
@@ -151,10 +152,14 @@ class AttackResultPlot(GraphWidget, ResultsBase, AttackObserver):
                 ydataptr = [[t] for t in ydataptr]
                 pointargsg = {'symbol':'t', 'symbolPen':'b', 'symbolBrush':'g'}
 
+            highlighted = None
+            if bnum < len(highlightedKeys):
+                highlighted = highlightedKeys[bnum]
+
             if drawtype.startswith('fast'):
-                newdiff = np.array(ydataptr)
-                if highlightedKeys[bnum] is not None and bnum < len(highlightedKeys):
-                    newdiff = np.delete(newdiff, highlightedKeys[bnum], 0)
+                newdiff = np.array(ydataptr, dtype=np.float64)
+                if highlighted is not None:
+                    newdiff = np.delete(newdiff, highlighted, 0)
 
                 if top is not None:
                     top = np.maximum.reduce([top, np.amax(newdiff, 0)])
@@ -164,48 +169,42 @@ class AttackResultPlot(GraphWidget, ResultsBase, AttackObserver):
                     bottom = np.amin(newdiff, 0)
 
             elif drawtype.startswith('norm'):
-                tlisttst = []
-                maxlisttst = []
+                rows = [i for i in range(0, self._numPerms(bnum)) if i != highlighted]
+                ydata = np.asarray(ydataptr, dtype=np.float64)[rows]
                 if len(pointargsg) == 0:
-                    tlist_fixed = [xdataptr[-1], xdataptr[0]]
-                    tlist_fixed[:0] = xdataptr
+                    p = self.plotEnvelope(EnvelopePyramid(ydata, xdataptr), joined=True, pen=self.traceColor)
                 else:
-                    tlist_fixed = xdataptr
-                for i in range(0, self._numPerms(bnum)):
-                    if bnum < len(highlightedKeys) and i == highlightedKeys[bnum]:
-                        continue
-
-                    tlisttst.extend(tlist_fixed)
-                    if len(pointargsg) == 0:
-                        newmax = [0, 0]
-                        newmax[:0] = ydataptr[i]
-                    else:
-                        newmax = ydataptr[i]
-                    maxlisttst.extend(newmax)
-                self.setupPlot(self.pw.plot(tlisttst, maxlisttst, pen=self.traceColor, **pointargsg), 0, False, str(bnum) + ":All")
+                    p = self.pw.plot(np.tile(xdataptr, len(rows)), ydata.ravel(), pen=self.traceColor, **pointargsg)
+                self.setupPlot(p, 0, False, str(bnum) + ":All")
 
             elif drawtype.startswith('detail'):
+                ydata = np.asarray(ydataptr, dtype=np.float64)
+                pyramid = EnvelopePyramid(ydata, xdataptr)
                 for i in range(0, self._numPerms(bnum)):
-                    self.setupPlot(self.pw.plot(xdataptr, ydataptr[i], pen=QColor(*self.traceColor), **pointargsg), 0, True, str(bnum) + ":%02X" % i)
+                    if len(pointargsg) == 0:
+                        p = self.plotEnvelope(pyramid, row=i, pen=QColor(*self.traceColor))
+                    else:
+                        p = self.pw.plot(xdataptr, ydata[i], pen=QColor(*self.traceColor), **pointargsg)
+                    self.setupPlot(p, 0, True, str(bnum) + ":%02X" % i)
 
                 # Plot the highlighted byte(s) on top
-            pointargsr = {}
-            if not hasattr(ydataptr[0], '__iter__'):
-                ydataptr = [[t] for t in ydataptr]
-                pointargsr = {'symbol':'o', 'symbolPen':'b', 'symbolBrush':'r'}
-
-            if bnum < len(highlightedKeys):
-                b = highlightedKeys[bnum]
-                if b >=0 and b < len(ydataptr):
-                    self.setupPlot(self.pw.plot(xdataptr, ydataptr[b], pen=QColor(*self.highlightedKeyColor), **pointargsr), 1, True, str(bnum) + ":%02X" % b)
+            if highlighted is not None and 0 <= highlighted < len(ydataptr):
+                if len(pointargsg) == 0:
+                    p = self.plotEnvelope(EnvelopePyramid(ydataptr[highlighted], xdataptr), pen=QColor(*self.highlightedKeyColor))
+                else:
+                    # Single points are drawn with a symbol, there's nothing to reduce
+                    pointargsr = {'symbol':'o', 'symbolPen':'b', 'symbolBrush':'r'}
+                    p = self.pw.plot(xdataptr, ydataptr[highlighted], pen=QColor(*self.highlightedKeyColor), **pointargsr)
+                self.setupPlot(p, 1, True, str(bnum) + ":%02X" % highlighted)
             pvalue += 1
             progress.updateStatus(pvalue)
             if progress.wasAborted():
                 break
 
         if drawtype.startswith('fast') and xdataptr:
-            p1 = self.setupPlot(self.pw.plot(x=xdataptr, y=top), -1, True, "Maxes")
-            p2 = self.setupPlot(self.pw.plot(x=xdataptr, y=bottom), -1, True, "Mins")
+            pyramid = EnvelopePyramid(np.vstack((top, bottom)), xdataptr)
+            p1 = self.setupPlot(self.plotEnvelope(pyramid, row=0), -1, True, "Maxes")
+            p2 = self.setupPlot(self.plotEnvelope(pyramid, row=1), -1, True, "Mins")
             try:
                 p3 = pg.FillBetweenItem(p1, p2, brush=self.traceColor)
                 p3.setZValue(-1)
@@ -25,6 +25,7 @@
 #=================================================
 
 from ._plotdata import AttackResultPlot
+import numpy as np
 from PySide.QtGui import *
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.pluginmanager import Plugin
@@ -50,85 +51,69 @@ class PGEVsTrace(AttackResultPlot, Plugin):
 
     def getPGE(self, addPlotMatlab=True):
         """Return the  Partial Guessing Entropy (PGE) according to the specified format"""
-        allpge = self.calculatePGE()
+        tnums, pge, trials = self.pgeTable()
+        # NaN where a subkey has no trials at a trace number
+        cells = np.where(np.isnan(pge), "NaN", np.char.mod("%f", pge))
 
         fmt = self.findParam('fmt').getValue()
         if fmt == 'CSV':
-            spge = "Trace Number, "
-            for i in range(0, self._numKeys()):
-                spge += "Subkey %d, "%i
-            spge += "\n"
-            for (tnum, plist) in allpge.iteritems():
-                spge += "%d, "%tnum
-                for j in plist:
-                    if j['trials'] > 0:
-                        spge += "%f, "%j['pge']
-                    else:
-                        spge += "NaN, "
-                spge += "\n"
+            spge = "Trace Number, " + "".join(["Subkey %d, " % i for i in range(0, self._numKeys())]) + "\n"
+            spge += "".join(["%d, " % tnum + "".join([c + ", " for c in row]) + "\n" for tnum, row in zip(tnums, cells)])
         elif fmt == 'MATLAB':
-            tracestr = "tnum = ["
+            tracestr = "tnum = [" + "".join(["%d " % tnum for tnum in tnums]) + "];\n"
             spge = "pge = ["
-            trials = 0
-            for (tnum, plist) in allpge.iteritems():
-                tracestr += "%d "%tnum
-                for j in plist:
-                    if j['trials'] > 0:
-                        spge += "%f "%j['pge']
-                        trials = max(trials, j['trials'])
-                    else:
-                        spge += "NaN, "
-                spge += ";\n"
-            tracestr += "];\n"
+            spge += "".join(["".join([c + " " if c != "NaN" else "NaN, " for c in row]) + ";\n" for row in cells])
             spge += "];\n"
             spge += tracestr
             spge += "\n"
             if addPlotMatlab:
                 spge += "plot(tnum, pge)\n"
                 spge += "xlabel('Trace Number')\n"
-                spge += "ylabel('Average PGE (%d Trials)')\n" % trials
+                spge += "ylabel('Average PGE (%d Trials)')\n" % (trials.max() if trials.size else 0)
                 spge += "title('Average Partial Guessing Entropy (PGE) via ChipWhisperer')\n"
-                spge += "legend("
-                for k in range(0, self._numKeys()):
-                    spge += "'Subkey %d'" % k
-                    if k != (self._numKeys()-1):
-                        spge += ", "
-                spge += ")\n"
+                spge += "legend(" + ", ".join(["'Subkey %d'" % k for k in range(0, self._numKeys())]) + ")\n"
         else:
             raise ValueError("Invalid fmt: %s" % fmt)
 
         return spge
 
-    def calculatePGE(self):
-        """Calculate the Partial Guessing Entropy (PGE)"""
+    def pgeTable(self):
+        """
+        Return the average Partial Guessing Entropy (PGE) of every subkey over all trials, as (tnums, pge, trials):
+        the trace numbers in order of appearance, and (traces x subkeys) arrays of the PGE (NaN without trials) and of
+        the number of trials.
+        """
         if not self._analysisSource:
             raise Warning("Attack not set/executed yet")
 
         stats = self._analysisSource.getStatistics()
-        pge = stats.pge_total
-        allpge = util.DictType()
+        pge = stats.pgeHistory.data()
 
-        for i in pge:
-            tnum = i['trace']
-            if not tnum in allpge:
-                allpge[tnum] = [{'pgesum':0, 'trials':0} for z in range(0,stats.numSubkeys)]
+        # Sum the PGE of all trials for each (trace, subkey) pair at once, keeping traces in order of appearance
+        tnums, first, tidx = np.unique(pge['trace'], return_index=True, return_inverse=True)
+        tidx = np.ravel(tidx)
+        pgesum = np.zeros((len(tnums), stats.numSubkeys))
+        trials = np.zeros((len(tnums), stats.numSubkeys), dtype=np.int64)
+        np.add.at(pgesum, (tidx, pge['subkey']), pge['pge'])
+        np.add.at(trials, (tidx, pge['subkey']), 1)
 
-            allpge[tnum][i['subkey']]['pgesum'] += i['pge']
-            allpge[tnum][i['subkey']]['trials'] += 1
-
-        for (tnum, plist) in allpge.iteritems():
-            for j in plist:
-                if j['trials'] > 0:
-                    j['pge'] = float(j['pgesum']) / float(j['trials'])
-                    # print "%d "%j['trials'],
-                else:
-                    j['pge'] = None
+        order = np.argsort(first, kind='mergesort')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg = pgesum[order] / trials[order]
+        return tnums[order], avg, trials[order]
 
+    def calculatePGE(self):
+        """Calculate the Partial Guessing Entropy (PGE)"""
+        tnums, pge, trials = self.pgeTable()
+        allpge = util.DictType()
+        for t, tnum in enumerate(tnums):
+            allpge[int(tnum)] = [{'pgesum':pge[t][z] * trials[t][z] if trials[t][z] > 0 else 0.0, 'trials':trials[t][z],
+                                  'pge':float(pge[t][z]) if trials[t][z] > 0 else None} for z in range(0, len(trials[t]))]
         return allpge
 
     def redrawPlot(self):
         """Recalculate the PGE and redraw the PGE plot"""
-        allpge = self.calculatePGE()
+        tnums, pge, _ = self.pgeTable()
 
         self.clearPushed()
         #prange = range(self.pstart[bnum], self.pend[bnum])
@@ -136,13 +121,8 @@ class PGEVsTrace(AttackResultPlot, Plugin):
         try:
             for bnum in range(0, len(self.enabledbytes)):
                 if self.enabledbytes[bnum]:
-                    trace = []
-                    pge = []
-                    for (tnum, plist) in allpge.iteritems():
-                        if plist[bnum]['pge'] is not None:
-                            trace.append(tnum)
-                            pge.append(plist[bnum]['pge'])
-                    p = self.pw.plot(trace, pge, pen='r')
+                    valid = ~np.isnan(pge[:, bnum])
+                    p = self.pw.plot(tnums[valid], pge[valid, bnum], pen='r')
                     p.curve.setClickable(True)
                     p.id = str(bnum)
                     p.sigClicked.connect(self.selectTrace)
@@ -24,15 +24,57 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
-import copy
 from datetime import datetime
+import warnings
 import numpy as np
 from chipwhisperer.analyzer.attacks._base import AttackObserver
+from chipwhisperer.common.traces._npywriter import NpyAppendWriter
 from .base import ResultsBase
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.common.utils.parameter import setupSetParam
 
 
+def diffsRange(diffs, numKeys, numPerms):
+    """Return (max, min) of the diffs of every key guess as numKeys x numPerms arrays, NaN where there is no data"""
+    tempmax = np.full((numKeys, numPerms), np.nan)
+    tempmin = np.full((numKeys, numPerms), np.nan)
+    with warnings.catch_warnings():
+        # All-NaN guesses give NaN, which is what we want
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for i in range(0, numKeys):
+            if diffs[i] is None:
+                continue
+            d = np.asarray(diffs[i], dtype=np.float64)
+            d = d.reshape(len(d), -1)
+            tempmax[i, :len(d)] = np.nanmax(d, axis=1)
+            tempmin[i, :len(d)] = np.nanmin(d, axis=1)
+    return tempmax, tempmin
+
+
+class ResultsHistory(object):
+    """
+    Results saved by ResultsSave, read back lazily.
+
+    The file is memory-mapped, so only the records which are accessed are read. Each record is returned as a dict
+    with "tracecnt" (list, None for subkeys without data), "diffsmax" and "diffsmin" (numKeys x numPerms arrays).
+    """
+
+    def __init__(self, filename):
+        self.records = np.load(filename, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, n):
+        rec = self.records[n]
+        return {"tracecnt":[None if t < 0 else int(t) for t in rec["tracecnt"]],
+                "diffsmax":np.array(rec["diffsmax"]), "diffsmin":np.array(rec["diffsmin"])}
+
+    def __iter__(self):
+        for n in range(0, len(self)):
+            yield self[n]
+
+
 class ResultsSave(ResultsBase, AttackObserver, Plugin):
     _name = "Save to Files"
     _description = "Save correlation output to files."
@@ -41,7 +83,7 @@ class ResultsSave(ResultsBase, AttackObserver, Plugin):
         AttackObserver.__init__(self)
         self._filename = None
         self._enabled = False
-        self.dataarray = None
+        self._writer = None
 
         self.getParams().addChildren([
             {'name':'Save Raw Results', 'type':'bool', 'get':self.getEnabled, 'set':self.setEnabled}
@@ -59,32 +101,31 @@ class ResultsSave(ResultsBase, AttackObserver, Plugin):
         # attackStats.diffs[i][hypkey]
         # attackStats.diffs_tnum[i]
 
+        numKeys = self._numKeys()
+        numPerms = self._maxNumPerms()
+
         if self._filename is None:
             # Generate filename
             self._filename = "tempstats_%s.npy" % datetime.now().strftime('%Y%m%d_%H%M%S')
 
-            # Generate Array
-            self.dataarray = []
+            # One record per update is appended to the file, which can be read back with ResultsHistory
+            dtype = [("tracecnt", np.int64, (numKeys,)), ("diffsmax", np.float64, (numKeys, numPerms)),
+                     ("diffsmin", np.float64, (numKeys, numPerms))]
+            self._writer = NpyAppendWriter(self._filename, (), dtype, capacity=64)
 
         # Record max & min, used as we don't know if user wanted absolute mode or not
+        tempmax, tempmin = diffsRange(attackStats.diffs, numKeys, numPerms)
+        tracecnt = [-1 if t is None else t for t in attackStats.diffs_tnum]
 
-        tempmin = np.ndarray((self._numKeys(), self._maxNumPerms()))
-        tempmax = np.ndarray((self._numKeys(), self._maxNumPerms()))
-
-        for i in range(0, self._numKeys()):
-            for j in range(0, self._numPerms(i)):
-                tempmax[i][j] = np.nanmax(attackStats.diffs[i][j])
-                tempmin[i][j] = np.nanmin(attackStats.diffs[i][j])
-
-        newdata = {"tracecnt":copy.deepcopy(attackStats.diffs_tnum), "diffsmax":tempmax, "diffsmin":tempmin}
-
-        self.dataarray.append(newdata)
-        np.save(self._filename, self.dataarray)
+        self._writer.append((tracecnt, tempmax, tempmin))
+        self._writer.flush()
 
     def processAnalysis(self):
         """Attack is done"""
+        if self._writer is not None:
+            self._writer.finalize()
         self._filename = None
-        self.dataarray = None
+        self._writer = None
 
     def getEnabled(self):
         return self._enabled
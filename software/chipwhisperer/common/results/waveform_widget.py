@@ -30,9 +30,13 @@ from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.tracesource import TraceSource, ActiveTraceObserver
 from chipwhisperer.common.utils.pluginmanager import Plugin
 from chipwhisperer.common.ui.ProgressBar import *
+from chipwhisperer.common.utils.timer import runTask
+from chipwhisperer.analyzer.utils.moments import RegressionAccumulator
 import numpy as np
 import logging
 
+_HW = np.array([bin(n).count('1') for n in range(256)])
+
 class WaveFormWidget(GraphWidget, ResultsBase, ActiveTraceObserver, Plugin):
     _name = 'Trace Output Plot'
     _description = 'Plots the waveform for a given trace source'
@@ -85,6 +89,10 @@ class WaveFormWidget(GraphWidget, ResultsBase, ActiveTraceObserver, Plugin):
             {'name':'Redraw', 'type':'action', 'action':self.plotInputTrace},
         ])
 
+        # T-statistic of the last settings it was computed for, and the computation in progress (if any)
+        self._tstatCache = (None, None)
+        self._tstatTask = None
+
         self.findParam('input').setValue(TraceSource.registeredObjects["Trace Management"])
         TraceSource.sigRegisteredObjectsChanged.connect(self.traceSourcesChanged)
 
@@ -226,8 +234,6 @@ class WaveFormWidget(GraphWidget, ResultsBase, ActiveTraceObserver, Plugin):
             return
 
         try:
-            progress_bar = None
-
             if len(plotlist) > 1 or tstat_enabled:
                 self.setPersistance(True)
 
@@ -257,57 +263,91 @@ class WaveFormWidget(GraphWidget, ResultsBase, ActiveTraceObserver, Plugin):
                         util.updateUI()
 
             if tstat_enabled:
-                ttrace = [0] * (pend - pstart + 1)
                 tstat_leakage = self.findParam(['tstat', 'type']).getValue()
-                if tstat_leakage == 'Text In':
-                    b_list = np.array([self._traceSource.getTextin(tnum)[0] for tnum in range(ttstart, ttend+1)])
-                elif tstat_leakage == 'Text Out':
-                    b_list = np.array([self._traceSource.getTextout(tnum)[0] for tnum in range(ttstart, ttend + 1)])
-                elif tstat_leakage == 'Key':
-                    b_list = np.array([self._traceSource.getKnownKey(tnum)[0] for tnum in range(ttstart, ttend + 1)])
-                else:
-                    raise NotImplementedError("Can't calculate t-statistics against input type %s" % tstat_leakage)
-                x_list = np.array([bin(x).count('1') for x in b_list])
-                s_x = np.sum(x_list)
-                mu_x = s_x / len(x_list)
-
-                progress_bar = ProgressBarGUI("Computing T-Statistics", "Calculating T-Statistic:")
-                progress_bar.setStatusMask("Current Point = %d", 0)
-                progress_bar.setMaximum(pend+1 - pstart)
-                progress_bar.show()
-                for i in range(pstart, pend+1):
-                    y_list = np.array([self._traceSource.getTrace(tnum)[i] for tnum in range(ttstart, ttend+1)])
-                    s_y = np.sum(y_list)
-                    mu_y = s_y / len(y_list)
-                    s_xx = np.sum(np.dot(x_list, x_list))
-                    s_xy = np.sum(np.dot(x_list, y_list))
-
-                    b_1 = (s_xy - mu_y * s_x) / (s_xx - s_x**2 / len(x_list))
-                    b_0 = mu_y - b_1 * mu_x
-
-                    y_est = b_0 + b_1 * x_list
-                    err = y_est - y_list
-                    s_ee = np.sum(np.dot(err, err))
-                    se = np.sqrt(s_ee / (len(x_list) - 2) / (s_xx - s_x**2 / len(x_list)))
-
-                    t_stat = b_1 / se
-                    ttrace[i] = t_stat
-
-                    prog = i+1 - pstart
-                    progress_bar.updateStatus(prog, prog)
-                    if progress_bar.wasAborted():
-                        break
-
-                self.passTrace(ttrace[pstart:pend + 1], pstart + self._traceSource.offset(), idString='ttest', xaxis=xaxis, dsmode=dsmode, color=0.0)
+                key = (self._traceSource, tstat_leakage, ttstart, ttend, pstart, pend)
+                plotargs = dict(idString='ttest', xaxis=xaxis, dsmode=dsmode, color=0.0)
+                if self._tstatCache[0] == key:
+                    self.passTrace(self._tstatCache[1], pstart + self._traceSource.offset(), **plotargs)
+                elif self._tstatTask is None or self._tstatTask['key'] != key:
+                    self._startTStat(key, plotargs)
         except NotImplementedError as e:
             # This happens if we can't get text in/out or key from a trace source
             logging.info("Couldn't plot t-statistic; error message:%s" % e)
         finally:
             self.setPersistance(initialPersist)
-            if progress_bar is not None:
-                progress_bar.close()
+
+    def _startTStat(self, key, plotargs):
+        """
+        Start computing the linear-regression t-statistic of the points against the Hamming weight of byte 0 of the
+        leakage type. Traces are read a block at a time from a timer, so the GUI stays responsive, and the result is
+        plotted (and cached) once the whole range is done.
+        """
+        self._stopTStat()
+        traceSource, leakage, ttstart, ttend, pstart, pend = key
+
+        if leakage == 'Text In':
+            data = traceSource.getTextins(ttstart, ttend + 1)
+        elif leakage == 'Text Out':
+            data = traceSource.getTextouts(ttstart, ttend + 1)
+        elif leakage == 'Key':
+            data = traceSource.getKnownKeys(ttstart, ttend + 1)
+        else:
+            raise NotImplementedError("Can't calculate t-statistics against input type %s" % leakage)
+
+        progress_bar = ProgressBar("Computing T-Statistics", "Calculating T-Statistic:")
+        progress_bar.setStatusMask("Current Trace = %d", ttstart)
+        progress_bar.setMaximum(ttend + 1 - ttstart)
+
+        self._tstatTask = {'key':key, 'plotargs':plotargs, 'next':ttstart, 'progress':progress_bar,
+                           'x':_HW[np.array([d[0] for d in data], dtype=np.uint8)],
+                           'acc':RegressionAccumulator(pend - pstart + 1)}
+        self._tstatTask['timer'] = runTask(self._tstatStep, 0, start_timer=True)
+
+    def _tstatStep(self):
+        task = self._tstatTask
+        if task is None:
+            return
+        traceSource, _, ttstart, ttend, pstart, pend = task['key']
+
+        try:
+            bstart = task['next']
+            bend = min(bstart + traceSource.blockSize, ttend + 1)
+            traces = traceSource.getTraces(bstart, bend)[:, pstart:pend + 1]
+            task['acc'].addBlock(task['x'][bstart - ttstart:bend - ttstart], traces)
+            task['next'] = bend
+
+            task['progress'].updateStatus(bend - ttstart, bend - 1)
+            aborted = task['progress'].wasAborted()
+            if bend <= ttend and not aborted:
+                return
+
+            self._stopTStat()
+            ttrace = task['acc'].tstat()
+            # An aborted computation is plotted for the traces done so far, but not cached
+            if not aborted:
+                self._tstatCache = (task['key'], ttrace)
+
+            initialPersist = self.persistant
+            self.setPersistance(True)
+            try:
+                self.passTrace(ttrace, pstart + traceSource.offset(), **task['plotargs'])
+            finally:
+                self.setPersistance(initialPersist)
+        except Exception as e:
+            # Raising from the timer would leave it running and failing on every tick
+            self._stopTStat()
+            logging.error("Couldn't calculate t-statistic; error message:%s" % e)
+
+    def _stopTStat(self):
+        if self._tstatTask is not None:
+            self._tstatTask['timer'].stop()
+            self._tstatTask['progress'].close()
+            self._tstatTask = None
 
     def processTraces(self):
+        # The traces may have changed, drop the cached t-statistic
+        self._stopTStat()
+        self._tstatCache = (None, None)
         self.resetTraceLimits()
         self.plotInputTrace()
 
@@ -29,10 +29,12 @@ import os.path
 import sys
 from PySide.QtGui import *
 from PySide.QtCore import *
-from chipwhisperer.common.utils import tracereader_dpacontestv3, tracereader_native
+from chipwhisperer.common.utils import tracereader_dpacontestv3
 import numpy as np
 from time import gmtime, strftime
 from _base import TraceContainer
+from TraceContainerNative import TraceContainerNative
+from chipwhisperer.common.ui.ProgressBar import ProgressBar
 import chipwhisperer.common.utils.qt_tweaks as QtFixes
 
 class TraceContainerDPAv3(TraceContainer):
@@ -67,10 +69,7 @@ class TraceContainerDPAv3(TraceContainer):
             logging.info('Key file exists!')
             return
         
-        self.inf = open(self.dir + "text_in.txt", "w")
-        self.outf = open(self.dir + "text_out.txt", "w")
-        self.wavef = open(self.dir + "wave.txt", "w")
-        self.keyf = open(self.dir + "key.txt", "w")
+        self.writer = tracereader_dpacontestv3.DPAv3Writer(self.dir)
         
     def numPoints(self):
         return self._numPoints
@@ -79,49 +78,21 @@ class TraceContainerDPAv3(TraceContainer):
         self.wavelen = len(wave)
         self._numTraces = self._numTraces + 1
         self._numPoints = len(wave)
+        self.writer.addTrace(wave, textin, textout, key)
 
-        for i in textin:
-            self.inf.write('%2X '%i)
-        self.inf.write('\n')
-
-        for i in textout:
-            self.outf.write('%2X '%i)
-        self.outf.write('\n')
-
-        for i in wave:
-            iint = i * float(2**16)
-            self.wavef.write('%d '%int(iint))
-        self.wavef.write('\n')
-
-        if key:
-            for i in key:
-                self.keyf.write('%2X '%i)
-            self.keyf.write('\n')
-        
     def copyTo(self, srcTraces=None):
-        pass        
-        
+        """Export all traces of srcTraces to a new capture directory, a block of traces at a time"""
+        self.startTime = gmtime()
+        self.dir = "capture-%s/"%strftime("%Y.%m.%d-%H.%M.%S", self.startTime)
+        with ProgressBar("Exporting to DPA Contest v3 format", "Exporting traces") as progress:
+            self._numTraces = tracereader_dpacontestv3.exportFromTraceSource(srcTraces, self.dir, progressBar=progress)
+        self._numPoints = srcTraces.numPoints()
+
     def loadAllTraces(self, directory=None, prefix=""):
         pass
 
     def writeInfo(self):
-        infofile = open(self.dir + "info.xml", "w")
-
-        infofile.write('<?xml version="1.0" encoding="utf-8"?>\n')
-        infofile.write('<WaveformInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">\n')
-        infofile.write('  <Date>%s</Date>'%strftime("%d/%m%Y %H:%M:%S", self.startTime))
-        infofile.write('  <Operator>Smooth</Operator>\n')
-        infofile.write('  <WaveType>PowerTrace</WaveType>\n')
-        infofile.write('  <WaveFormat>System.Single[]</WaveFormat>\n')
-        infofile.write('  <Instrument>Something</Instrument>\n')
-        infofile.write('  <Module>AES</Module>\n')
-        infofile.write('  <Cipher>AES</Cipher>\n')
-        infofile.write('  <KeyLength>128</KeyLength>\n')
-        infofile.write('  <TextWidth>128</TextWidth>\n')
-        infofile.write('  <NumTrace>%d</NumTrace>\n'%self._numTraces)
-        infofile.write('  <NumPoint>%d</NumPoint>\n'%self._numPoints)
-        infofile.write('</WaveformInfo>\n')
-        infofile.close()
+        tracereader_dpacontestv3.writeInfo(self.dir, self._numTraces, self._numPoints, self.startTime)
 
     def writeSettings(self, settings):
         settingsfile = open(self.dir + "settings.txt", "w")
@@ -134,11 +105,8 @@ class TraceContainerDPAv3(TraceContainer):
         self.writeInfo()
         
     def closeAll(self, clearTrace=True, clearText=True, clearKeys=True):
+        self.writer.close()
         self.saveAllTraces()
-        self.inf.close()
-        self.outf.close()
-        self.wavef.close()
-        self.keyf.close()
 
 
 class ImportDPAv3Dialog(QtFixes.QDialog):
@@ -301,30 +269,16 @@ class ImportDPAv3Dialog(QtFixes.QDialog):
         if self.validatePrefix(False) == False:
             return
         
-        ti = TraceContainer()
-        ti.numTraces = int(self.LETraces.text())
-        ti.numPoints = int(self.LEPoints.text())
-        ti.date = self.LEDate.text()
-        ti.scope = self.LEScope.text()
-        ti.targetHW = self.LETargetHW.text()
-        ti.targetSW = self.LETargetSW.text()
-        ti.notes = self.LENotes.text()
-
-        msg = QMessageBox()
-        msg.setText("Message from ChipWhisperer")
-        msg.setInformativeText("Importing, could take a while. This message dissappears when done")
-        msg.setStandardButtons(0)
-        msg.show()
-        self.trimport.loadAllTraces()
-    
-        tmp = tracereader_native.tracereader_native()
-        tmp.copyTo(self.trimport)
-        msg.close()
-
-        #Save file automatically
-        tmp.saveAllTraces(self.parent.parent.cwp.traceslocation + "/", prefix=self.prefixDirLE.text() + "_")
-
-        ti.prefix = self.prefixDirLE.text() + "_"
-        
-        ti.saveTrace(self.getTraceCfgFile())     
+        tc = TraceContainerNative()
+        tc.config.setConfigFilename(self.getTraceCfgFile())
+        tc.config.setAttr("prefix", self.prefixDirLE.text() + "_")
+        tc.config.setAttr("date", self.LEDate.text())
+        tc.config.setAttr("scopeName", self.LEScope.text())
+        tc.config.setAttr("targetHW", self.LETargetHW.text())
+        tc.config.setAttr("targetSW", self.LETargetSW.text())
+        tc.config.setAttr("notes", self.LENotes.text())
+
+        with ProgressBar("Importing DPA Contest v3 traces", "Importing traces") as progress:
+            tracereader_dpacontestv3.importToNative(self.trimport.directory, tc, self.trimport.tracedtype,
+                                                    progressBar=progress)
         self.close()
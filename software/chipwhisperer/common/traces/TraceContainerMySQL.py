@@ -23,25 +23,33 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 import logging
-import pickle
 import numpy as np
 from _base import TraceContainer
 from _cfgfile import makeAttrDict
+from _tracedb import TraceDB
 
 try:
-    import umysql as sql
-except ImportError, e:
-    # This isn't really needed, no need to bother users
-    # print "umysql required: https://pypi.python.org/pypi/umysql"
-    raise ImportError(e)
+    import MySQLdb as sql
+except ImportError:
+    try:
+        import pymysql as sql
+    except ImportError, e:
+        # This isn't really needed, no need to bother users
+        # print "MySQLdb or pymysql required: https://pypi.python.org/pypi/PyMySQL"
+        raise ImportError(e)
 
 
 class TraceContainerMySQL(TraceContainer):
     _name = "MySQL"
 
+    #Names of the 'Trace Format' parameter values in TraceDB
+    _waveFormats = {'Binary':'binary', 'NumPy Pickle':'pickle'}
+
     def __init__(self, openMode = False):
         super(TraceContainerMySQL, self).__init__()
         self.db = None
+        self.tdb = None
+        self.tableName = None
         self.idOffset = 0
         self.lastId = 0
         self.openMode = openMode
@@ -62,19 +70,20 @@ class TraceContainerMySQL(TraceContainer):
             traceParams[0]['children'].append({'name':'Relist Tables', 'key':'tableListAct', 'type':'action'})
             traceParams[0]['children'].append({'name':'Table List', 'key':'tableNameList', 'type':'list', 'values':[], 'value':'', 'linked':['Table Name']})
 
-        traceParams[0]['children'].append({'name':'Trace Format', 'key':'traceFormat', 'type':'list', 'values':['NumPy Pickle'], 'value':'NumPy Pickle', 'set':self.setFormat})
-        self.params.addChildren(traceParams)
+        traceParams[0]['children'].append({'name':'Trace Format', 'key':'traceFormat', 'type':'list', 'values':['Binary', 'NumPy Pickle'], 'value':'Binary', 'set':self.setFormat})
+        self.traceParams = traceParams
+        self.getParams().addChildren(traceParams)
 
         #Connect actions if applicable
         try:
-            self.getParams.findParam('tableListAct').opts['action'] = self.listAllTables
+            self.findParam('tableListAct').opts['action'] = self.listAllTables
         except AttributeError:
             pass
 
-        self.getParams.findParam('tableName').opts['get'] = self._getTableName
+        self.findParam('tableName').opts['get'] = self._getTableName
 
         #Save extra configuration options
-        self.attrDict = makeAttrDict("MySQL Config", "mysql", self.getParams.traceParams)
+        self.attrDict = makeAttrDict("MySQL Config", "mysql", self.traceParams)
         self.config.attrList.append(self.attrDict)
 
         #Format name must agree with names from TraceContainerFormatList
@@ -103,70 +112,62 @@ class TraceContainerMySQL(TraceContainer):
 
         raise ValueError("Invalid mode: %s"%mode)
 
+    def _openTable(self):
+        self.tdb = TraceDB(self.db, self.tableName, 'mysql', self._waveFormats[self.format()], binary=sql.Binary)
+
     def prepareDisk(self):
         self.con()
         #CREATE DATABASE `cwtraces` /*!40100 COLLATE 'utf8_unicode_ci' */
-        traceprefix = self.makePrefix(self.getParams.findParam('tableNameType').getValue())
+        traceprefix = self.makePrefix(self.findParam('tableNameType').getValue())
 
         #Check version as simple validation
-        result = self.db.query("SELECT VERSION()")
-        logging.info('MySQL Version: %s' % result.rows[0][0])
+        cur = self.db.cursor()
+        cur.execute("SELECT VERSION()")
+        logging.info('MySQL Version: %s' % cur.fetchone()[0])
+        cur.close()
 
         self.tableName = traceprefix
-
-        self.db.query("CREATE TABLE IF NOT EXISTS %s(Id INT PRIMARY KEY AUTO_INCREMENT,\
-         Textin VARCHAR(32),\
-         EncKey VARCHAR(32),\
-         Textout VARCHAR(32),\
-         Wave MEDIUMBLOB)"%self.tableName)
+        self._openTable()
+        self.tdb.createTable()
 
     def con(self):
         if self.db is not None:
             self.db.close()
 
-        db = sql.Connection()
-
-        server = self.getParams.findParam('addr').getValue()
-        port = int(self.getParams.findParam('port').getValue())
-        user = self.getParams.findParam('user').getValue()
-        password = self.getParams.findParam('password').getValue()
-        database = self.getParams.findParam('database').getValue()
+        server = self.findParam('addr').getValue()
+        port = int(self.findParam('port').getValue())
+        user = self.findParam('user').getValue()
+        password = self.findParam('password').getValue()
+        database = self.findParam('database').getValue()
 
         #Connection
-        db.connect(server,port,user,password,database)
-
-        self.db = db
+        self.db = sql.connect(host=server, port=port, user=user, passwd=password, db=database)
 
     def _getTableName(self):
-        return self.getParams.findParam('tableNameList').getValue()
+        return self.findParam('tableNameList').getValue()
 
     def listAllTables(self):
         self.con()
-        database = self.getParams.findParam('database').getValue()
-        results = self.db.query("SHOW TABLES IN %s"%database)
+        database = self.findParam('database').getValue()
+        cur = self.db.cursor()
+        cur.execute("SHOW TABLES IN %s"%database)
         tables = []
-        for r in results.rows:
+        for r in cur.fetchall():
             tables.append(r[0])
-        self.getParams.findParam('tableNameList').setLimits(tables)
-
+        cur.close()
+        self.findParam('tableNameList').setLimits(tables)
 
     def updatePointsTraces(self):
-        res = self.db.query("SELECT COUNT(*) FROM %s" % self.tableName)
-        self._numTraces = res.rows[0][0]
-
-        wav = self.db.query("SELECT Wave FROM %s LIMIT 1 OFFSET %d" % (self.tableName, 0)).rows[0][0]
-        self._numPoints = self.formatWave(wav, read=True).shape[0]
+        self._numTraces = self.tdb.numTraces()
+        self._numPoints = self.tdb.numPoints()
 
     def updateConfigData(self):
         self.con()
 
-        self.tableName = self.getParams.findParam('tableName').getValue()
-        res = self.db.query("SELECT COUNT(*) FROM %s" % self.tableName)
-        self._numTraces = res.rows[0][0]
+        self.tableName = self.findParam('tableName').getValue()
+        self._openTable()
+        self.updatePointsTraces()
         self.config.setAttr('numTraces', self._numTraces)
-
-        wav = self.db.query("SELECT Wave FROM %s LIMIT 1 OFFSET %d"%(self.tableName, 0)).rows[0][0]
-        self._numPoints = self.formatWave(wav, read=True).shape[0]
         self.config.setAttr('numPoints', self._numPoints)
 
     def numTraces(self, update=False):
@@ -180,48 +181,28 @@ class TraceContainerMySQL(TraceContainer):
         return self._numPoints
 
     def loadAllConfig(self):
-        for p in self.getParams.traceParams[0]['children']:
+        for p in self.traceParams[0]['children']:
             try:
                 val = self.config.attr(p["key"], "mysql")
-                self.getParams.findParam(p["key"]).setValue(val)
+                self.findParam(p["key"]).setValue(val)
             except ValueError:
                 pass
-            #print "%s to %s=%s"%(p["key"], val, self.getParams.findParam(p["key"]).getValue())
+            #print "%s to %s=%s"%(p["key"], val, self.findParam(p["key"]).getValue())
 
     def loadAllTraces(self, path=None, prefix=None):
         self.updateConfigData()
 
-    def formatWave(self, wave, read=False):
-        if self.getParams.format() == "NumPy Pickle":
-            if read == False:
-                return pickle.dumps(wave, protocol=2)
-            else:
-                return np.array(pickle.loads(wave))
-        else:
-            raise AttributeError("Invalid Format for MySQL")
-
     def addTrace(self, trace, textin, textout, key, dtype=np.double):
-        strTextin = ""
-        for t in textin:
-            strTextin += "%02X"%t
-
-        strTextout = ""
-        for t in textout:
-            strTextout += "%02X" % t
-
-        if key is not None:
-            strKey = ""
-            for t in key:
-                strKey += "%02X"%t
-        else:
-            strKey = ""
+        self.tdb.add(trace, textin, textout, key, dtype)
+        self._numTraces += 1
 
-        self.db.query("INSERT INTO %s(Textin, Textout, EncKey, Wave) VALUES('%s', '%s', '%s', "%(self.tableName, strTextin, strTextout,
-                                                                                                strKey) + "%s)", (self.formatWave(trace),))
     def saveAll(self):
+        if self.tdb is not None:
+            self.tdb.flush()
+
         #Save attributes from config settings
-        for t in self.getParams.traceParams[0]['children']:
-            self.config.setAttr(t["key"],  self.getParams.findParam(t["key"]).getValue() ,"mysql")
+        for t in self.traceParams[0]['children']:
+            self.config.setAttr(t["key"],  self.findParam(t["key"]).getValue() ,"mysql")
 
         #Save table name/prefix too
         self.config.setAttr("tableName", self.tableName, "mysql")
@@ -242,30 +223,36 @@ class TraceContainerMySQL(TraceContainer):
             self.keylist = None
             self.knownkey = None
 
+        if self.tdb is not None:
+            self.tdb.flush()
+        self.tdb = None
+
         if self.db is not None:
             self.db.close()
         self.db = None
 
     def getTrace(self, n):
-        wv = self.db.query("SELECT Wave FROM %s LIMIT 1 OFFSET %d"%(self.tableName, n)).rows[0][0]
-        return self.formatWave(wv, read=True)
-
-    def asc2list(self, asc):
-        lst = []
-        for i in range(0,len(asc),2):
-            lst.append( int(asc[i:(i+2)], 16) )
-        return lst
+        return self.tdb.get(n)[0]
 
     def getTextin(self, n):
-        asc = self.db.query("SELECT Textin FROM %s LIMIT 1 OFFSET %d"%(self.tableName, n)).rows[0][0]
-        return self.asc2list(asc)
+        return list(self.tdb.get(n)[1])
 
     def getTextout(self, n):
-        asc = self.db.query("SELECT Textout FROM %s LIMIT 1 OFFSET %d"%(self.tableName, n)).rows[0][0]
-        return self.asc2list(asc)
+        return list(self.tdb.get(n)[2])
 
     def getKnownKey(self, n=None):
         if n is None:
             n = 0
-        asc = self.db.query("SELECT EncKey FROM %s LIMIT 1 OFFSET %d"%(self.tableName, n)).rows[0][0]
-        return self.asc2list(asc)
+        return list(self.tdb.get(n)[3])
+
+    def getTraces(self, start, end):
+        return self.tdb.read(start, end)[0]
+
+    def getTextins(self, start, end):
+        return self.tdb.read(start, end)[1]
+
+    def getTextouts(self, start, end):
+        return self.tdb.read(start, end)[2]
+
+    def getKnownKeys(self, start, end):
+        return self.tdb.read(start, end)[3]
@@ -22,38 +22,332 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import os
 import numpy as np
 from _base import TraceContainer
+from _npywriter import NpyAppendWriter
+from chipwhisperer.common.utils.parameter import setupSetParam
+from chipwhisperer.common.utils.tracereader_dpacontestv3 import decodeHex
 
 
 class TraceContainerNative(TraceContainer):
     _name = "ChipWhisperer/Native"
 
-    def copyTo(self, srcTraces=None):
-        self.numTrace = srcTraces.numTraces()
-        self.numPoint = srcTraces.numPoints()
-        self.knownkey = srcTraces.knownkey
+    #In streaming mode, the files on disk are made loadable every this many traces
+    streamFlushInterval = 100
+
+    #copyTo() reads and writes this many traces at a time
+    copyBlockSize = 1000
+
+    def __init__(self, configfile=None):
+        self._compactStorage = False
+        TraceContainer.__init__(self, configfile)
+        self.getParams().addChildren([
+            {'name':'Store Raw ADC Codes', 'key':'compact', 'type':'bool', 'get':self.getCompactStorage, 'set':self.setCompactStorage,
+             'help':'When the scope delivers integer ADC samples (e.g. OpenADC), store the raw 16-bit codes and their '
+                    'scale/offset instead of 64-bit floats. Traces read back the same, using 4x less disk space.'},
+        ])
+
+    def getCompactStorage(self):
+        return self._compactStorage
+
+    @setupSetParam("Store Raw ADC Codes")
+    def setCompactStorage(self, enabled):
+        """Store captured traces as raw ADC codes when the scope supports it (see ScopeTemplate.sampleScaling())"""
+        self._compactStorage = enabled
+
+    def clear(self):
+        TraceContainer.clear(self)
+        self._writers = None
+
+    def prepareDisk(self):
+        """Stream the traces and text/key rows to the segment files as they are added, instead of keeping them in RAM"""
+        if not self.config.configFilename():
+            return
+        self._writers = {}
+        self.config.saveTrace()
+
+    def _streamFile(self, name):
+        return os.path.dirname(self.config.configFilename()) + "/%s%s.npy" % (self.config.attr("prefix"), name)
+
+    def _streamRow(self, name, row, dtype):
+        """Append row to the file of column name, creating it with the shape of the first row"""
+        w = self._writers.get(name)
+        if w is None:
+            w = NpyAppendWriter(self._streamFile(name), np.shape(row), dtype, capacity=self.tracehint)
+            self._writers[name] = w
+        w.append(row)
+        return w.data()
+
+    def _streamRows(self, name, rows, dtype):
+        """Append a block of rows to the file of column name, creating it with the shape of the rows"""
+        w = self._writers.get(name)
+        if w is None:
+            w = NpyAppendWriter(self._streamFile(name), np.shape(rows)[1:], dtype, capacity=max(self.tracehint, len(rows)))
+            self._writers[name] = w
+        w.appendRows(rows)
+        return w.data()
+
+    def _streamText(self, name, data, rows):
+        """Stream a text/key column, or keep it in the rows list if the first row has no data"""
+        if name not in self._writers:
+            if data is None:
+                self._writers[name] = None
+            else:
+                return self._streamRow(name, data, np.uint8)
+        if self._writers[name] is None:
+            rows.append(data)
+            return rows
+        if data is None:
+            data = 0
+        return self._streamRow(name, data, np.uint8)
+
+    def _streamTextRows(self, name, data, rows, count):
+        """Block version of _streamText, data being a 2D array of count rows or None"""
+        if name not in self._writers:
+            if data is None:
+                self._writers[name] = None
+            else:
+                return self._streamRows(name, data, np.uint8)
+        if self._writers[name] is None:
+            rows.extend([None] * count if data is None else list(data))
+            return rows
+        if data is None:
+            data = np.zeros((count,) + self._writers[name].rowshape, dtype=np.uint8)
+        return self._streamRows(name, data, np.uint8)
+
+    def _flushStream(self):
+        for w in self._writers.values():
+            if w is not None:
+                w.flush()
+        self.config.saveTrace()
+
+    def addWave(self, trace, dtype=None):
+        if self._writers is None:
+            return TraceContainer.addWave(self, trace, dtype)
+
+        trace, dtype = self._encodeTrace(trace, dtype)
+        w = self._writers.get("traces")
+        if w is None:
+            if dtype is None:
+                dtype = np.double
+            self.tracedtype = dtype
+        else:
+            trace = self._padTrace(trace, w.rowshape[0])
+        self.traces = self._streamRow("traces", trace, self.tracedtype)
+
+        self._numTraces += 1
+        self.setDirty(True)
+        self.writeDataToConfig()
+        if self._numTraces % self.streamFlushInterval == 0:
+            self._flushStream()
+
+    def addTraces(self, traces, textins, textouts, keys, dtype=None):
+        """
+        Add a block of traces (2D array) with one row of textins, textouts and keys per trace (keys may be None). When
+        streaming, the block is appended to the files in one go.
+        """
+        if self._writers is None:
+            for i in range(len(traces)):
+                self.addTrace(traces[i], textins[i], textouts[i], None if keys is None else keys[i], dtype)
+            return
+
+        traces, dtype = self._encodeTrace(traces, dtype)
+        w = self._writers.get("traces")
+        if w is None:
+            if dtype is None:
+                dtype = np.double
+            self.tracedtype = dtype
+        elif np.shape(traces)[1] < w.rowshape[0]:
+            traces = np.array([self._padTrace(t, w.rowshape[0]) for t in traces])
+        self.traces = self._streamRows("traces", traces, self.tracedtype)
+        self.textins = self._streamTextRows("textin", textins, self.textins, len(traces))
+        self.textouts = self._streamTextRows("textout", textouts, self.textouts, len(traces))
+        self.keylist = self._streamTextRows("keylist", keys, self.keylist, len(traces))
+
+        before = self._numTraces
+        self._numTraces += len(traces)
+        self.setDirty(True)
+        self.writeDataToConfig()
+        if self._numTraces // self.streamFlushInterval != before // self.streamFlushInterval:
+            self._flushStream()
+
+    def addTextin(self, data):
+        if self._writers is None:
+            return TraceContainer.addTextin(self, data)
+        self.textins = self._streamText("textin", data, self.textins)
 
-        self.textins = np.zeros([self.numTrace, 16], dtype=np.uint8)
-        for n in range(0, self.numTrace):
-            tin = srcTraces.textins[n]
-            self.textins[n] = map(int, tin, [16] * len(tin))
+    def addTextout(self, data):
+        if self._writers is None:
+            return TraceContainer.addTextout(self, data)
+        self.textouts = self._streamText("textout", data, self.textouts)
 
-        self.textouts = np.zeros([self.numTrace, 16], dtype=np.uint8)
-        for n in range(0, self.numTrace):
-            tout = srcTraces.textouts[n]
-            self.textouts[n] = map(int, tout, [16] * len(tout))
+    def addKey(self, key):
+        if self._writers is None:
+            return TraceContainer.addKey(self, key)
+        self.keylist = self._streamText("keylist", key, self.keylist)
+
+    def _finishStream(self):
+        """Finalize the streamed files, and save the columns which were not streamed the usual way"""
+        self.config.saveTrace()
+        for name, attr in (("traces", "traces"), ("textin", "textins"), ("textout", "textouts"), ("keylist", "keylist")):
+            w = self._writers.get(name)
+            if w is not None:
+                w.finalize()
+                setattr(self, attr, np.load(self._streamFile(name), mmap_mode='r'))
+            else:
+                np.save(self._streamFile(name), getattr(self, attr))
+        np.save(self._streamFile("knownkey"), self.knownkey)
+        logging.debug('Finished streaming %d traces to %s' % (self._numTraces, self._streamFile("traces")))
+        self._writers = None
+        self.setDirty(False)
+
+    def _resumeStream(self, numPoints, source, numTraces, withKeys):
+        """
+        Reopen the files left by an interrupted streaming copy of the trace set with config file source (numTraces
+        traces) to append to them. Returns the number of traces they all hold, or 0 (and starts a new stream) if there
+        is nothing to resume or the files were written by a copy of something else.
+        """
+        self.prepareDisk()
+        if source is None or self.config.attr("copySource") != source or \
+                int(self.config.attr("copySourceTraces")) != numTraces:
+            return 0
+        names = ("traces", "textin", "textout")
+        if withKeys:
+            names += ("keylist",)
+        if not all([os.path.isfile(self._streamFile(n)) for n in names]):
+            return 0
+        try:
+            writers = dict([(n, NpyAppendWriter.reopen(self._streamFile(n))) for n in names])
+        except (IOError, ValueError) as e:
+            logging.warning("Can't resume copy into %s, starting over: %s" % (self._streamFile("traces"), str(e)))
+            return 0
+        if writers["traces"].rowshape != (numPoints,):
+            for w in writers.values():
+                w.finalize()
+            return 0
+
+        count = min([w.rows for w in writers.values()])
+        for w in writers.values():
+            w.rows = count
+        self._writers = writers
+        self.tracedtype = writers["traces"].dtype
+        self.traces = writers["traces"].data()
+        self.textins = writers["textin"].data()
+        self.textouts = writers["textout"].data()
+        if withKeys:
+            self.keylist = writers["keylist"].data()
+        else:
+            self._writers["keylist"] = None
+            self.keylist = [None] * count
+        self._numTraces = count
+        return count
+
+    @staticmethod
+    def _textRows(rows):
+        """Text rows of a copy source as a uint8 matrix: hex strings (e.g. loaded as '|S2') are decoded"""
+        rows = np.asarray(rows)
+        if rows.dtype.kind in ('S', 'U'):
+            return decodeHex(rows)
+        return rows.astype(np.uint8)
+
+    @classmethod
+    def _keyRows(cls, srcTraces, start, end):
+        """Per-trace keys start to end-1 of a copy source as a uint8 matrix, None if it doesn't have them"""
+        keylist = getattr(srcTraces, "keylist", None)
+        if keylist is None or len(keylist) < end:
+            return None
+        rows = keylist[start:end]
+        if any([r is None for r in rows]):
+            return None
+        return cls._textRows(rows)
+
+    def copyTo(self, srcTraces=None, progressBar=None, resume=False):
+        """
+        Import all traces of srcTraces, copyBlockSize traces at a time. srcTraces can be a TraceContainer or any
+        object with traces, textins and textouts arrays (text as numbers or hex strings), and optionally a keylist.
+
+        If this container has a config file, the blocks are streamed to its files, which are made loadable after every
+        block. With resume=True, an interrupted copy of the same trace set (a TraceContainer with a config file, which
+        is recorded in this one's config along with its number of traces) carries on after the last block which was
+        written.
+        """
+        numTraces = srcTraces.numTraces()
+        numPoints = srcTraces.numPoints()
+        self.numTrace = numTraces
+        self.numPoint = numPoints
+        self.knownkey = srcTraces.knownkey
+        if getattr(srcTraces, "sampleScale", None) is not None:
+            self.setSampleScaling(srcTraces.sampleScale, srcTraces.sampleOffset, srcTraces.tracedtype)
 
         if srcTraces.tracedtype:
             userdtype = srcTraces.tracedtype
         else:
-            userdtype = np.float
+            userdtype = np.float64
 
-        self.traces = np.array(srcTraces.traces, dtype=userdtype)
+        source = None
+        if getattr(srcTraces, "config", None) is not None and srcTraces.config.configFilename():
+            source = os.path.abspath(srcTraces.config.configFilename())
+        withKeys = numTraces > 0 and self._keyRows(srcTraces, 0, 1) is not None
 
-        # Traces copied in means not saved
-        self.setDirty(True)
+        done = 0
+        if self.config.configFilename():
+            self.setTraceHint(numTraces)
+            if resume:
+                done = self._resumeStream(numPoints, source, numTraces, withKeys)
+            else:
+                self.prepareDisk()
+            if done:
+                logging.info("Resuming copy at trace %d of %d" % (done, numTraces))
+            self.config.setAttr("copySource", "" if source is None else source)
+            self.config.setAttr("copySourceTraces", numTraces)
+            self.config.saveTrace()
+        else:
+            self.tracedtype = np.dtype(self._encodeTrace(np.zeros(0), userdtype)[1])
+            self.traces = np.empty((numTraces, numPoints), dtype=self.tracedtype)
+            self.textins = None
+            self.textouts = None
+
+        if progressBar:
+            progressBar.setMaximum(numTraces)
+
+        for start in range(done, numTraces, self.copyBlockSize):
+            end = min(start + self.copyBlockSize, numTraces)
+            if hasattr(srcTraces, "getTraces"):
+                traces = srcTraces.getTraces(start, end)
+            else:
+                traces = srcTraces.traces[start:end]
+            textins = self._textRows(srcTraces.textins[start:end])
+            textouts = self._textRows(srcTraces.textouts[start:end])
+            keys = self._keyRows(srcTraces, start, end) if withKeys else None
+
+            if self._writers is not None:
+                self.addTraces(traces, textins, textouts, keys, userdtype)
+                self._flushStream()
+            else:
+                if self.textins is None:
+                    self.textins = np.zeros((numTraces, textins.shape[1]), dtype=np.uint8)
+                    self.textouts = np.zeros((numTraces, textouts.shape[1]), dtype=np.uint8)
+                self.traces[start:end] = self._encodeTrace(traces, userdtype)[0]
+                self.textins[start:end] = textins
+                self.textouts[start:end] = textouts
+                if keys is not None:
+                    if start == 0:
+                        self.keylist = np.zeros((numTraces, keys.shape[1]), dtype=np.uint8)
+                    self.keylist[start:end] = keys
+                self._numTraces = end
+
+            if progressBar:
+                progressBar.updateStatus(end)
+                if progressBar.wasAborted():
+                    return
+
+        if self._writers is not None:
+            self._finishStream()
+        else:
+            # Traces copied in means not saved
+            self.setDirty(True)
 
     def loadAllTraces(self, directory=None, prefix=""):
         """Load all traces into memory"""
@@ -65,6 +359,7 @@ class TraceContainerNative(TraceContainer):
                 prefix = self.config.attr("prefix")
 
         self.traces = np.load(directory + "/%straces.npy" % prefix, mmap_mode='r')
+        self.tracedtype = self.traces.dtype
         self.textins = np.load(directory + "/%stextin.npy" % prefix)
         self.textouts = np.load(directory + "/%stextout.npy" % prefix)
 
@@ -79,6 +374,8 @@ class TraceContainerNative(TraceContainer):
         except IOError:
             self.keylist = None
 
+        self._readSampleScaling()
+
         # Traces loaded means saved
         self.setDirty(False)
         self._isloaded = True
@@ -122,7 +419,10 @@ class TraceContainerNative(TraceContainer):
         self.setDirty(False)
 
     def closeAll(self, clearTrace=True, clearText=True, clearKeys=True):
-        self.saveAllTraces(os.path.dirname(self.config.configFilename()), prefix=self.config.attr("prefix"))
+        if self._writers is not None:
+            self._finishStream()
+        else:
+            self.saveAllTraces(os.path.dirname(self.config.configFilename()), prefix=self.config.attr("prefix"))
 
         # Release memory associated with data in case this isn't deleted
         if clearTrace:
@@ -64,6 +64,47 @@ class TraceContainer(Parameterized, Plugin):
         self.pointhint = 0
         self._numTraces = 0
         self._isloaded = False
+        self.sampleReadDtype = np.float64
+        self._readSampleScaling()
+
+    def _readSampleScaling(self):
+        """Pick up the sample scaling stored in the config file (if any)"""
+        scale = float(self.config.attr("sampleScale"))
+        if scale:
+            self.sampleScale = scale
+            self.sampleOffset = float(self.config.attr("sampleOffset"))
+        else:
+            self.sampleScale = None
+            self.sampleOffset = 0.0
+
+    def setSampleScaling(self, scale, offset, dtype=np.uint16):
+        """
+        Store the trace samples as integer codes of type dtype, where sample = code * scale - offset.
+
+        Must be called before the first trace is added. The scale and offset are kept in the config file, and
+        getTrace()/getTraces() convert the codes back to floating point (sampleReadDtype) as they are read.
+        """
+        self.sampleScale = float(scale)
+        self.sampleOffset = float(offset)
+        self.tracedtype = dtype
+        self.config.setAttr("sampleScale", repr(self.sampleScale))
+        self.config.setAttr("sampleOffset", repr(self.sampleOffset))
+
+    def _encodeTrace(self, trace, dtype):
+        """Return the trace and dtype to store: the trace as-is, or its integer codes if sample scaling is on"""
+        if self.sampleScale is None:
+            return trace, dtype
+        codes = np.rint((np.asarray(trace, dtype=np.float64) + self.sampleOffset) / self.sampleScale)
+        info = np.iinfo(self.tracedtype)
+        return np.clip(np.nan_to_num(codes), info.min, info.max), self.tracedtype
+
+    def _decodeTraces(self, data):
+        """Convert stored samples (one trace or a block) to the values which were captured"""
+        if self.sampleScale is None:
+            return data
+        out = np.multiply(data, self.sampleScale, dtype=self.sampleReadDtype)
+        out -= self.sampleOffset
+        return out
 
     def setDirty(self, dirty):
         self.dirty = dirty
@@ -106,6 +147,7 @@ class TraceContainer(Parameterized, Plugin):
         self.config.setAttr("numPoints", self.numPoints())      
 
     def addWave(self, trace, dtype=None):
+        trace, dtype = self._encodeTrace(trace, dtype)
         try:
             if self.traces is None:
                 if dtype is None:
@@ -123,14 +165,7 @@ class TraceContainer(Parameterized, Plugin):
                     # Do a resize now to allocate more memory
                     self.traces.resize((self.tracehint, self.traces.shape[1]))
 
-                #Validate traces fit - if too short warn & pad (prevents aborting long captures)
-                pad = self.traces.shape[1] - len(trace)
-                if pad > 0:
-                    logging.warning('Trace too short (length=%d)' % len(trace) + " *This MAY SUGGEST DATA CORRUPTION*")
-                    logging.warning('Padding with %d zero points' % pad)
-                    trace = np.concatenate((trace, [0]*pad))
-
-                self.traces[self._numTraces][:] = trace
+                self.traces[self._numTraces][:] = self._padTrace(trace, self.traces.shape[1])
         except MemoryError:
             raise Warning("Failed to allocate/resize array for %d x %d, if you have sufficient memory it may be fragmented. Use smaller segments and retry." % (self.tracehint, self.traces.shape[1]))
             
@@ -138,6 +173,16 @@ class TraceContainer(Parameterized, Plugin):
         self.setDirty(True)
         self.writeDataToConfig()
 
+    @staticmethod
+    def _padTrace(trace, numPoints):
+        """Validate trace fits - if too short warn & pad (prevents aborting long captures)"""
+        pad = numPoints - len(trace)
+        if pad > 0:
+            logging.warning('Trace too short (length=%d)' % len(trace) + " *This MAY SUGGEST DATA CORRUPTION*")
+            logging.warning('Padding with %d zero points' % pad)
+            trace = np.concatenate((trace, [0]*pad))
+        return trace
+
     def setKnownKey(self, key):
         self.knownkey = key
 
@@ -151,7 +196,7 @@ class TraceContainer(Parameterized, Plugin):
         self.textouts.append(data)
         
     def getTrace(self, n):
-        data = self.traces[n]
+        data = self._decodeTraces(self.traces[n])
 
         #Following line will normalize all traces relative to each
         #other by mean & standard deviation
@@ -170,6 +215,23 @@ class TraceContainer(Parameterized, Plugin):
                 return self.keylist[n]
 
         return self.knownkey
+
+    def getTraces(self, start, end):
+        """Return traces start to end-1 as a 2D array (a view, when the traces are in one array and not scaled)"""
+        return self._decodeTraces(self.traces[start:end])
+
+    def getTextins(self, start, end):
+        return np.asarray(self.textins[start:end])
+
+    def getTextouts(self, start, end):
+        return np.asarray(self.textouts[start:end])
+
+    def getKnownKeys(self, start, end):
+        if hasattr(self, 'keylist'):
+            if self.keylist is not None:
+                return np.asarray(self.keylist[start:end])
+
+        return np.asarray([self.knownkey] * (end - start))
     
     def getAuxDataConfig(self, newmodule):
         """
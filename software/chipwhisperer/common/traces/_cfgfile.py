@@ -108,7 +108,11 @@ class TraceContainerConfig(object):
                     "scopeSampleRate":{"order":8, "value":0, "desc":"Sample Rate (s/sec)", "changed":False, "headerLabel":"Sample Rate", "editable":True},
                     "scopeYUnits":{"order":9, "value":0, "desc":"Units of Y Points", "changed":False, "editable":True},
                     "scopeXUnits":{"order":10, "value":0, "desc":"Units of X Points", "changed":False, "editable":True},
-                    "notes":{"order":11, "value":"", "desc":"Additional Notes about Capture Setup", "changed":False, "headerLabel":"Notes", "editable":True}                
+                    "notes":{"order":11, "value":"", "desc":"Additional Notes about Capture Setup", "changed":False, "headerLabel":"Notes", "editable":True},
+                    "sampleScale":{"order":12, "value":0, "desc":"Scale of stored integer samples (0 if samples are stored as-is)", "changed":False, "editable":False},
+                    "sampleOffset":{"order":13, "value":0, "desc":"Offset of stored integer samples, sample = code * scale - offset", "changed":False, "editable":False},
+                    "copySource":{"order":14, "value":"", "desc":"Config file of the trace set these traces were copied from", "changed":False, "editable":False},
+                    "copySourceTraces":{"order":15, "value":0, "desc":"Number of traces of the trace set these traces were copied from", "changed":False, "editable":False}
                     },
                 }
     
@@ -118,12 +122,39 @@ class TraceContainerConfig(object):
         if configfile is not None:
             configfile = os.path.normpath(configfile)
         self._configfile = configfile
+        self._deferred = None
 
         #Attempt load/sync
         self.loadTrace(configfile)
-        
+
+    def __getattr__(self, name):
+        # The ConfigObj of a deferred config is only read when it is first needed
+        if name == "config" and self.__dict__.get("_deferred") is not None:
+            self._loadDeferred()
+            return self.config
+        raise AttributeError(name)
+
+    def deferLoad(self, configfile, values):
+        """
+        Use configfile without reading it yet: the attributes in the dictionary values (e.g. cached from an index) are
+        returned by attr() as they are, and the file is loaded the first time anything else is needed.
+        """
+        self._configfile = os.path.normpath(configfile)
+        self._deferred = dict(values)
+        self.__dict__.pop("config", None)
+
+    def isDeferred(self):
+        """True if the config file hasn't been read yet (see deferLoad())"""
+        return self._deferred is not None
+
+    def _loadDeferred(self):
+        if self._deferred is not None:
+            self._deferred = None
+            self.loadTrace()
+
     def module(self, attr, moduleName=None):
         """Given an attribute & possibly module name, return reference to module dictionary"""
+        self._loadDeferred()
         module = None
                 
         if moduleName == None:
@@ -170,7 +201,9 @@ class TraceContainerConfig(object):
         return self._configfile
      
     def attr(self, attr, moduleName=None):
-        """Get value of attribute specified from internal DB"""       
+        """Get value of attribute specified from internal DB"""
+        if self._deferred is not None and moduleName is None and attr in self._deferred:
+            return self._deferred[attr]
         return self.attrDict(attr, moduleName)["value"]
     
     def attrDict(self, attr, moduleName=None):
@@ -230,6 +263,7 @@ class TraceContainerConfig(object):
         
     def loadTrace(self, configfile=None):
         """Load config file. Syncs internal DB to File"""
+        self._deferred = None
         if configfile:
             self._configfile = os.path.normpath(configfile)
             if not os.path.isfile(configfile):
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+import struct
+
+import numpy as np
+
+
+class NpyAppendWriter(object):
+    """
+    Appends rows to a .npy file through a memory map, growing the file geometrically when it is full.
+
+    The header lives in a fixed-size block in front of the data, so it can be rewritten in place: after every flush()
+    the file is a valid .npy holding the rows written so far (plus unused space at the end), and finalize() trims it
+    to the exact size. np.load() reads the file like any other .npy at any of these points.
+    """
+
+    headerSize = 4096
+
+    def __init__(self, filename, rowshape, dtype, capacity=1):
+        self.filename = filename
+        self.rowshape = tuple([int(x) for x in rowshape])
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.array = None
+        self._rowbytes = self.dtype.itemsize * int(np.prod(self.rowshape))
+        self._capacity = 0
+        self._f = open(filename, 'w+b')
+        self._writeHeader()
+        self._resize(max(1, capacity))
+
+    @classmethod
+    def reopen(cls, filename):
+        """
+        Open a file written by an NpyAppendWriter (e.g. by a run which was interrupted) to append rows after the ones
+        covered by its header
+        """
+        f = open(filename, 'r+b')
+        try:
+            np.lib.format.read_magic(f)
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            if f.tell() != cls.headerSize or fortran:
+                raise ValueError("%s was not written by %s" % (filename, cls.__name__))
+        except Exception:
+            f.close()
+            raise
+
+        self = cls.__new__(cls)
+        self.filename = filename
+        self.rowshape = tuple(shape[1:])
+        self.dtype = dtype
+        self.rows = shape[0]
+        self.array = None
+        self._rowbytes = self.dtype.itemsize * int(np.prod(self.rowshape))
+        self._f = f
+        f.seek(0, 2)
+        self._resize(max(1, self.rows, (f.tell() - self.headerSize) // max(1, self._rowbytes)))
+        return self
+
+    def _resize(self, capacity):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+        self._f.truncate(self.headerSize + capacity * self._rowbytes)
+        self._capacity = capacity
+        self.array = np.memmap(self._f, dtype=self.dtype, mode='r+', offset=self.headerSize, shape=(capacity,) + self.rowshape)
+
+    def _writeHeader(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(self.dtype), (self.rows,) + self.rowshape)
+        header = header.ljust(self.headerSize - 11) + "\n"
+        self._f.seek(0)
+        self._f.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self._f.flush()
+
+    def append(self, row):
+        """Add one row at the end of the file"""
+        if self.rows >= self._capacity:
+            self._resize(self._capacity * 2)
+        self.array[self.rows] = row
+        self.rows += 1
+
+    def appendRows(self, rows):
+        """Add a block of rows at the end of the file"""
+        n = len(rows)
+        if self.rows + n > self._capacity:
+            capacity = self._capacity
+            while capacity < self.rows + n:
+                capacity *= 2
+            self._resize(capacity)
+        self.array[self.rows:self.rows + n] = rows
+        self.rows += n
+
+    def data(self):
+        """Return the rows written so far (a view of the memory map)"""
+        return self.array[:self.rows]
+
+    def flush(self):
+        """Write the data and a header covering all rows so far to disk"""
+        self.array.flush()
+        self._writeHeader()
+
+    def finalize(self):
+        """Flush, trim the unused capacity and close the file"""
+        self.flush()
+        self.array = None
+        self._f.truncate(self.headerSize + self.rows * self._rowbytes)
+        self._f.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+
+import binascii
+import pickle
+import struct
+
+import numpy as np
+
+
+def packWave(wave, dtype=None):
+    """
+    Encode a wave as a blob: one byte giving the length of the dtype string, the dtype string (always little-endian),
+    then the samples as raw little-endian binary
+    """
+    wave = np.asarray(wave, dtype=dtype)
+    dt = wave.dtype.newbyteorder('<')
+    descr = dt.str.encode('ascii')
+    return struct.pack('B', len(descr)) + descr + wave.astype(dt, copy=False).tobytes()
+
+
+def unpackWave(blob):
+    """Decode a blob written by packWave()"""
+    blob = bytes(blob)
+    n = struct.unpack('B', blob[:1])[0]
+    dt = np.dtype(blob[1:1 + n].decode('ascii'))
+    return np.frombuffer(blob, dtype=dt, offset=1 + n)
+
+
+def _packPickle(wave, dtype=None):
+    return pickle.dumps(np.asarray(wave, dtype=dtype), protocol=2)
+
+
+def _unpackPickle(blob):
+    return np.array(pickle.loads(bytes(blob)))
+
+
+def hexString(data):
+    """Bytes as an upper-case hex string, '' for None"""
+    if data is None:
+        return ""
+    return binascii.hexlify(bytearray([int(t) for t in data])).decode('ascii').upper()
+
+
+def hexBytes(strings):
+    """
+    Decode a list of hex strings to a 2D uint8 array, one row per string. If the strings don't all have the same length
+    (e.g. some of the fields are empty) a 1D object array holding one uint8 array per string is returned instead.
+    """
+    if len(set([len(s) for s in strings])) > 1:
+        rows = np.empty(len(strings), dtype=object)
+        for i, s in enumerate(strings):
+            rows[i] = np.frombuffer(binascii.unhexlify(s), dtype=np.uint8)
+        return rows
+    raw = b"".join([binascii.unhexlify(s) for s in strings])
+    return np.frombuffer(raw, dtype=np.uint8).reshape(len(strings), -1 if strings else 0)
+
+
+class TraceDB(object):
+    """
+    A table of traces accessed through a DB-API 2 connection (MySQL, or SQLite for local testing and benchmarks).
+
+    Inserts are buffered and written batchSize rows at a time with executemany() in one transaction. Trace n is the
+    row with Id = first Id + n, so reads select ranges of the primary key and return the waves and text of a whole
+    block in one query; single trace reads fetch a window of prefetch traces at a time and serve the next ones from
+    it. This needs the Ids to be contiguous, which they are for a table only ever filled by add().
+
+    Wave blobs are passed to the driver through binary, its DB-API Binary() constructor (sqlite3.Binary for SQLite,
+    MySQLdb.Binary by default for MySQL), as some drivers reject raw byte strings.
+    """
+
+    batchSize = 256
+    prefetch = 256
+
+    _formats = {'binary':(packWave, unpackWave), 'pickle':(_packPickle, _unpackPickle)}
+
+    def __init__(self, connection, tableName, dialect='mysql', waveFormat='binary', binary=None):
+        if dialect not in ('mysql', 'sqlite'):
+            raise ValueError("Invalid database dialect: %s" % dialect)
+        if binary is None:
+            if dialect == 'sqlite':
+                import sqlite3
+                binary = sqlite3.Binary
+            else:
+                import MySQLdb
+                binary = MySQLdb.Binary
+        self._binary = binary
+        self.connection = connection
+        self.tableName = tableName
+        self.dialect = dialect
+        self._pack, self._unpack = self._formats[waveFormat]
+        self._param = '?' if dialect == 'sqlite' else '%s'
+        self._pending = []
+        self._firstId = None
+        self._count = None
+        self._cache = None
+        self._cacheStart = 0
+        self._block = None
+
+    def _query(self, query, args=()):
+        cur = self.connection.cursor()
+        try:
+            cur.execute(query, args)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def createTable(self):
+        if self.dialect == 'sqlite':
+            idcol = "Id INTEGER PRIMARY KEY AUTOINCREMENT"
+            blob = "BLOB"
+        else:
+            idcol = "Id INT PRIMARY KEY AUTO_INCREMENT"
+            blob = "MEDIUMBLOB"
+        self._query("CREATE TABLE IF NOT EXISTS %s(%s, Textin VARCHAR(32), EncKey VARCHAR(32), Textout VARCHAR(32), "
+                    "Wave %s)" % (self.tableName, idcol, blob))
+        self.connection.commit()
+
+    def add(self, wave, textin, textout, key, dtype=None):
+        """Queue one trace for insertion, writing the queue once it holds batchSize traces"""
+        self._pending.append((hexString(textin), hexString(textout), hexString(key), self._binary(self._pack(wave, dtype))))
+        if len(self._pending) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """Insert all queued traces in one transaction"""
+        if not self._pending:
+            return
+        cur = self.connection.cursor()
+        try:
+            cur.executemany("INSERT INTO %s(Textin, Textout, EncKey, Wave) VALUES(%s)" %
+                            (self.tableName, ", ".join([self._param] * 4)), self._pending)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+        self._pending = []
+        self._firstId = None
+        self._count = None
+        self._cache = None
+        self._block = None
+
+    def numTraces(self):
+        self.flush()
+        count, first = self._query("SELECT COUNT(*), MIN(Id) FROM %s" % self.tableName)[0]
+        self._firstId = first
+        self._count = int(count)
+        return self._count
+
+    def numPoints(self):
+        if self.numTraces() == 0:
+            return 0
+        return len(self.read(0, 1)[0][0])
+
+    def read(self, start, end):
+        """
+        Return (waves, textins, textouts, keys) of traces start to end-1, as one 2D array each. The last block read is
+        kept, so reading its waves and text separately only takes one query.
+        """
+        self.flush()
+        if self._block is not None and self._block[0] == (start, end):
+            return self._block[1]
+        if self._count is None:
+            self.numTraces()
+        if self._firstId is None or end <= start:
+            return np.zeros((0, 0)), np.zeros((0, 0), np.uint8), np.zeros((0, 0), np.uint8), np.zeros((0, 0), np.uint8)
+        rows = self._query("SELECT Wave, Textin, Textout, EncKey FROM %s WHERE Id BETWEEN %s AND %s ORDER BY Id" %
+                           (self.tableName, self._param, self._param), (self._firstId + start, self._firstId + end - 1))
+        if len(rows) != end - start:
+            raise IndexError("Traces %d to %d requested but %d found in %s" % (start, end - 1, len(rows), self.tableName))
+        waves = np.array([self._unpack(r[0]) for r in rows])
+        block = (waves,) + tuple([hexBytes([r[i] or "" for r in rows]) for i in (1, 2, 3)])
+        self._block = ((start, end), block)
+        return block
+
+    def get(self, n):
+        """Return (wave, textin, textout, key) of trace n, from the prefetch window"""
+        if self._cache is None or not (self._cacheStart <= n < self._cacheStart + len(self._cache[0])):
+            if self._count is None:
+                self.numTraces()
+            self._cache = self.read(n, min(n + self.prefetch, self._count))
+            self._cacheStart = n
+        i = n - self._cacheStart
+        return tuple([c[i] for c in self._cache])
@@ -27,6 +27,7 @@ from PySide.QtCore import *
 from PySide.QtGui import *
 import chipwhisperer.common.utils.qt_tweaks as QtFixes
 import pyqtgraph as pg
+from chipwhisperer.common.utils.envelope import EnvelopePyramid, joinRows
 
 
 class ColorDialog(QtFixes.QDialog):
@@ -106,6 +107,10 @@ class GraphWidget(QWidget):
         self.persistantItems = []
         self._customWidgets = []
 
+        #Plots drawn from an EnvelopePyramid, redrawn at the resolution of the view when it changes
+        self._envelopes = []
+        self._updatingEnvelopes = False
+
         self.colorDialog = ColorDialog()
 
         self.pw = pg.PlotWidget(name="Power Trace View")
@@ -126,6 +131,7 @@ class GraphWidget(QWidget):
         vb.setMouseMode(vb.RectMode)
         vb.sigStateChanged.connect(self.VBStateChanged)
         vb.sigXRangeChanged.connect(self.VBXRangeChanged)
+        vb.sigResized.connect(self.updateEnvelopes)
 
         self.proxysig = pg.SignalProxy(self.pw.plotItem.vb.scene().sigMouseMoved, rateLimit=10, slot=self.mouseMoved)
 
@@ -263,6 +269,7 @@ class GraphWidget(QWidget):
     def VBXRangeChanged(self, vb, range):
         """Called when X-Range changed"""
         self.xRangeChanged.emit(range[0], range[1])
+        self.updateEnvelopes()
         
     def xRange(self):
         """Returns the X-Range"""
@@ -290,7 +297,13 @@ class GraphWidget(QWidget):
         vb = self.pw.getPlotItem().getViewBox()
         bounds = vb.childrenBoundingRect(None)
         # print bounds
-        vb.setXRange(bounds.left(), bounds.right())
+        left, right = bounds.left(), bounds.right()
+        #Envelope plots only hold the data around the view, so they don't cover the full X range
+        for _, pyramid, _, _ in self._envelopes:
+            xb = pyramid.xBounds()
+            if xb is not None:
+                left, right = min(left, xb[0]), max(right, xb[1])
+        vb.setXRange(left, right)
         
     def yAutoScale(self, enabled):
         """Auto-fit Y axis to data"""
@@ -326,6 +339,7 @@ class GraphWidget(QWidget):
 
         if not self.persistant:
             self.pw.clear()
+            self._envelopes = []
 
         if self.persistant and self.autocolor:
             nc = (self.acolor + 1) % 8
@@ -341,6 +355,10 @@ class GraphWidget(QWidget):
         else:
             enableds = True
 
+        #Peak mode is done here with a cached envelope, the other modes are left to pyqtgraph
+        if dsmode == 'peak':
+            enableds = False
+
         if hasattr(self.pw, 'setDownsampling'):
             self.pw.setDownsampling(ds=enableds, auto=True, mode=dsmode)
 
@@ -350,7 +368,10 @@ class GraphWidget(QWidget):
         if pen is None:
             pen = pg.mkPen(self.acolor)
 
-        p = self.pw.plot(x=xaxis, y=trace, pen=pen)
+        if dsmode == 'peak':
+            p = self.plotEnvelope(EnvelopePyramid(trace, xaxis), pen=pen)
+        else:
+            p = self.pw.plot(x=xaxis, y=trace, pen=pen)
         self.setupPlot(p, 0, True, idString)
 
         if ghostTrace is False:
@@ -360,9 +381,53 @@ class GraphWidget(QWidget):
         self.checkPersistantItems()
         return p
 
+    def plotEnvelope(self, pyramid, row=None, joined=False, **kargs):
+        """
+        Plot the min/max envelope of pyramid (an EnvelopePyramid) at the resolution of the view, and keep it updated
+        when the view is zoomed, panned or resized. For a 2D pyramid either plot a single row, or with joined=True
+        all rows as one curve (see envelope.joinRows). Other arguments are passed to PlotWidget.plot().
+        """
+        p = self.pw.plot(**kargs)
+        env = (p, pyramid, row, joined)
+        self._envelopes.append(env)
+        self._drawEnvelope(env, None)
+        return p
+
+    def _drawEnvelope(self, env, xrange):
+        p, pyramid, row, joined = env
+        vb = self.pw.getPlotItem().getViewBox()
+        width = max(int(vb.width()), 256)
+        if xrange is None:
+            start, end = 0, pyramid.numPoints()
+        else:
+            #Also keep one view width on each side, so short pans still have data to show
+            start, end = pyramid.indexRange(xrange[0], xrange[1])
+            visible = max(end - start, 1)
+            start, end = max(0, start - visible), min(pyramid.numPoints(), end + visible)
+            width = width * max(end - start, 1) // visible
+        x, y = pyramid.envelope(start, end, width)
+        if row is not None:
+            y = y[row]
+        elif joined:
+            x, y = joinRows(x, y)
+        p.setData(x=x, y=y)
+
+    def updateEnvelopes(self, *args):
+        """Redraw the envelope plots for the current view"""
+        if self._updatingEnvelopes or not self._envelopes:
+            return
+        self._updatingEnvelopes = True
+        try:
+            xrange = self.xRange()
+            for env in self._envelopes:
+                self._drawEnvelope(env, xrange)
+        finally:
+            self._updatingEnvelopes = False
+
     def clearPushed(self):
         """Clear display"""
         self.pw.clear()
+        self._envelopes = []
         self.checkPersistantItems()
         self.acolor = self.seedColor
 
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013-2017, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.assembla.com/spaces/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+
+
+import numpy as np
+
+
+class EnvelopePyramid(object):
+    """
+    Min/max envelope of an array at several resolutions, for plotting arrays much longer than the screen is wide.
+
+    Level k holds the minimum and maximum of every block of factor**k points along the last axis of data (level 0 is
+    the data itself). Levels are built on first use, each from the one below, so the whole pyramid costs about
+    1/(factor-1) of the data size. envelope() reduces any range of the data to a given number of buckets starting from
+    the coarsest level that is still finer than the bucket size, so a view of any zoom level is computed in time
+    proportional to the number of pixels rather than the number of points.
+
+    data may be 1D, or 2D to keep the envelope of several rows (e.g. one per key guess) on the same X axis. NaNs are
+    ignored unless a whole bucket is NaN.
+    """
+
+    factor = 4
+
+    def __init__(self, data, x=None, offset=0):
+        self.data = np.asarray(data, dtype=np.float64)
+        if self.data.ndim not in (1, 2):
+            raise ValueError("Expected a 1D or 2D array, got shape %s" % str(self.data.shape))
+        if x is not None:
+            x = np.asarray(x, dtype=np.float64)
+            if len(x) != self.numPoints():
+                raise ValueError("X axis has %d points but data has %d" % (len(x), self.numPoints()))
+        self.x = x
+        self.offset = offset
+        self._levels = [(self.data, self.data)]
+
+    def numPoints(self):
+        return self.data.shape[-1]
+
+    def xAt(self, idx):
+        """X coordinate of the points at index idx"""
+        if self.x is None:
+            return np.asarray(idx, dtype=np.float64) + self.offset
+        return self.x[idx]
+
+    def xBounds(self):
+        """X coordinates of the first and last point"""
+        if self.numPoints() == 0:
+            return None
+        return tuple(self.xAt([0, self.numPoints() - 1]))
+
+    def indexRange(self, xlo, xhi):
+        """Return the (start, end) index range of the points with xlo <= x <= xhi, X being sorted ascending"""
+        n = self.numPoints()
+        if self.x is None:
+            start = int(np.ceil(xlo - self.offset))
+            end = int(np.floor(xhi - self.offset)) + 1
+        else:
+            start = np.searchsorted(self.x, xlo, side='left')
+            end = np.searchsorted(self.x, xhi, side='right')
+        return min(max(int(start), 0), n), min(max(int(end), 0), n)
+
+    def level(self, k):
+        """(mins, maxes) of blocks of factor**k points, building the missing levels"""
+        while len(self._levels) <= k:
+            mins, maxes = self._levels[-1]
+            idx = np.arange(0, mins.shape[-1], self.factor)
+            self._levels.append((np.fmin.reduceat(mins, idx, axis=-1), np.fmax.reduceat(maxes, idx, axis=-1)))
+        return self._levels[k]
+
+    def envelope(self, start=0, end=None, width=1024):
+        """
+        Reduce points [start, end) to at most about width buckets.
+
+        Returns (x, y). If the range has no more than 2*width points they are returned as is. Otherwise every bucket
+        gives two points at the X coordinate of its first point, its minimum then its maximum, so plotting them as a
+        line draws one vertical stroke per bucket which covers everything the full data would.
+        """
+        n = self.numPoints()
+        if end is None or end > n:
+            end = n
+        start = max(0, start)
+        width = max(1, int(width))
+        if end - start <= 2 * width:
+            return self.xAt(np.arange(start, max(start, end))), self.data[..., start:max(start, end)]
+
+        bucket = (end - start) // width
+        k = 0
+        while self.factor ** (k + 1) <= bucket:
+            k += 1
+        bs = self.factor ** k
+        mins, maxes = self.level(k)
+        lstart = start // bs
+        lend = -(-end // bs)
+
+        #Merge whole blocks of the level into buckets; the edge buckets may reach a little outside [start, end)
+        step = -(-(lend - lstart) // width)
+        idx = np.arange(lstart, lend, step)
+        bmins = np.fmin.reduceat(mins[..., :lend], idx, axis=-1)
+        bmaxes = np.fmax.reduceat(maxes[..., :lend], idx, axis=-1)
+
+        y = np.empty(bmins.shape[:-1] + (2 * len(idx),))
+        y[..., 0::2] = bmins
+        y[..., 1::2] = bmaxes
+        return np.repeat(self.xAt(idx * bs), 2), y
+
+
+def envelope(data, width, x=None, offset=0):
+    """Envelope of a whole array reduced to about width buckets, see EnvelopePyramid.envelope()"""
+    return EnvelopePyramid(data, x, offset).envelope(0, None, width)
+
+
+def joinRows(x, y):
+    """
+    Join the rows of y, all on X axis x, into a single curve which can be drawn in one go: after each row the curve goes
+    back to the start along y=0.
+    """
+    y = np.asarray(y)
+    if y.ndim == 1:
+        return x, y
+    x = np.concatenate((x, [x[-1], x[0]])) if len(x) else x
+    jy = np.zeros((y.shape[0], len(x)))
+    jy[:, :y.shape[1]] = y
+    return np.tile(x, y.shape[0]), jy.ravel()
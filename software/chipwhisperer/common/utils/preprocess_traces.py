@@ -22,12 +22,57 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
 from chipwhisperer.common.api.CWCoreAPI import CWCoreAPI
 from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+from chipwhisperer.common.utils import util
+
+
+def fixedTextMask(textins, fixed):
+    """
+    Boolean mask of the rows of textins (2D array) equal to any of the texts in fixed, e.g. to split a TVLA set into
+    its fixed and random plaintext groups
+    """
+    textins = np.asarray(textins)
+    fixed = np.atleast_2d(np.asarray(fixed, dtype=textins.dtype))
+    mask = np.zeros(len(textins), dtype=bool)
+    for f in fixed:
+        mask |= np.all(textins == f, axis=1)
+    return mask
+
+
+def _function(method):
+    return getattr(method, '__func__', method)
+
+
+def _copySegment(args):
+    copier, srcfile, dstfile = args
+    return copier.copySegment(srcfile, dstfile)
+
 
 class CopyProject(object):
+    """
+    Copy the enabled trace segments of a project into a new project, filtering and transforming the traces on the way.
+
+    Each segment is read blockSize traces at a time. selectTraces() gives the traces of a block to keep and
+    transformTraces() what to write for them, both working on whole blocks (2D arrays); reimplement them to preprocess
+    traces. The output segments are streamed to memory-mapped files sized for the whole input segment and trimmed at
+    the end. With jobs > 1 the segments are copied by that many worker processes, which get a pickled copy of the
+    object: subclasses must then be importable, i.e. defined at module level and not in a script's __main__ block
+    (Windows starts the workers without the parent's __main__ definitions).
 
-    def __init__(self, oldprojectname, newprojectname):
+    trace_callback() is the older per-trace interface: if a subclass reimplements it, it is called for every kept trace.
+    """
+
+    blockSize = 1000
+
+    def __init__(self, oldprojectname, newprojectname, jobs=1):
+        self.jobs = jobs
 
         cwapi_new = CWCoreAPI()
         cwapi_old = CWCoreAPI()
@@ -38,45 +83,108 @@ class CopyProject(object):
         cwapi_new.saveProject(newprojectname)
 
         tm = cwapi_old.project().traceManager()
-        ntraces = tm.numTraces()
-
         segs = tm.getSegmentList()
 
-        numtraces = 0
-
-        for offset, seg_idx in enumerate(segs['offsetList']):
-            seg_len = segs['lengthList'][seg_idx]
+        tasks = []
+        for offset in segs['offsetList']:
+            seg = tm.getSegment(offset)
+            srcfile = seg.config.configFilename()
+            dstfile = cwapi_new.project().datadirectory + "traces/" + os.path.basename(srcfile)
+            tasks.append((self, srcfile, dstfile))
+
+        if self.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(self.jobs, len(tasks)))
+            try:
+                results = pool.map(_copySegment, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_copySegment(t) for t in tasks]
 
-            seg = tm.getSegment(seg_idx)
+        numtraces = 0
+        for dstfile, count in results:
             tc = TraceContainerNative()
-            tc.clear()
-            # Copy all aux data over
-            # seg.config._configfile
-            tc.config.config = seg.config.config
-            prefix = tc.config.config['Trace Config']['prefix']
-            tc.config.setConfigFilename(cwapi_new.project().datadirectory + "traces/config_" + prefix + ".cfg")
-
-            tc.setDirty(True)
-            tc.config.syncFile()
-
-            for tnum in range(offset, seg_len + offset):
-                trace = tm.getTrace(tnum)
-                textin = tm.getTextin(tnum)
-                textout = tm.getTextout(tnum)
-                key = tm.getKnownKey(tnum)
-
-                try:
-                    textin, textout, trace, key = self.trace_callback(textin, textout, trace, key)
-                except StopIteration:
-                    continue
-
-                numtraces += 1
-                tc.addTrace(trace, textin, textout, key)
-            tc.closeAll()
+            tc.config.loadTrace(dstfile)
             cwapi_new.project().traceManager().appendSegment(tc)
+            numtraces += count
 
+        logging.info("Copied %d traces to %s" % (numtraces, newprojectname))
         cwapi_new.saveProject()
 
+    def copySegment(self, srcfile, dstfile):
+        """Copy the segment of config file srcfile to dstfile, returning (dstfile, number of traces written)"""
+        src = TraceContainerNative()
+        src.config.loadTrace(srcfile)
+        src.loadAllTraces(None, None)
+        numTraces = src.numTraces()
+
+        tc = TraceContainerNative()
+        tc.clear()
+        # Copy all aux data over
+        tc.config.config = src.config.config
+        tc.config.setConfigFilename(dstfile)
+        tc.setDirty(True)
+        tc.config.syncFile()
+        tc.config.setAttr("numTraces", 0)
+        tc.setKnownKey(src.knownkey)
+        if src.sampleScale is not None:
+            tc.setSampleScaling(src.sampleScale, src.sampleOffset, src.tracedtype)
+        tc.setTraceHint(numTraces)
+        tc.prepareDisk()
+
+        count = 0
+        for start in range(0, numTraces, self.blockSize):
+            end = min(start + self.blockSize, numTraces)
+            keys = src.getKnownKeys(start, end)
+            if keys.dtype == object:
+                keys = None
+            textins, textouts, traces, keys = self.processBlock(src.getTextins(start, end), src.getTextouts(start, end),
+                                                                src.getTraces(start, end), keys)
+            if len(traces):
+                tc.addTraces(traces, textins, textouts, keys, np.asarray(traces).dtype)
+                count += len(traces)
+
+        tc.closeAll()
+        src.unloadAllTraces()
+        return dstfile, count
+
+    def processBlock(self, textins, textouts, traces, keys):
+        """Return the (textins, textouts, traces, keys) to write for a block read from the source project"""
+        mask = np.asarray(self.selectTraces(textins, textouts, traces, keys), dtype=bool)
+        textins, textouts, traces = textins[mask], textouts[mask], traces[mask]
+        if keys is not None:
+            keys = keys[mask]
+
+        if _function(type(self).trace_callback) is not _function(CopyProject.trace_callback):
+            return self._perTrace(textins, textouts, traces, keys)
+
+        return self.transformTraces(textins, textouts, traces, keys)
+
+    def _perTrace(self, textins, textouts, traces, keys):
+        out = []
+        for i in range(len(traces)):
+            try:
+                out.append(self.trace_callback(textins[i], textouts[i], traces[i], None if keys is None else keys[i]))
+            except StopIteration:
+                continue
+        if len(out) == 0:
+            return textins[:0], textouts[:0], traces[:0], None if keys is None else keys[:0]
+        textins, textouts, traces, keys = zip(*out)
+        if any([k is None for k in keys]):
+            keys = None
+        else:
+            keys = np.array(keys)
+        return np.array(textins), np.array(textouts), np.array(traces), keys
+
+    def selectTraces(self, textins, textouts, traces, keys):
+        """Return a boolean mask of the traces of a block to keep (all of them by default)"""
+        return np.ones(len(traces), dtype=bool)
+
+    def transformTraces(self, textins, textouts, traces, keys):
+        """Return the (textins, textouts, traces, keys) to write for the kept traces of a block (unchanged by default)"""
+        return textins, textouts, traces, keys
+
     def trace_callback(self, textin, textout, trace, key):
 
         #If you want to preprocess traces, simply reimplement this.
@@ -85,24 +193,19 @@ class CopyProject(object):
         return (textin, textout, trace, key)
 
 
-if __name__ == "__main__":
-    from chipwhisperer.common.utils import util
+class CopyRandOnly(CopyProject):
+    """Copy the random plaintext traces of an interleaved TVLA set, dropping the traces with the fixed plaintexts"""
 
-    class copyRandOnly(CopyProject):
-        def trace_callback(self, textin, textout, trace, key):
-            interleavedPlaintext128 = util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 90")
-            interleavedPlaintext192 = util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 88")
-            interleavedPlaintext256 = util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 95")
+    fixedTexts = [util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 90"),
+                  util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 88"),
+                  util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 95")]
 
-            if (textin == interleavedPlaintext128).all() or \
-                    (textin == interleavedPlaintext192).all() or \
-                    (textin == interleavedPlaintext256).all():
-                raise StopIteration()
-
-            return (textin, textout, trace, key)
+    def selectTraces(self, textins, textouts, traces, keys):
+        return ~fixedTextMask(textins, self.fixedTexts)
 
 
+if __name__ == "__main__":
     filename = r'tvla-test-set.cwp'
     filename_grouprand = filename.replace(".cwp", "_randonly.cwp")
 
-    copyRandOnly(filename, filename_grouprand)
\ No newline at end of file
+    CopyRandOnly(filename, filename_grouprand, jobs=multiprocessing.cpu_count())
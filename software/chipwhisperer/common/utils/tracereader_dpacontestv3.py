@@ -22,11 +22,145 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
+import logging
 import numpy as np
 import os
 import xml.etree.ElementTree as ET
+from time import gmtime, strftime
+
+#Value of every ASCII hex digit, other characters read as 0
+_HEXVAL = np.zeros(256, dtype=np.uint8)
+for _i, _c in enumerate("0123456789abcdef"):
+    _HEXVAL[ord(_c)] = _i
+    _HEXVAL[ord(_c.upper())] = _i
+
+#Samples are written to wave.txt as integers of this many fractional bits
+waveScale = float(2**16)
+
+
+def readLines(f, count):
+    """Read up to count non-empty lines from file object f"""
+    return [l for l in itertools.islice(f, count) if l.strip()]
+
+
+def decodeHex(tokens):
+    """
+    Decode an array of hex byte strings of one or two digits (e.g. an '|S2' array, or a list of such strings) to an
+    array of uint8 of the same shape
+    """
+    tokens = np.asarray(tokens)
+    if tokens.dtype.kind == 'U':
+        tokens = tokens.astype('S2')
+    #Single digit bytes come out of the S2 array with a NUL second character
+    c = np.frombuffer(np.ascontiguousarray(tokens, dtype='S2').tobytes(), dtype=np.uint8).reshape(-1, 2)
+    hi = _HEXVAL[c[:, 0]]
+    vals = np.where(c[:, 1] == 0, hi, hi * 16 + _HEXVAL[c[:, 1]])
+    return vals.astype(np.uint8).reshape(tokens.shape)
+
+
+def parseHex(lines):
+    """
+    Parse lines of space separated hex bytes (e.g. text_in.txt, where each byte is written as '%2X ') to a 2D uint8
+    array, one row per line. All lines must hold the same number of bytes.
+    """
+    tokens = b" ".join(lines).split()
+    if len(tokens) == 0:
+        return np.zeros((len(lines), 0), dtype=np.uint8)
+    return decodeHex(tokens).reshape(len(lines), -1)
+
+
+def parseWaves(lines, numPoints):
+    """Parse lines of space separated samples (wave.txt) to a 2D array of numPoints columns"""
+    return np.fromstring(b" ".join(lines), sep=" ").reshape(-1, numPoints)
+
+
+def formatRows(fmt, rows):
+    """Format a 2D array as text, one line per row with fmt repeated for every element"""
+    rows = np.asarray(rows)
+    rowfmt = fmt * rows.shape[1] + "\n"
+    return "".join([rowfmt % tuple(r) for r in rows.tolist()])
+
+
+def writeInfo(directory, numTraces, numPoints, startTime=None):
+    """Write the info.xml of a DPAv3 trace set"""
+    if startTime is None:
+        startTime = gmtime()
+    infofile = open(os.path.join(directory, "info.xml"), "w")
+
+    infofile.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    infofile.write('<WaveformInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">\n')
+    infofile.write('  <Date>%s</Date>'%strftime("%d/%m%Y %H:%M:%S", startTime))
+    infofile.write('  <Operator>Smooth</Operator>\n')
+    infofile.write('  <WaveType>PowerTrace</WaveType>\n')
+    infofile.write('  <WaveFormat>System.Single[]</WaveFormat>\n')
+    infofile.write('  <Instrument>Something</Instrument>\n')
+    infofile.write('  <Module>AES</Module>\n')
+    infofile.write('  <Cipher>AES</Cipher>\n')
+    infofile.write('  <KeyLength>128</KeyLength>\n')
+    infofile.write('  <TextWidth>128</TextWidth>\n')
+    infofile.write('  <NumTrace>%d</NumTrace>\n'%numTraces)
+    infofile.write('  <NumPoint>%d</NumPoint>\n'%numPoints)
+    infofile.write('</WaveformInfo>\n')
+    infofile.close()
+
+
+class DPAv3Writer(object):
+    """
+    Writes the text files of a DPAv3 trace set (wave.txt, text_in.txt, text_out.txt and key.txt).
+
+    Traces are buffered and formatted chunkSize at a time, so each file gets one write() per chunk.
+    """
+
+    chunkSize = 1000
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.numTraces = 0
+        self.numPoints = 0
+        self._files = {}
+        for name in ("wave", "text_in", "text_out", "key"):
+            self._files[name] = open(os.path.join(directory, name + ".txt"), "w")
+        self._buffer = []
+
+    def addTrace(self, wave, textin, textout, key=None):
+        self._buffer.append((wave, textin, textout, key))
+        if len(self._buffer) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered traces"""
+        if not self._buffer:
+            return
+        waves, textins, textouts, keys = zip(*self._buffer)
+        self._buffer = []
+        if any([k is None or len(k) == 0 for k in keys]):
+            keys = None
+        self.addTraces(np.array(waves), textins, textouts, keys)
+
+    def addTraces(self, waves, textins, textouts, keys=None):
+        """Write a block of traces (2D array) with their text and key rows (keys may be None)"""
+        waves = np.asarray(waves)
+        ints = (waves * waveScale).astype(np.int64)
+        self._files["wave"].write(formatRows('%d ', ints))
+        self._files["text_in"].write(formatRows('%2X ', textins))
+        self._files["text_out"].write(formatRows('%2X ', textouts))
+        if keys is not None:
+            self._files["key"].write(formatRows('%2X ', keys))
+        self.numTraces += waves.shape[0]
+        self.numPoints = waves.shape[1]
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
 
 class tracereader_dpacontestv3:
+    #Traces read per chunk by iterBlocks()
+    chunkSize = 1000
+
     def __init__(self):
         self.numTrace = None
         self.numPoint = None
@@ -50,7 +184,47 @@ class tracereader_dpacontestv3:
 
         self.numTrace = numTrace
         self.numPoint = numPoint
-        
+
+    def _open(self, name):
+        try:
+            return open(os.path.join(self.directory, name), 'rb')
+        except IOError:
+            return None
+
+    def iterBlocks(self, chunkSize=None):
+        """
+        Parse the trace set chunkSize traces at a time. Yields (waves, textins, textouts, keys) as 2D arrays, the
+        text and keys being None when their file is missing or shorter than wave.txt.
+        """
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+        if self.numTrace is None:
+            self.loadInfo()
+
+        files = [self._open(name) for name in ('wave.txt', 'text_in.txt', 'text_out.txt', 'key.txt')]
+        try:
+            while True:
+                lines = readLines(files[0], chunkSize)
+                if len(lines) == 0:
+                    break
+                waves = parseWaves(lines, self.numPoint)
+                block = [waves]
+                for i in range(1, 4):
+                    rows = None
+                    if files[i] is not None:
+                        tlines = readLines(files[i], len(waves))
+                        if len(tlines) == len(waves):
+                            rows = parseHex(tlines)
+                        else:
+                            files[i].close()
+                            files[i] = None
+                    block.append(rows)
+                yield tuple(block)
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+
     def loadAllTraces(self, directory=None):
         if directory == None:
             directory = self.directory
@@ -60,30 +234,24 @@ class tracereader_dpacontestv3:
         if (self.numTrace == None):
             self.loadInfo(directory)
 
-        self.traces = np.loadtxt(os.path.join(directory, 'wave.txt'), ndmin=2)
-
-        try:
-            self.textins = np.loadtxt(os.path.join(directory, 'text_in.txt'), dtype='|S2',  ndmin=2)
-        except IOError:
-            self.textins = None
+        blocks = list(self.iterBlocks())
+        self.traces = np.concatenate([b[0] for b in blocks]) if blocks else np.zeros((0, self.numPoint))
+        self.textins = self._join(blocks, 1)
+        self.textouts = self._join(blocks, 2)
 
-        try:
-            self.textouts = np.loadtxt(os.path.join(directory, 'text_out.txt'), dtype='|S2',  ndmin=2)
-        except IOError:
-            self.textouts = None
-
-        try:
-           knownkey = np.loadtxt(os.path.join(directory, 'key.txt'), dtype='|S2',  ndmin=2)
-        except IOError:
-            knownkey = None
+        self.knownkey = None
+        f = self._open('key.txt')
+        if f is not None:
+            lines = readLines(f, 1)
+            f.close()
+            if lines:
+                self.knownkey = list(parseHex(lines)[0])
 
-        try:
-            knownkey = knownkey[0]
-            self.knownkey = []
-            for r in knownkey:
-                self.knownkey.append(int(r, 16))
-        except:
-            self.knownkey = None
+    @staticmethod
+    def _join(blocks, i):
+        if not blocks or any([b[i] is None for b in blocks]):
+            return None
+        return np.concatenate([b[i] for b in blocks])
 
     def numPoints(self):
         return self.numPoint
@@ -101,20 +269,76 @@ class tracereader_dpacontestv3:
         return data
 
     def getTextin(self, n):
-        tin = self.textins[n]
-        return map(int, tin, [16]*len(tin))
+        return list(self.textins[n])
 
     def getTextout(self, n):
-        tout = self.textouts[n]
-        return map(int, tout, [16]*len(tout))
+        return list(self.textouts[n])
 
     def getKnownKey(self):
         return self.knownkey
 
-#Test Example
+
+def importToNative(directory, tc, dtype=np.int16, chunkSize=1000, progressBar=None):
+    """
+    Convert the DPAv3 trace set in directory to the native segment tc (a TraceContainerNative with its config file
+    and prefix set), streaming chunkSize traces at a time to its files. Samples are stored as dtype, as the DPAv3
+    files hold integers.
+    """
+    reader = tracereader_dpacontestv3()
+    reader.loadInfo(directory)
+    tc.setTraceHint(reader.numTrace)
+    tc.prepareDisk()
+
+    if progressBar:
+        progressBar.setMaximum(reader.numTrace)
+
+    for waves, textins, textouts, keys in reader.iterBlocks(chunkSize):
+        if tc.knownkey is None and keys is not None:
+            tc.setKnownKey(keys[0])
+        tc.addTraces(waves.astype(dtype), textins, textouts, keys, dtype)
+        if progressBar:
+            progressBar.updateStatus(tc.numTraces())
+            if progressBar.wasAborted():
+                break
+
+    tc.closeAll(clearTrace=False, clearText=False, clearKeys=False)
+    logging.info("Imported %d traces from %s" % (tc.numTraces(), directory))
+    return tc
+
+
+def exportFromTraceSource(traceSource, directory, chunkSize=1000, progressBar=None):
+    """
+    Write all traces of traceSource (anything with block getters, e.g. a TraceContainer or the TraceManager) as a
+    DPAv3 trace set in directory, chunkSize traces at a time.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    startTime = gmtime()
+    numTraces = traceSource.numTraces()
+    writer = DPAv3Writer(directory)
+
+    if progressBar:
+        progressBar.setMaximum(numTraces)
+
+    try:
+        for start in range(0, numTraces, chunkSize):
+            end = min(start + chunkSize, numTraces)
+            keys = traceSource.getKnownKeys(start, end)
+            if keys.ndim != 2 or keys.shape[1] == 0:
+                keys = None
+            writer.addTraces(traceSource.getTraces(start, end), traceSource.getTextins(start, end),
+                             traceSource.getTextouts(start, end), keys)
+            if progressBar:
+                progressBar.updateStatus(end)
+                if progressBar.wasAborted():
+                    break
+    finally:
+        writer.close()
+
+    writeInfo(directory, writer.numTraces, writer.numPoints, startTime)
+    return writer.numTraces
+
+
 if __name__ == "__main__":
     tr = tracereader_dpacontestv3()
     tr.loadAllTraces("api-2012.11.30-19.22.58")
-
-    
-    
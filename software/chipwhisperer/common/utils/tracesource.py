@@ -26,6 +26,7 @@
 #=================================================
 import logging
 import uuid
+import numpy as np
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.parameter import Parameterized, setupSetParam
 
@@ -38,6 +39,9 @@ class TraceSource(object):
     registeredObjects["None"] = None
     sigRegisteredObjectsChanged = util.Signal()
 
+    #Number of traces users of getTraces() read in one go when going through a long range
+    blockSize = 1000
+
     def __init__(self, name="Unknown"):
         self.sigTracesChanged = util.Signal()
         self.name = name
@@ -72,6 +76,35 @@ class TraceSource(object):
         """Get known-key number n"""
         raise NotImplementedError
 
+    def getTraces(self, start, end):
+        """
+        Return traces start to end-1 as a 2D array, one trace per row.
+
+        The default reads the traces one by one, sources that can should override it with a block read. Traces which
+        are not available (e.g. rejected by a preprocessing module) are returned as rows of NaN.
+        """
+        data = [self.getTrace(n) for n in range(start, end)]
+        valid = [d for d in data if d is not None]
+        traces = np.empty((len(data), len(valid[0]) if valid else self.numPoints()))
+        for i, d in enumerate(data):
+            if d is None:
+                traces[i] = np.nan
+            else:
+                traces[i] = d
+        return traces
+
+    def getTextins(self, start, end):
+        """Get text-ins start to end-1 as an array"""
+        return np.array([self.getTextin(n) for n in range(start, end)])
+
+    def getTextouts(self, start, end):
+        """Get text-outs start to end-1 as an array"""
+        return np.array([self.getTextout(n) for n in range(start, end)])
+
+    def getKnownKeys(self, start, end):
+        """Get known-keys start to end-1 as an array"""
+        return np.array([self.getKnownKey(n) for n in range(start, end)])
+
     def getSegmentList(self):
         """Return a list of segments."""
         raise NotImplementedError
@@ -0,0 +1,162 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.results.base import ResultsBase
+from chipwhisperer.common.utils.tracesource import TraceSource
+from chipwhisperer.analyzer.preprocessing._align import SlidingReference
+from chipwhisperer.analyzer.preprocessing.resync_sad import ResyncSAD
+from chipwhisperer.analyzer.preprocessing.resync_cross_correlation import ResyncCrossCorrelation
+
+
+class ArrayTraceSource(TraceSource):
+    """Trace source serving an in-memory array"""
+
+    def __init__(self, traces):
+        TraceSource.__init__(self, "Test Traces")
+        self.traces = traces
+
+    def getTrace(self, n):
+        return self.traces[n]
+
+    def getTraces(self, start, end):
+        return self.traces[start:end].copy()
+
+    def numTraces(self):
+        return len(self.traces)
+
+    def numPoints(self):
+        return self.traces.shape[1]
+
+
+def shiftLoop(trace, diff):
+    """Shift one trace the way the resync modules' getTrace() used to"""
+    if diff < 0:
+        trace = np.append(np.zeros(-diff), trace[:diff])
+    elif diff > 0:
+        trace = np.append(trace[diff:], np.zeros(diff))
+    return trace
+
+
+def findDiffLoop(inputtrace, reftrace, wdStart, wdEnd, squared=False):
+    """The old per-trace ResyncSAD._findSAD()"""
+    reflen = len(reftrace)
+    sadarray = np.empty(wdEnd - wdStart - reflen)
+    for ptstart in range(wdStart, wdEnd - reflen):
+        diff = inputtrace[ptstart:(ptstart + reflen)] - reftrace
+        if squared:
+            sadarray[ptstart - wdStart] = np.sum(diff * diff)
+        else:
+            sadarray[ptstart - wdStart] = np.sum(np.abs(diff))
+    return sadarray
+
+
+def resyncSADLoop(traces, rtrace, ccStart, ccEnd, wdStart, wdEnd, squared=False):
+    """The old ResyncSAD.calcRefTrace() and getTrace(), with rejected traces as rows of NaN"""
+    reftrace = traces[rtrace][ccStart:ccEnd]
+    sad = findDiffLoop(traces[rtrace], reftrace, wdStart, wdEnd, squared)
+    refmaxloc = np.argmin(sad)
+    maxthreshold = np.mean(sad)
+
+    out = np.empty(traces.shape)
+    for i, trace in enumerate(traces):
+        sad = findDiffLoop(trace, reftrace, wdStart, wdEnd, squared)
+        if min(sad) > maxthreshold:
+            out[i] = np.nan
+        else:
+            out[i] = shiftLoop(trace, np.argmin(sad) - refmaxloc)
+    return out
+
+
+def resyncCCLoop(traces, rtrace, ccStart, ccEnd):
+    """The old ResyncCrossCorrelation.calcRefTrace() and getTrace(), with np.correlate()"""
+    reftrace = traces[rtrace][ccStart:ccEnd]
+    refmaxloc = np.argmax(np.correlate(traces[rtrace], reftrace, mode='valid')[ccStart:ccEnd])
+    return np.array([shiftLoop(t, np.argmax(np.correlate(t, reftrace, mode='valid')[ccStart:ccEnd]) - refmaxloc)
+                     for t in traces])
+
+
+class TestSlidingReference(TestCase):
+
+    def bruteForce(self, ref, traces, start, count):
+        windows = [traces[:, start + k:start + k + len(ref)] for k in range(count)]
+        dot = np.array([np.dot(w, ref) for w in windows]).T.reshape(len(traces), count)
+        sad = np.array([np.sum(np.abs(w - ref), axis=1) for w in windows]).T.reshape(len(traces), count)
+        ssd = np.array([np.sum((w - ref) ** 2, axis=1) for w in windows]).T.reshape(len(traces), count)
+        return dot, sad, ssd
+
+    def test_bruteForce(self):
+        rng = np.random.RandomState(0)
+        traces = rng.randn(5, 700)
+        # (reference length, start, count): one FFT block, several overlap-save blocks with a partial last one, a
+        # window exactly one block long, a reference of one point, and windows shorter than the reference (SAD loops
+        # over the offsets instead of the reference)
+        cases = [(50, 0, 300), (7, 10, 200), (7, 3, 58), (7, 0, 57), (1, 0, 700), (1, 5, 13), (1, 699, 1),
+                 (100, 20, 30), (100, 20, 1), (64, 0, 637), (5, 0, 0)]
+        for reflen, start, count in cases:
+            ref = rng.randn(reflen)
+            s = SlidingReference(ref)
+            dot, sad, ssd = self.bruteForce(ref, traces, start, count)
+            msg = "reflen %d, start %d, count %d" % (reflen, start, count)
+            np.testing.assert_allclose(s.dot(traces, start, count), dot, atol=1e-9, err_msg=msg)
+            np.testing.assert_allclose(s.sad(traces, start, count), sad, atol=1e-9, err_msg=msg)
+            np.testing.assert_allclose(s.ssd(traces, start, count), ssd, atol=1e-9, err_msg=msg)
+            # The cached reference spectrum is reused by later calls
+            np.testing.assert_allclose(s.dot(traces[:2], start, count), dot[:2], atol=1e-9, err_msg=msg)
+
+    def test_sadChunks(self):
+        rng = np.random.RandomState(1)
+        traces = rng.randn(11, 200)
+        ref = rng.randn(20)
+        s = SlidingReference(ref)
+        s.sadChunkSize = 400
+        for count in (10, 150):
+            np.testing.assert_allclose(s.sad(traces, 5, count), self.bruteForce(ref, traces, 5, count)[1], atol=1e-9)
+
+
+class TestResync(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        base = rng.randn(400)
+        shifted = [np.roll(base, s) + rng.normal(0, 0.05, 400) for s in rng.randint(-15, 16, 40)]
+        # Unrelated, louder traces, which ResyncSAD rejects
+        self.traces = np.array(shifted + list(3 * rng.randn(5, 400)))
+        self.source = ArrayTraceSource(self.traces)
+
+    def checkBlocks(self, module, expected):
+        np.testing.assert_allclose(module.getTraces(0, len(self.traces)), expected)
+        np.testing.assert_allclose(module.getTraces(3, 17), expected[3:17])
+        for n in (0, 5, 42):
+            trace = module.getTrace(n)
+            if np.isnan(expected[n, 0]):
+                self.assertIsNone(trace)
+            else:
+                np.testing.assert_allclose(trace, expected[n])
+
+    def test_sad(self):
+        for metric in ("sad", "ssd"):
+            resync = ResyncSAD(self.source, connectTracePlot=False)
+            resync.enabled = True
+            resync.metric = metric
+            resync.ref_trace = 1
+            resync.ref_points = (150, 200)
+            resync.input_window = (130, 240)
+            expected = resyncSADLoop(self.traces, 1, 150, 200, 130, 240, squared=(metric == "ssd"))
+            self.assertTrue(np.isnan(expected[-5:, 0]).all())
+            self.assertFalse(np.isnan(expected[:-5, 0]).any())
+            self.checkBlocks(resync, expected)
+
+    def test_crossCorrelation(self):
+        # No trace plot to show the window on without the GUI
+        ResultsBase.registeredObjects.setdefault("Trace Output Plot", None)
+        resync = ResyncCrossCorrelation(self.source)
+        resync.enabled = True
+        resync.ref_trace = 1
+        resync.window = (150, 250)
+        self.checkBlocks(resync, resyncCCLoop(self.traces, 1, 150, 250))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.attacks._channel_estimate_attack import ChannelEstimateAttackOneSubkey
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit, SBox_output
+
+
+class TestChannelEstimate(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.model = AES128_8bit(SBox_output)
+        self.key = rng.randint(0, 256, 16).astype(np.uint8)
+        self.textins = rng.randint(0, 256, (260, 16)).astype(np.uint8)
+        self.traces = rng.normal(0, 1, (260, 12))
+        for bnum in range(16):
+            hyp = self.model.leakageBatch(self.textins, None, bnum)[np.arange(260), self.key[bnum]]
+            self.traces[:, bnum % 12] += 0.5 * hyp
+        self.fit = slice(0, 200)
+        self.test = slice(200, 260)
+
+    def accumulate(self, bnum, blockSize):
+        cea = ChannelEstimateAttackOneSubkey()
+        for s in (self.fit, self.test):
+            for bstart in range(s.start, s.stop, blockSize):
+                bend = min(bstart + blockSize, s.stop)
+                if s is self.fit:
+                    cea.addFitTraces(bnum, self.traces[bstart:bend], self.textins[bstart:bend], self.model)
+                else:
+                    cea.addTestTraces(bnum, self.traces[bstart:bend], self.textins[bstart:bend], self.model)
+        return cea
+
+    def test_blockErrorsMatchOneSubkey(self):
+        for bnum in (0, 7, 15):
+            errors = self.accumulate(bnum, 64).errors()
+            for useSVD in (True, False):
+                diffs = ChannelEstimateAttackOneSubkey().oneSubkey(bnum, self.traces[self.fit], self.traces[self.test],
+                                                                   self.textins[self.fit], self.textins[self.test],
+                                                                   self.model, useSVD=useSVD)[0]
+                np.testing.assert_allclose(errors, diffs, rtol=1e-8, atol=1e-6)
+
+    def test_blockSize(self):
+        cea1 = self.accumulate(3, 1000)
+        cea2 = self.accumulate(3, 17)
+        np.testing.assert_allclose(cea1.channels(), cea2.channels(), rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(cea1.errors(), cea2.errors(), rtol=1e-8, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import pickle
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.attacks._parallel import buildModel, modelDescription
+from chipwhisperer.analyzer.attacks.cpa_algorithms.bayesian import AttackCPA_Bayesian
+from chipwhisperer.analyzer.attacks.cpa_algorithms.progressive import CPAProgressive
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit, SBox_output
+
+
+class ArrayTraceSource(object):
+    """Minimal trace source serving blocks of in-memory arrays"""
+
+    def __init__(self, traces, textins, textouts, knownkeys):
+        self.traces = traces
+        self.textins = textins
+        self.textouts = textouts
+        self.knownkeys = knownkeys
+
+    def numTraces(self):
+        return len(self.traces)
+
+    def getTraces(self, start, end):
+        return self.traces[start:end]
+
+    def getTextins(self, start, end):
+        return self.textins[start:end]
+
+    def getTextouts(self, start, end):
+        return self.textouts[start:end]
+
+    def getKnownKeys(self, start, end):
+        return self.knownkeys[start:end]
+
+
+def simulatedSource(numTraces=100, numPoints=40, seed=0):
+    """AES traces leaking the HW of the first round SBox output of subkey i at point 2*i, plus noise"""
+    rng = np.random.RandomState(seed)
+    key = rng.randint(0, 256, 16).astype(np.uint8)
+    textins = rng.randint(0, 256, (numTraces, 16)).astype(np.uint8)
+    knownkeys = np.tile(key, (numTraces, 1))
+    model = AES128_8bit(SBox_output)
+    traces = rng.normal(0, 1, (numTraces, numPoints))
+    for bnum in range(16):
+        traces[:, 2 * bnum] += model.leakageBatch(textins, None, bnum)[np.arange(numTraces), key[bnum]]
+    return ArrayTraceSource(traces, textins, np.zeros_like(textins), knownkeys), key
+
+
+class TestParallelCPA(TestCase):
+
+    def runAttack(self, source, jobs, brange=range(0, 16)):
+        attack = CPAProgressive()
+        attack.setModel(AES128_8bit(SBox_output))
+        attack.setTargetSubkeys(brange)
+        attack.setReportingInterval(40)
+        attack.setParallelJobs(jobs)
+        attack.addTraces(source, (0, source.numTraces() - 1))
+        return attack.getStatistics()
+
+    def test_modelDescription(self):
+        model = AES128_8bit(SBox_output, bitmask=0x0F)
+        rebuilt = buildModel(pickle.loads(pickle.dumps(modelDescription(model))))
+        self.assertIs(rebuilt.__class__, AES128_8bit)
+        self.assertIs(rebuilt.modelobj.__class__, SBox_output)
+        self.assertEqual(rebuilt._mask, 0x0F)
+
+    def test_parallelMatchesSerial(self):
+        source, key = simulatedSource()
+        serial = self.runAttack(source, 1)
+        parallel = self.runAttack(source, 3)
+        for bnum in range(16):
+            self.assertTrue(np.allclose(np.asarray(serial.diffs[bnum]), np.asarray(parallel.diffs[bnum]), equal_nan=True),
+                            "Subkey %d differs" % bnum)
+        parallel.setKnownkey(key)
+        parallel.findMaximums()
+        self.assertEqual(list(parallel.pge), [0] * 16)
+
+    def test_rejectedBlock(self):
+        #A block where the preprocessing rejected every trace adds nothing, the following blocks are still used
+        source, key = simulatedSource()
+        rejected = ArrayTraceSource(source.traces.copy(), source.textins, source.textouts, source.knownkeys)
+        rejected.traces[:40] = np.nan
+        kept = ArrayTraceSource(source.traces[40:], source.textins[40:], source.textouts[40:], source.knownkeys[40:])
+        stats = self.runAttack(rejected, 1, brange=[0, 1])
+        reference = self.runAttack(kept, 1, brange=[0, 1])
+        for bnum in [0, 1]:
+            self.assertTrue(np.allclose(np.asarray(stats.diffs[bnum]), np.asarray(reference.diffs[bnum]), equal_nan=True))
+
+
+
+def bayesianLoop(model, traces, textins, bnum):
+    """
+    Probability of every guess at every point, from the explicit per-guess sums of the old "log" Bayesian CPA
+    (normalized over the guesses)
+    """
+    q = len(traces)
+    meant = np.mean(traces, axis=0, dtype=np.float64)
+    stddevt = np.std(traces, axis=0, dtype=np.float64)
+    hyps = model.leakageBatch(textins, None, bnum)
+    loglike = np.zeros((256, traces.shape[1]))
+    for key in range(0, 256):
+        hyp = np.asarray(hyps[:, key], dtype=np.float64)
+        meanh = np.mean(hyp)
+        stddevh = np.std(hyp)
+        sumstd = np.zeros(traces.shape[1])
+        for tnum in range(q):
+            hdiff = (hyp[tnum] - meanh) / stddevh
+            tdiff = (traces[tnum] - meant) / stddevt
+            sumstd += (hdiff - tdiff) ** 2
+        loglike[key] = -q * ((0.5 * np.log(sumstd)) - np.log(q))
+    top = np.max(loglike, axis=0)
+    return np.exp(loglike - top) / np.sum(np.exp(loglike - top), axis=0)
+
+
+class TestBayesianCPA(TestCase):
+
+    def test_progressiveDiffs(self):
+        source, key = simulatedSource(numTraces=100, seed=3)
+        model = AES128_8bit(SBox_output)
+        attack = AttackCPA_Bayesian()
+        attack.setModel(model)
+        attack.setTargetSubkeys([0, 3])
+        attack.setReportingInterval(30)
+
+        updates = []
+        attack.stats.updateSubkey = lambda bnum, data, copy=True, forceUpdate=False, tnum=None: \
+            updates.append((bnum, tnum, np.array(data)))
+        attack.addTraces(source, (0, 99))
+
+        self.assertEqual([(bnum, tnum) for bnum, tnum, data in updates],
+                         [(0, 30), (3, 30), (0, 60), (3, 60), (0, 90), (3, 90), (0, 100), (3, 100)])
+        for bnum, tnum, data in updates:
+            expected = bayesianLoop(model, source.traces[:tnum], source.textins[:tnum], bnum)
+            np.testing.assert_allclose(data, expected, rtol=1e-7, atol=1e-12, err_msg="subkey %d, %d traces" % (bnum, tnum))
+            np.testing.assert_allclose(np.sum(data, axis=0), 1.0)
+        # With all the traces the key is the most likely guess where it leaks
+        self.assertEqual(np.argmax(updates[-2][2][:, 0]), key[0])
+        self.assertEqual(np.argmax(updates[-1][2][:, 6]), key[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
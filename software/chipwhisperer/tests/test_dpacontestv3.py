@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+from chipwhisperer.common.utils.tracereader_dpacontestv3 import DPAv3Writer, decodeHex, exportFromTraceSource, \
+    importToNative, parseHex
+
+FILES = ("wave.txt", "text_in.txt", "text_out.txt", "key.txt")
+
+
+def writeLoop(directory, waves, textins, textouts, keys):
+    """The old per-sample TraceContainerDPAv3.addTrace() writer"""
+    inf = open(os.path.join(directory, "text_in.txt"), "w")
+    outf = open(os.path.join(directory, "text_out.txt"), "w")
+    wavef = open(os.path.join(directory, "wave.txt"), "w")
+    keyf = open(os.path.join(directory, "key.txt"), "w")
+    for wave, textin, textout, key in zip(waves, textins, textouts, keys):
+        for i in textin:
+            inf.write('%2X '%i)
+        inf.write('\n')
+
+        for i in textout:
+            outf.write('%2X '%i)
+        outf.write('\n')
+
+        for i in wave:
+            iint = i * float(2**16)
+            wavef.write('%d '%int(iint))
+        wavef.write('\n')
+
+        if key:
+            for i in key:
+                keyf.write('%2X '%i)
+            keyf.write('\n')
+    for f in (inf, outf, wavef, keyf):
+        f.close()
+
+
+def readFiles(directory):
+    return [open(os.path.join(directory, name), "rb").read() for name in FILES]
+
+
+class TestDPAv3(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.waves = rng.randint(-3000, 3000, (23, 15)) / 65536.0 + rng.rand(23, 15) * 1e-6
+        # Plenty of bytes below 0x10, written as a single digit
+        self.textins = rng.randint(0, 32, (23, 16)).astype(np.uint8)
+        self.textouts = rng.randint(0, 256, (23, 16)).astype(np.uint8)
+        self.keys = rng.randint(0, 16, (23, 16)).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def subdir(self, name):
+        path = os.path.join(self.directory, name)
+        os.mkdir(path)
+        return path
+
+    def test_hex(self):
+        tokens = ['%X' % i for i in range(256)]
+        self.assertEqual(list(decodeHex(tokens)), range(256))
+        self.assertEqual(list(decodeHex([t.lower() for t in tokens])), range(256))
+        lines = ["".join(['%2X ' % b for b in row]) + "\n" for row in self.textins]
+        np.testing.assert_array_equal(parseHex(lines), self.textins)
+
+    def test_writer(self):
+        old = self.subdir("old")
+        keys = [list(k) for k in self.keys]
+        writeLoop(old, self.waves, self.textins, self.textouts, keys)
+        expected = readFiles(old)
+
+        # Trace by trace, flushed in chunks of 5
+        new = self.subdir("new")
+        writer = DPAv3Writer(new)
+        writer.chunkSize = 5
+        for i in range(len(self.waves)):
+            writer.addTrace(self.waves[i], self.textins[i], self.textouts[i], keys[i])
+        writer.close()
+        self.assertEqual(readFiles(new), expected)
+
+        # As blocks
+        blocks = self.subdir("blocks")
+        writer = DPAv3Writer(blocks)
+        for start in (0, 10):
+            end = start + 10 if start == 0 else len(self.waves)
+            writer.addTraces(self.waves[start:end], self.textins[start:end], self.textouts[start:end],
+                             self.keys[start:end])
+        writer.close()
+        self.assertEqual(readFiles(blocks), expected)
+
+        # Without keys
+        writeLoop(old, self.waves, self.textins, self.textouts, [None] * len(self.waves))
+        writer = DPAv3Writer(new)
+        for i in range(len(self.waves)):
+            writer.addTrace(self.waves[i], self.textins[i], self.textouts[i])
+        writer.close()
+        self.assertEqual(readFiles(new), readFiles(old))
+        self.assertEqual(readFiles(new)[3], b"")
+
+    def makeSegment(self, prefix):
+        seg = TraceContainerNative()
+        seg.config.setConfigFilename(os.path.join(self.directory, "config_%s.cfg" % prefix))
+        seg.config.setAttr("prefix", prefix)
+        return seg
+
+    def roundTrip(self, withKey):
+        src = self.makeSegment("src_")
+        src.setKnownKey(self.keys[0])
+        for i in range(len(self.waves)):
+            src.addTrace(self.waves[i], self.textins[i], self.textouts[i], self.keys[0])
+        src.closeAll()
+        src.loadAllTraces(None, None)
+
+        exported = self.subdir("export")
+        self.assertEqual(exportFromTraceSource(src, exported, chunkSize=4), len(self.waves))
+        if not withKey:
+            os.remove(os.path.join(exported, "key.txt"))
+
+        dst = importToNative(exported, self.makeSegment("dst_"), dtype=np.int32, chunkSize=6)
+        self.assertEqual(dst.numTraces(), len(self.waves))
+        # Samples are stored as the integers of wave.txt
+        np.testing.assert_array_equal(dst.getTraces(0, len(self.waves)), (self.waves * 65536).astype(np.int64))
+        np.testing.assert_array_equal(dst.getTextins(0, len(self.waves)), self.textins)
+        np.testing.assert_array_equal(dst.getTextouts(0, len(self.waves)), self.textouts)
+        return dst
+
+    def test_roundTrip(self):
+        dst = self.roundTrip(True)
+        np.testing.assert_array_equal(dst.knownkey, self.keys[0])
+        np.testing.assert_array_equal(dst.getKnownKeys(0, len(self.waves)), np.tile(self.keys[0], (len(self.waves), 1)))
+
+        # The segment files load back
+        reloaded = TraceContainerNative(dst.config.configFilename())
+        reloaded.loadAllTraces(None, None)
+        np.testing.assert_array_equal(reloaded.traces[:len(self.waves)], (self.waves * 65536).astype(np.int64))
+        np.testing.assert_array_equal(reloaded.textins[:len(self.waves)], self.textins)
+        np.testing.assert_array_equal(reloaded.knownkey, self.keys[0])
+
+    def test_roundTripNoKey(self):
+        dst = self.roundTrip(False)
+        self.assertIsNone(dst.knownkey)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.utils import fasterdtw
+from chipwhisperer.analyzer.utils.fasterdtw import fastdtw, warp_traces, _dtw_windows, _expand_windows
+
+#Module-private helpers of the original fastdtw(), not name-mangled at module level
+_reduce_by_half = getattr(fasterdtw, '__reduce_by_half')
+_expand_window = getattr(fasterdtw, '__expand_window')
+
+
+def pathCost(x, y, cells):
+    return sum([abs(x[i] - y[j]) for i, j in cells])
+
+
+def averagePath(x, y, cells):
+    """Warp y onto x along the path cells, the way ResyncDTW did with fastdtw()"""
+    s = np.zeros(len(x))
+    n = np.zeros(len(x))
+    for i, j in cells:
+        s[i] += y[j]
+        n[i] += 1
+    return s / n
+
+
+class TestWarpTraces(TestCase):
+    """
+    warp_traces() against the fastdtw() path. With the abs() distance different paths can have exactly the same cost
+    (e.g. both rows of a corner between two samples), and the two versions may pick different ones. So the warped
+    traces must match, or else the costs of the paths must.
+    """
+
+    def traces(self, rng, ref, num):
+        shifted = [np.roll(ref, rng.randint(-5, 6)) + rng.normal(0, 0.1, len(ref)) for i in range(num)]
+        return np.array(shifted + [rng.rand(len(ref)) for i in range(num)])
+
+    def test_identity(self):
+        ref = np.random.RandomState(0).rand(64)
+        self.assertTrue(np.allclose(warp_traces(ref, [ref], 2)[0], ref))
+
+    def test_exact(self):
+        #With a radius over the trace length FastDTW is the full DTW
+        rng = np.random.RandomState(1)
+        ref = rng.rand(40)
+        traces = self.traces(rng, ref, 10)
+        warped = warp_traces(ref, traces, 50)
+        for t, w in zip(traces, warped):
+            dist, path = fastdtw(ref, t, radius=50)
+            if not np.allclose(averagePath(ref, t, path), w):
+                jmin, jmax = fasterdtw._warp_level(ref, t[np.newaxis, :], 50, False)
+                cells = [(i, j) for i in range(len(ref)) for j in range(jmin[0, i], jmax[0, i] + 1)]
+                self.assertAlmostEqual(pathCost(ref, t, cells), dist)
+
+    def test_windows(self):
+        #One FastDTW level: the same coarse path gives the same search window, and the best path in it is found
+        rng = np.random.RandomState(2)
+        ref = rng.rand(100)
+        for radius in (1, 3, 5):
+            traces = self.traces(rng, ref, 10)
+            for t in traces:
+                dist, coarse = fastdtw(_reduce_by_half(ref), _reduce_by_half(t), radius=radius)
+                window = _expand_window(coarse, len(ref), len(t), radius)
+                olddist, oldpath = fasterdtw.dtw(ref, t, window)
+
+                ncoarse = (len(ref) + 1) // 2
+                jmin = np.array([[min([j for i, j in coarse if i == r]) for r in range(ncoarse)]])
+                jmax = np.array([[max([j for i, j in coarse if i == r]) for r in range(ncoarse)]])
+                lo, hi = _expand_windows(jmin, jmax, len(ref), len(t), radius)
+                self.assertTrue(set(window) <= set((i, j) for i in range(len(ref)) for j in range(lo[0, i], hi[0, i] + 1)))
+
+                warped = _dtw_windows(ref, t[np.newaxis, :], lo, hi, True)[0]
+                if not np.allclose(averagePath(ref, t, oldpath), warped):
+                    pmin, pmax = _dtw_windows(ref, t[np.newaxis, :], lo, hi, False)
+                    cells = [(i, j) for i in range(len(ref)) for j in range(pmin[0, i], pmax[0, i] + 1)]
+                    self.assertAlmostEqual(pathCost(ref, t, cells), olddist)
+
+
+if __name__ == '__main__':
+    unittest.main()
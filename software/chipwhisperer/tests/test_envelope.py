@@ -0,0 +1,84 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.utils.envelope import EnvelopePyramid
+
+
+class TestEnvelopePyramid(TestCase):
+
+    def bruteForce(self, data, start, end, width, factor):
+        """Buckets (first index, min, max) of points [start, end) the way envelope() documents them, with plain loops"""
+        n = data.shape[-1]
+        bs = 1
+        while bs * factor <= (end - start) // width:
+            bs *= factor
+        lstart = start // bs
+        lend = -(-end // bs)
+        step = -(-(lend - lstart) // width)
+        buckets = []
+        for b in range(lstart, lend, step):
+            first = b * bs
+            last = min(min(b + step, lend) * bs, n)
+            rows = data.reshape(-1, n)
+            mins = []
+            maxes = []
+            for row in rows:
+                values = [v for v in row[first:last] if not np.isnan(v)]
+                mins.append(min(values) if values else np.nan)
+                maxes.append(max(values) if values else np.nan)
+            buckets.append((first, mins, maxes))
+        return buckets
+
+    def checkEnvelope(self, pyramid, data, start, end, width):
+        x, y = pyramid.envelope(start, end, width)
+        y = y.reshape(-1, y.shape[-1])
+        buckets = self.bruteForce(data, start, end, width, pyramid.factor)
+        self.assertEqual(len(x), 2 * len(buckets))
+        self.assertLessEqual(len(buckets), width)
+        self.assertLessEqual(buckets[0][0], start)
+        for j, (first, mins, maxes) in enumerate(buckets):
+            self.assertEqual(x[2 * j], pyramid.xAt(first))
+            self.assertEqual(x[2 * j + 1], pyramid.xAt(first))
+            np.testing.assert_array_equal(y[:, 2 * j], mins)
+            np.testing.assert_array_equal(y[:, 2 * j + 1], maxes)
+
+    def test_ranges(self):
+        rng = np.random.RandomState(0)
+        data = np.cumsum(rng.randn(10007))
+        pyramid = EnvelopePyramid(data, offset=5)
+        for start, end, width in [(0, 10007, 100), (0, 10007, 7), (123, 9876, 50), (4000, 4500, 64), (17, 10007, 1000),
+                                  (9000, 10007, 3)]:
+            self.checkEnvelope(pyramid, data, start, end, width)
+
+    def test_shortRange(self):
+        data = np.arange(50.0)
+        x, y = EnvelopePyramid(data, offset=10).envelope(5, 30, 20)
+        np.testing.assert_array_equal(x, np.arange(15, 40))
+        np.testing.assert_array_equal(y, data[5:30])
+
+    def test_rowsAndNaN(self):
+        rng = np.random.RandomState(1)
+        data = rng.randn(3, 5000)
+        data[0, 100:130] = np.nan
+        data[1, 1000:3000] = np.nan
+        data[2, ::7] = np.nan
+        pyramid = EnvelopePyramid(data)
+        for start, end, width in [(0, 5000, 40), (90, 4321, 16), (1200, 2800, 10)]:
+            self.checkEnvelope(pyramid, data, start, end, width)
+
+    def test_xAxis(self):
+        rng = np.random.RandomState(2)
+        x = np.cumsum(rng.randint(1, 4, 3000)).astype(np.float64)
+        data = rng.randn(3000)
+        pyramid = EnvelopePyramid(data, x)
+        for xlo, xhi in [(0, 1e9), (x[10], x[2000]), (x[10] + 0.5, x[2000] - 0.5), (-5, x[0]), (x[-1], x[-1] + 3)]:
+            start, end = pyramid.indexRange(xlo, xhi)
+            self.assertEqual((start, end), (int(np.sum(x < xlo)), int(np.sum(x <= xhi))))
+            if end - start > 20:
+                self.checkEnvelope(pyramid, data, start, end, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
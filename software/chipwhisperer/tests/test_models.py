@@ -0,0 +1,78 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.attacks.models.base import ModelsBase
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.analyzer.attacks.models.AES256_8bit import AES256_8bit
+from chipwhisperer.analyzer.attacks.models.DES import DES
+
+
+class TestLeakageBatch(TestCase):
+    """The table-based leakageBatch() of every model must match the reference loop over leakage()"""
+
+    numTraces = 20
+
+    def checkModel(self, modelClass, textlen, keylen, keyvalues):
+        rng = np.random.RandomState(0)
+        textins = rng.randint(0, 256, (self.numTraces, textlen)).astype(np.uint8)
+        textouts = rng.randint(0, 256, (self.numTraces, textlen)).astype(np.uint8)
+        knownkeys = rng.randint(0, keyvalues, (self.numTraces, keylen)).astype(np.uint8)
+        for name, hwModel in modelClass.hwModels.items():
+            model = modelClass(hwModel)
+            for bnum in (0, 5, model.getNumSubKeys() - 1):
+                ref = ModelsBase.leakageBatch(model, textins, textouts, bnum, knownkeys)
+                hyp = model.leakageBatch(textins, textouts, bnum, knownkeys)
+                self.assertTrue(np.array_equal(ref, hyp), "%s: %s, subkey %d" % (modelClass.__name__, name, bnum))
+
+    def test_aes128(self):
+        self.checkModel(AES128_8bit, 16, 16, 256)
+
+    def test_des(self):
+        self.checkModel(DES, 8, 8, 64)
+
+
+
+class AES256Model(object):
+    """AES256_8bit has no leakage models of its own, it only needs a named one"""
+    name = "AES-256 test model"
+
+
+class TestAES256Batch(TestCase):
+    """The batched AES-256 hypotheses must match the scalar HypHW()/HypHD() loops"""
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.model = AES256_8bit(AES256Model())
+        self.textins = rng.randint(0, 256, (12, 16)).astype(np.uint8)
+        self.textouts = rng.randint(0, 256, (12, 16)).astype(np.uint8)
+
+    def scalar(self, func, pt, ct, bnum):
+        return np.array([[func(None if pt is None else list(pt[t]), None if ct is None else list(ct[t]), guess, bnum)
+                          for guess in range(256)] for t in range(len(pt if pt is not None else ct))])
+
+    def test_hw(self):
+        for bnum in (0, 7, 15):
+            self.assertTrue(np.array_equal(self.model.HypHWBatch(self.textins, None, bnum),
+                                           self.scalar(self.model.HypHW, self.textins, None, bnum)))
+            self.assertTrue(np.array_equal(self.model.HypHWBatch(None, self.textouts, bnum),
+                                           self.scalar(self.model.HypHW, None, self.textouts, bnum)))
+            self.assertTrue(np.array_equal(self.model.leakageBatch(self.textins, self.textouts, bnum),
+                                           self.model.HypHWBatch(self.textins, None, bnum)))
+            self.assertTrue(np.array_equal(self.model.leakageBatch(None, self.textouts, bnum),
+                                           self.model.HypHWBatch(None, self.textouts, bnum)))
+
+    def test_hd(self):
+        for bnum in (0, 7, 15):
+            self.assertTrue(np.array_equal(self.model.HypHDBatch(self.textins, None, bnum),
+                                           self.scalar(self.model.HypHD, self.textins, None, bnum)))
+            # The scalar ciphertext version wraps its state in a list and can't run, this is what it computes
+            ct = self.textouts.astype(int)
+            ref = [[AES256_8bit.HW[(ct[t, bnum] ^ guess) ^ ct[t, AES256_8bit.INVSHIFT[bnum]]] for guess in range(256)]
+                   for t in range(len(ct))]
+            self.assertTrue(np.array_equal(self.model.HypHDBatch(None, self.textouts, bnum), ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
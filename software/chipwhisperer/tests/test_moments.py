@@ -0,0 +1,148 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+from scipy import stats
+
+from chipwhisperer.analyzer.utils.moments import CovarianceAccumulator, MomentAccumulator, RegressionAccumulator, welchT
+
+
+def addInBlocks(acc, traces, groups, sizes):
+    start = 0
+    for size in sizes:
+        acc.addBlock(traces[start:start + size], groups[start:start + size])
+        start += size
+    acc.addBlock(traces[start:], groups[start:])
+
+
+class TestMomentAccumulator(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.traces = rng.standard_gamma(2.0, (300, 7)) + 5
+        self.groups = rng.randint(0, 3, 300)
+        self.traces[[10, 150]] = np.nan
+        self.groups[[20, 21, 200]] = -1
+        self.valid = ~np.isnan(self.traces[:, 0]) & (self.groups >= 0)
+
+    def groupRows(self, g):
+        return self.traces[self.valid & (self.groups == g)]
+
+    def checkMoments(self, acc):
+        for g in range(3):
+            rows = self.groupRows(g)
+            self.assertEqual(acc.count()[g], len(rows))
+            np.testing.assert_allclose(acc.mean()[g], np.mean(rows, axis=0), rtol=1e-12)
+            for p in range(2, 7):
+                ref = np.mean((rows - np.mean(rows, axis=0)) ** p, axis=0)
+                np.testing.assert_allclose(acc.centralMoment(p)[g], ref, rtol=1e-9, err_msg="order %d" % p)
+            np.testing.assert_allclose(acc.variance()[g], np.var(rows, axis=0), rtol=1e-10)
+            np.testing.assert_allclose(acc.variance(ddof=1)[g], np.var(rows, axis=0, ddof=1), rtol=1e-10)
+        # The fourth group never gets a trace
+        self.assertEqual(acc.count()[3], 0)
+        self.assertFalse(acc.mean()[3].any())
+
+    def test_blocks(self):
+        acc = MomentAccumulator(4, 7, maxOrder=6)
+        addInBlocks(acc, self.traces, self.groups, [1, 2, 50, 97, 3])
+        self.checkMoments(acc)
+
+    def test_merge(self):
+        a = MomentAccumulator(4, 7, maxOrder=6)
+        b = MomentAccumulator(4, 7, maxOrder=6)
+        addInBlocks(a, self.traces[:130], self.groups[:130], [64])
+        # Group 2 is only on one side of the merge
+        groups = self.groups[130:].copy()
+        rest = self.traces[130:]
+        b.addBlock(rest[groups != 2], groups[groups != 2])
+        a.addBlock(rest[groups == 2], groups[groups == 2])
+        a.merge(b)
+        self.checkMoments(a)
+
+    def test_skipped(self):
+        acc = MomentAccumulator(4, 7)
+        acc.addBlock(self.traces[[10, 150]], [0, 1])
+        acc.addBlock(self.traces[:5], [-1] * 5)
+        self.assertFalse(acc.count().any())
+        self.assertFalse(acc.mean().any())
+
+    def test_ttest(self):
+        acc = MomentAccumulator(4, 7, maxOrder=6)
+        addInBlocks(acc, self.traces, self.groups, [100])
+        a = self.groupRows(0)
+        b = self.groupRows(2)
+        ref = stats.ttest_ind(a, b, equal_var=False)[0]
+        np.testing.assert_allclose(welchT(np.mean(a, axis=0), np.var(a, axis=0, ddof=1), len(a),
+                                          np.mean(b, axis=0), np.var(b, axis=0, ddof=1), len(b)), ref, rtol=1e-12)
+
+        # ttest() uses the population variance of each group, as populations.wttest always has
+        ref = (np.mean(a, axis=0) - np.mean(b, axis=0)) / np.sqrt(np.var(a, axis=0) / len(a) + np.var(b, axis=0) / len(b))
+        np.testing.assert_allclose(acc.ttest(1, (0, 2)), ref, rtol=1e-9)
+
+        # Higher orders compare the centered (order 2) and standardized (order 3) traces, with their population variance
+        for order in (2, 3):
+            mean, var = acc.ttestStats(order)
+            for g in range(3):
+                rows = self.groupRows(g)
+                x = rows - np.mean(rows, axis=0)
+                if order == 3:
+                    x = x / np.std(rows, axis=0)
+                x = x ** order
+                np.testing.assert_allclose(mean[g], np.mean(x, axis=0), rtol=1e-9)
+                np.testing.assert_allclose(var[g], np.var(x, axis=0), rtol=1e-8)
+        self.assertRaises(ValueError, acc.ttestStats, 4)
+
+    def test_welchTZero(self):
+        self.assertEqual(list(welchT(np.array([1.0, 2.0]), np.zeros(2), 5, np.array([1.0, 3.0]), np.zeros(2), 5)),
+                         [0.0, np.nan_to_num(-np.inf)])
+
+
+class TestCovarianceAccumulator(TestCase):
+
+    def test_blocksAndMerge(self):
+        rng = np.random.RandomState(1)
+        traces = np.dot(rng.randn(250, 5), rng.randn(5, 5)) + 100
+        groups = rng.randint(0, 3, 250)
+        traces[7] = np.nan
+        groups[8] = -1
+        valid = ~np.isnan(traces[:, 0]) & (groups >= 0)
+
+        a = CovarianceAccumulator(3, 5)
+        b = CovarianceAccumulator(3, 5)
+        addInBlocks(a, traces[:100], groups[:100], [3, 40])
+        addInBlocks(b, traces[100:], groups[100:], [77])
+        a.merge(b)
+        for g in range(3):
+            rows = traces[valid & (groups == g)]
+            self.assertEqual(a.count()[g], len(rows))
+            np.testing.assert_allclose(a.mean()[g], np.mean(rows, axis=0), rtol=1e-12)
+            np.testing.assert_allclose(a.covariance()[g], np.cov(rows, rowvar=False), rtol=1e-9)
+            np.testing.assert_allclose(a.covariance(ddof=0)[g], np.cov(rows, rowvar=False, ddof=0), rtol=1e-9)
+        self.assertRaises(ValueError, a.merge, CovarianceAccumulator(3, 4))
+
+
+class TestRegressionAccumulator(TestCase):
+
+    def test_tstat(self):
+        rng = np.random.RandomState(2)
+        x = rng.randint(0, 9, 400).astype(np.float64)
+        traces = rng.randn(400, 6) + 1000
+        traces[:, 2] += 0.3 * x
+        traces[[5, 6]] = np.nan
+
+        acc = RegressionAccumulator(6)
+        for start in range(0, 400, 64):
+            acc.addBlock(x[start:start + 64], traces[start:start + 64])
+        valid = ~np.isnan(traces[:, 0])
+        for i in range(6):
+            fit = stats.linregress(x[valid], traces[valid, i])
+            self.assertAlmostEqual(acc.tstat()[i], fit.slope / fit.stderr, places=6)
+
+    def test_tooFew(self):
+        acc = RegressionAccumulator(3)
+        acc.addBlock([1, 2], np.ones((2, 3)))
+        self.assertTrue(np.isnan(acc.tstat()).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.api.ProjectFormat import ProjectFormat
+from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+from chipwhisperer.common.utils.preprocess_traces import CopyRandOnly, fixedTextMask
+
+
+class CopyRandOnlyBlocks(CopyRandOnly):
+    """CopyRandOnly reading a few traces at a time, defined at module level so worker processes can unpickle it"""
+    blockSize = 7
+
+
+def loadProject(filename):
+    """Traces, text-ins, text-outs and keys of all the segments of a project"""
+    proj = ProjectFormat()
+    proj.load(filename)
+    tm = proj.traceManager()
+    n = tm.numTraces()
+    return tm.getTraces(0, n), tm.getTextins(0, n), tm.getTextouts(0, n), tm.getKnownKeys(0, n)
+
+
+class TestCopyProject(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.traces = rng.rand(75, 20)
+        self.textins = rng.randint(0, 256, (75, 16)).astype(np.uint8)
+        # Every third trace is one of the interleaved fixed plaintexts
+        for i in range(0, 75, 3):
+            self.textins[i] = CopyRandOnly.fixedTexts[(i // 3) % 3]
+        self.textouts = rng.randint(0, 256, (75, 16)).astype(np.uint8)
+        self.keys = np.tile(np.arange(16, dtype=np.uint8), (75, 1))
+
+        proj = ProjectFormat()
+        proj.setFilename(os.path.join(self.directory, "src.cwp"))
+        for n, (start, end) in enumerate([(0, 40), (40, 75)]):
+            seg = TraceContainerNative()
+            seg.config.setConfigFilename(os.path.join(proj.datadirectory, "traces", "config_seg%d_.cfg" % n))
+            seg.config.setAttr("prefix", "seg%d_" % n)
+            seg.setKnownKey(self.keys[0])
+            for i in range(start, end):
+                seg.addTrace(self.traces[i], self.textins[i], self.textouts[i], self.keys[i])
+            seg.closeAll()
+            proj.traceManager().appendSegment(seg)
+        proj.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_jobs(self):
+        src = os.path.join(self.directory, "src.cwp")
+        keep = ~fixedTextMask(self.textins, CopyRandOnly.fixedTexts)
+        self.assertEqual(np.sum(keep), 50)
+
+        results = []
+        for jobs in (1, 2):
+            dst = os.path.join(self.directory, "rand%d.cwp" % jobs)
+            CopyRandOnlyBlocks(src, dst, jobs=jobs)
+            results.append(loadProject(dst))
+
+        for expected, one, two in zip([self.traces, self.textins, self.textouts, self.keys], *results):
+            np.testing.assert_array_equal(one, two)
+            np.testing.assert_array_equal(one, expected[keep])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.attacks._stats import DataTypeDiffs
+from chipwhisperer.common.results.save import ResultsHistory, ResultsSave, diffsRange
+
+
+class StatsSource(object):
+    """Stands in for the attack ResultsSave observes"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def getStatistics(self):
+        return self.stats
+
+
+class TestResultsSave(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def test_diffsRange(self):
+        rng = np.random.RandomState(0)
+        diffs = [rng.randn(256, 30), None, rng.randn(200, 30), rng.randn(256)]
+        diffs[0][5, :] = np.nan
+        diffs[0][7, 3] = np.nan
+        tempmax, tempmin = diffsRange(diffs, 4, 256)
+
+        for i, d in enumerate(diffs):
+            for hyp in range(0, 256):
+                row = [] if d is None or hyp >= len(d) else [v for v in np.ravel(d[hyp]) if not np.isnan(v)]
+                if row:
+                    self.assertEqual(tempmax[i, hyp], max(row))
+                    self.assertEqual(tempmin[i, hyp], min(row))
+                else:
+                    self.assertTrue(np.isnan(tempmax[i, hyp]) and np.isnan(tempmin[i, hyp]))
+
+    def test_roundTrip(self):
+        rng = np.random.RandomState(1)
+        stats = DataTypeDiffs(numSubkeys=3, numPerms=256)
+        saver = ResultsSave()
+        saver._analysisSource = StatsSource(stats)
+        saver.setEnabled(True)
+
+        expected = []
+        for tnum in (10, 20, 30):
+            for bnum in range(0, 3):
+                if bnum == 1 and tnum == 10:
+                    continue
+                stats.updateSubkey(bnum, rng.randn(256, 50), tnum=tnum)
+            saver.analysisUpdated()
+            tempmax, tempmin = diffsRange(stats.diffs, 3, 256)
+            expected.append(([None if t is None else t for t in stats.diffs_tnum], tempmax, tempmin))
+        filename = saver._filename
+        saver.processAnalysis()
+
+        history = ResultsHistory(filename)
+        self.assertEqual(len(history), len(expected))
+        for rec, (tracecnt, tempmax, tempmin) in zip(history, expected):
+            self.assertEqual(rec["tracecnt"], tracecnt)
+            np.testing.assert_array_equal(rec["diffsmax"], tempmax)
+            np.testing.assert_array_equal(rec["diffsmin"], tempmin)
+        self.assertEqual(history[0]["tracecnt"], [10, None, 10])
+        del history
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.analyzer.attacks._stats import DataTypeDiffs, HistoryBuffer
+from chipwhisperer.common.results.pgevstraceplot import PGEVsTrace
+
+
+class StatsSource(object):
+    """Stands in for the attack the PGE plot observes"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def getStatistics(self):
+        return self.stats
+
+
+def pgeTable(stats):
+    """PGEVsTrace.pgeTable() of an attack with these statistics, without the plot widget"""
+    plot = type("Plot", (object,), {"_analysisSource":StatsSource(stats)})()
+    return PGEVsTrace.pgeTable.__func__(plot)
+
+
+def attackDiffs(tnum, bnum):
+    """Diffs (256 hypotheses x 3 points) of subkey bnum after trace tnum of a made-up attack"""
+    return np.random.RandomState(tnum * 16 + bnum).randn(256, 3)
+
+
+class TestHistoryBuffer(TestCase):
+
+    def checkKeys(self, hist, numKeys, numRows):
+        data = hist.data()
+        self.assertLessEqual(len(data), hist.maxRows)
+        tnums, counts = np.unique(data['trace'], return_counts=True)
+        # Whole keys are kept or dropped, the first and the latest are kept, and the gaps between the others are no
+        # wider than needed to fit the table
+        self.assertTrue((counts == numRows).all())
+        self.assertEqual(tnums[0], 0)
+        self.assertEqual(tnums[-1], numKeys - 1)
+        self.assertTrue((data['trace'][1:] >= data['trace'][:-1]).all())
+        self.assertLessEqual(np.diff(tnums).max(), max(1, 4 * numKeys * numRows // hist.maxRows))
+        return tnums
+
+    def test_downsampleKeys(self):
+        hist = HistoryBuffer([('trace', 'i8'), ('subkey', 'i4'), ('pge', 'i4')], maxRows=2048, key='trace')
+        for t in range(5000):
+            for i in range(16):
+                hist.append(t, i, (t + i) % 256)
+            self.assertLessEqual(len(hist), 2048)
+            if t in (127, 128, 1000, 4999):
+                self.checkKeys(hist, t + 1, 16)
+        data = hist.data()
+        np.testing.assert_array_equal(data['subkey'], np.tile(np.arange(16), len(data) // 16))
+        np.testing.assert_array_equal(data['pge'], (data['trace'] + data['subkey']) % 256)
+        self.assertEqual(hist.last().tolist(), (4999, 15, (4999 + 15) % 256))
+
+    def test_downsampleRows(self):
+        hist = HistoryBuffer([('trace', 'i8'), ('value', 'f8')], maxRows=100)
+        for t in range(1000):
+            hist.append(t, t * 0.5)
+        data = hist.data()
+        self.assertLessEqual(len(data), 100)
+        self.assertEqual(data['trace'][0], 0)
+        self.assertEqual(data['trace'][-1], 999)
+        np.testing.assert_array_equal(data['value'], data['trace'] * 0.5)
+
+
+class TestDataTypeDiffsHistory(TestCase):
+
+    def test_downsampledHistory(self):
+        stats = DataTypeDiffs()
+        stats.maxPGEHistory = 2048
+        stats.maxMaxesHistory = 256
+        stats.clear()
+        stats.setKnownkey(range(0, 256, 16))
+
+        numTraces = 1200
+        pge = np.zeros((numTraces, 16), dtype=np.int64)
+        for t in range(numTraces):
+            for i in range(16):
+                stats.updateSubkey(i, attackDiffs(t, i), tnum=t)
+            stats.findMaximums()
+            pge[t] = stats.pge
+
+        self.assertLessEqual(len(stats.pgeHistory), 2048)
+        tnums, avg, trials = pgeTable(stats)
+        self.assertEqual(tnums[0], 0)
+        self.assertEqual(tnums[-1], numTraces - 1)
+        self.assertTrue((np.diff(tnums) > 0).all())
+        # Every kept trace has the PGE of all the subkeys
+        self.assertTrue((trials == 1).all())
+        np.testing.assert_array_equal(avg, pge[tnums])
+        self.assertEqual(len(stats.pge_total), len(stats.pgeHistory))
+
+        for i in range(16):
+            hist = stats.maxesHistory[i].data()
+            self.assertLessEqual(len(hist), stats.maxMaxesHistory)
+            self.assertEqual(hist['trace'][0], 0)
+            self.assertEqual(hist['trace'][-1], numTraces - 1)
+            for row in hist[::97]:
+                np.testing.assert_array_equal(row['value'], np.max(np.abs(attackDiffs(row['trace'], i)), axis=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
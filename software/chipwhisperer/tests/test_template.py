@@ -0,0 +1,195 @@
+import logging
+import unittest
+from unittest import TestCase
+
+import numpy as np
+from scipy.stats import multivariate_normal
+
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
+from chipwhisperer.analyzer.attacks.profiling_algorithms.template import ProfilingTemplate, TemplateMatcher, TemplateUsingMVS
+
+PARTITION_TYPES = ("PartitionHWIntermediate", "PartitionHDLastRound", "PartitionHDRounds")
+KNOWNKEY = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
+
+
+class ArrayTraceSource(object):
+    """Minimal trace source serving blocks of in-memory arrays"""
+
+    def __init__(self, traces, textins, textouts, blockSize):
+        self.traces = traces
+        self.textins = textins
+        self.textouts = textouts
+        self.blockSize = blockSize
+
+    def getTraces(self, start, end):
+        return self.traces[start:end]
+
+    def getTextins(self, start, end):
+        return self.textins[start:end]
+
+    def getTextouts(self, start, end):
+        return self.textouts[start:end]
+
+
+def partitionLoop(model, ptype, textin, textout, guess, bnum):
+    """Partition of one trace for one guess, as the attack used to find it"""
+    if ptype == "PartitionHWIntermediate":
+        model.setHwModel(model.hwModels['HW: AES SBox Output, First Round (Enc)'])
+        return model.leakage(textin, textout, guess, bnum, None)
+    elif ptype == "PartitionHDLastRound":
+        model.setHwModel(model.hwModels['HD: AES Last-Round State'])
+        return model.leakage(textin, textout, guess, bnum, None)
+    elif ptype == "PartitionHDRounds":
+        if bnum == 0:
+            return model.getHW(textin[bnum] ^ guess)
+        return model.getHW((textin[bnum - 1] ^ KNOWNKEY[bnum - 1]) ^ (textin[bnum] ^ guess))
+    return guess
+
+
+def addTracesLoop(model, template, traces, textins, textouts, brange, pointRange):
+    """The attack as a loop over traces and subkeys with scipy's logpdf(): the updateSubkey() calls (bnum, tnum, data)"""
+    calls = []
+    valid = ~np.isnan(traces[:, 0])
+    traces = traces[valid, pointRange[0]:pointRange[1]]
+    textins = textins[valid]
+    textouts = textouts[valid]
+    pois = template["poi"]
+    numparts = len(template['mean'][0])
+    results = np.zeros((model.getNumSubKeys(), model.getPermPerSubkey()))
+    for tnum in range(0, len(traces)):
+        for bnum in brange:
+            try:
+                scores = [multivariate_normal.logpdf(traces[tnum][pois[bnum]], mean=template['mean'][bnum][i],
+                                                     cov=np.diag(template['cov'][bnum][i])) for i in range(0, numparts)]
+            except np.linalg.LinAlgError:
+                scores = [0] * model.getPermPerSubkey()
+            results[bnum] += [scores[partitionLoop(model, str(template["partitiontype"]), textins[tnum], textouts[tnum], i, bnum)]
+                              for i in range(0, model.getPermPerSubkey())]
+            calls.append((bnum, tnum + 1, results[bnum].copy()))
+    return calls
+
+
+class TestTemplate(TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.model = AES128_8bit()
+
+    def test_logpdf(self):
+        means = self.rng.randn(9, 4)
+        covs = []
+        for i in range(9):
+            a = self.rng.randn(4, 4)
+            covs.append(np.dot(a, a.T) + 0.5 * np.eye(4))
+        points = self.rng.randn(25, 4)
+        scores = TemplateMatcher(means, covs).logpdf(points)
+        for i in range(9):
+            np.testing.assert_allclose(scores[:, i], multivariate_normal.logpdf(points, mean=means[i], cov=covs[i]), rtol=1e-10)
+
+    def test_singular(self):
+        self.assertRaises(np.linalg.LinAlgError, TemplateMatcher, np.zeros((2, 2)), [np.eye(2), np.zeros((2, 2))])
+
+    def test_partitionTable(self):
+        attack = ProfilingTemplate()
+        attack.setModel(self.model)
+        textins = self.rng.randint(0, 256, (6, 16)).astype(np.uint8)
+        textouts = self.rng.randint(0, 256, (6, 16)).astype(np.uint8)
+        for ptype in PARTITION_TYPES + ("PartitionRandvsFixed",):
+            for bnum in (0, 1, 15):
+                table = attack.partitionTable(ptype, textins, textouts, bnum)
+                ref = [[partitionLoop(self.model, ptype, list(textins[t]), list(textouts[t]), guess, bnum)
+                        for guess in range(256)] for t in range(6)]
+                self.assertTrue(np.array_equal(table, ref), "%s, subkey %d" % (ptype, bnum))
+
+    def test_addTraces(self):
+        traces = self.rng.randn(23, 30)
+        traces[[4, 17]] = np.nan
+        textins = self.rng.randint(0, 256, (23, 16)).astype(np.uint8)
+        textouts = self.rng.randint(0, 256, (23, 16)).astype(np.uint8)
+        brange = [0, 1, 2, 3]
+        pointRange = (2, 28)
+        pois = [[3 * b, 3 * b + 1, 3 * b + 5] for b in range(16)]
+        means = [self.rng.randn(9, 3) for b in range(16)]
+        covs = [[np.diag(1 + self.rng.rand(3)) for i in range(9)] for b in range(16)]
+        # A variance of 0 can't be applied, that subkey gets nothing added
+        covs[2][4] = np.diag([1.0, 0.0, 1.0])
+
+        for ptype in PARTITION_TYPES:
+            template = {"poi":pois, "partitiontype":ptype, "mean":means, "cov":covs}
+            attack = ProfilingTemplate()
+            attack.setModel(AES128_8bit())
+            attack.setTargetSubkeys(brange)
+            attack.setReportingInterval(5)
+            attack.loadTemplatesFromProject = lambda: [template]
+            calls = []
+            attack.stats.updateSubkey = lambda bnum, data, tnum=None: calls.append((bnum, tnum, np.array(data)))
+            logging.disable(logging.WARNING)
+            try:
+                attack.addTraces(ArrayTraceSource(traces, textins, textouts, 8), (0, 22), pointRange=pointRange)
+            finally:
+                logging.disable(logging.NOTSET)
+
+            ref = addTracesLoop(AES128_8bit(), template, traces, textins, textouts, brange, pointRange)
+            self.assertEqual([c[:2] for c in calls], [r[:2] for r in ref])
+            for c, r in zip(calls, ref):
+                np.testing.assert_allclose(c[2], r[2], rtol=1e-9, err_msg="%s, subkey %d, trace %d" % (ptype, c[0], c[1]))
+            self.assertEqual(len(calls), 21 * len(brange))
+            self.assertFalse(any([c[2].any() for c in calls if c[0] == 2]))
+
+
+
+class FixedPartitions(object):
+    """Partition method returning a precomputed partition of every trace for every subkey"""
+
+    def __init__(self, pnums, numPartitions):
+        self.pnums = pnums
+        self.numPartitions = numPartitions
+
+    def getNumPartitions(self):
+        return self.numPartitions
+
+    def getPartitionNum(self, traceSource, tnum):
+        return self.pnums[tnum]
+
+
+class TestTemplateAccumulate(TestCase):
+
+    def test_mergedRanges(self):
+        rng = np.random.RandomState(3)
+        traces = rng.randn(200, 12)
+        poiList = [[1, 4, 7], [0, 2, 9, 11]]
+        # Partition 3 is empty, partition 4 holds a single trace
+        pnums = rng.randint(0, 3, (200, 2))
+        pnums[57] = 4
+        source = ArrayTraceSource(traces, None, None, 32)
+        partMethod = FixedPartitions(pnums, 5)
+
+        accs = TemplateUsingMVS.accumulate(source, (0, 90), poiList, partMethod)
+        other = TemplateUsingMVS.accumulate(source, (90, 200), poiList, partMethod)
+        for acc, o in zip(accs, other):
+            acc.merge(o)
+        logging.disable(logging.WARNING)
+        try:
+            template = TemplateUsingMVS.fromAccumulators(accs, (0, 199), poiList, partMethod)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        for bnum, pois in enumerate(poiList):
+            points = traces[:, pois]
+            for part in range(5):
+                rows = points[pnums[:, bnum] == part]
+                mean = template["mean"][bnum][part]
+                cov = template["cov"][bnum][part]
+                if len(rows) == 0:
+                    self.assertTrue(np.isnan(mean).all())
+                    self.assertFalse(cov.any())
+                elif len(rows) == 1:
+                    np.testing.assert_allclose(mean, rows[0])
+                    self.assertFalse(cov.any())
+                else:
+                    np.testing.assert_allclose(mean, np.mean(rows, axis=0), rtol=1e-12, atol=1e-12)
+                    np.testing.assert_allclose(cov, np.cov(rows, rowvar=False), rtol=1e-10, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
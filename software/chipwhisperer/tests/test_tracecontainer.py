@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+
+
+class AbortAfter(object):
+    """Progress bar asking to abort once blocks updates were made"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def setMaximum(self, value):
+        pass
+
+    def updateStatus(self, value):
+        self.blocks -= 1
+
+    def wasAborted(self):
+        return self.blocks <= 0
+
+
+class TestCopyTo(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.sources = [self.makeSource("src%d_" % i, rng.rand(30, 20), rng) for i in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeSource(self, prefix, traces, rng):
+        src = TraceContainerNative()
+        src.config.setConfigFilename(os.path.join(self.directory, "config_%s.cfg" % prefix))
+        src.config.setAttr("prefix", prefix)
+        src.setKnownKey(np.zeros(16, dtype=np.uint8))
+        for t in traces:
+            src.addTrace(t, rng.randint(0, 256, 16), rng.randint(0, 256, 16), rng.randint(0, 256, 16))
+        src.closeAll()
+        src.loadAllTraces(None, None)
+        src.starts = []
+        getTraces = src.getTraces
+
+        def recordStart(start, end):
+            src.starts.append(start)
+            return getTraces(start, end)
+        src.getTraces = recordStart
+        return src
+
+    def makeDest(self, create=True):
+        cfg = os.path.join(self.directory, "config_dst_.cfg")
+        if not create:
+            return TraceContainerNative(cfg)
+        dst = TraceContainerNative()
+        dst.config.setConfigFilename(cfg)
+        dst.config.setAttr("prefix", "dst_")
+        dst.copyBlockSize = 7
+        return dst
+
+    def checkCopy(self, src):
+        dst = self.makeDest(create=False)
+        dst.loadAllTraces(None, None)
+        # The source arrays may have unused rows past its last trace
+        self.assertEqual(dst.numTraces(), 30)
+        np.testing.assert_array_equal(dst.traces, src.traces[:30])
+        np.testing.assert_array_equal(dst.textins, src.textins[:30])
+        np.testing.assert_array_equal(dst.textouts, src.textouts[:30])
+        np.testing.assert_array_equal(dst.keylist, src.keylist[:30])
+
+    def interruptedCopy(self, src):
+        self.makeDest().copyTo(src, AbortAfter(2))
+        self.assertEqual(src.starts, [0, 7])
+        del src.starts[:]
+        dst = self.makeDest(create=False)
+        dst.copyBlockSize = 7
+        return dst
+
+    def test_copy(self):
+        self.makeDest().copyTo(self.sources[0])
+        self.checkCopy(self.sources[0])
+
+    def test_resume(self):
+        self.interruptedCopy(self.sources[0]).copyTo(self.sources[0], resume=True)
+        self.assertEqual(self.sources[0].starts, [14, 21, 28])
+        self.checkCopy(self.sources[0])
+
+    def test_noResumeByDefault(self):
+        self.interruptedCopy(self.sources[0]).copyTo(self.sources[0])
+        self.assertEqual(self.sources[0].starts, [0, 7, 14, 21, 28])
+        self.checkCopy(self.sources[0])
+
+    def test_resumeOtherSource(self):
+        self.interruptedCopy(self.sources[0]).copyTo(self.sources[1], resume=True)
+        self.assertEqual(self.sources[1].starts, [0, 7, 14, 21, 28])
+        self.checkCopy(self.sources[1])
+
+
+
+class TestSampleScaling(TestCase):
+    """Traces stored as 10-bit ADC codes in uint16, sample = code / 1024 - 0.5"""
+
+    scale = 1.0 / 1024
+    offset = 0.5
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(2)
+        self.codes = rng.randint(0, 1024, (20, 30))
+        self.exact = self.codes * self.scale - self.offset
+        # Samples between the codes are stored as the nearest one
+        self.noisy = self.exact + rng.uniform(-0.49, 0.49, self.exact.shape) * self.scale
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeContainer(self, prefix, dtype=np.uint16):
+        tc = TraceContainerNative()
+        tc.config.setConfigFilename(os.path.join(self.directory, "config_%s.cfg" % prefix))
+        tc.config.setAttr("prefix", prefix)
+        tc.setKnownKey(np.zeros(16, dtype=np.uint8))
+        tc.setSampleScaling(self.scale, self.offset, dtype)
+        return tc
+
+    def reload(self, tc):
+        reloaded = TraceContainerNative(tc.config.configFilename())
+        reloaded.loadAllTraces(None, None)
+        self.assertEqual(reloaded.sampleScale, self.scale)
+        self.assertEqual(reloaded.sampleOffset, self.offset)
+        return reloaded
+
+    def checkTraces(self, tc, expected):
+        n = len(expected)
+        self.assertEqual(tc.traces.dtype, np.uint16)
+        np.testing.assert_array_equal(tc.traces[:n], self.codes[:n])
+        np.testing.assert_array_equal(tc.getTraces(0, n), expected)
+        for i in (0, 7, n - 1):
+            np.testing.assert_array_equal(tc.getTrace(i), expected[i])
+        self.assertEqual(tc.getTraces(0, n).dtype, np.float64)
+
+    def test_addTrace(self):
+        tc = self.makeContainer("add_")
+        for t in self.noisy:
+            tc.addTrace(t, [0] * 16, [0] * 16, [0] * 16)
+        self.checkTraces(tc, self.exact)
+        tc.closeAll()
+        self.checkTraces(self.reload(tc), self.exact)
+
+    def test_streamed(self):
+        tc = self.makeContainer("stream_")
+        tc.setTraceHint(len(self.noisy))
+        tc.prepareDisk()
+        zeros = np.zeros((10, 16), dtype=np.uint8)
+        tc.addTraces(self.noisy[:10], zeros, zeros, zeros)
+        tc.addTraces(self.noisy[10:], zeros, zeros, zeros)
+        tc.closeAll(clearTrace=False, clearText=False, clearKeys=False)
+        self.checkTraces(tc, self.exact)
+        reloaded = self.reload(tc)
+        self.checkTraces(reloaded, self.exact)
+
+        # Copies keep the codes and the scaling
+        dst = TraceContainerNative()
+        dst.config.setConfigFilename(os.path.join(self.directory, "config_copy_.cfg"))
+        dst.config.setAttr("prefix", "copy_")
+        dst.copyTo(reloaded)
+        self.checkTraces(self.reload(dst), self.exact)
+
+    def test_clipping(self):
+        trace = np.array([-1.0, -0.5, -0.5 - 0.49 * self.scale, 0.0, 63.99, 64.0, 100.0, np.nan, -np.inf, np.inf])
+        for dtype, lo, hi in ((np.uint16, 0, 65535), (np.int16, -32768, 32767), (np.uint8, 0, 255)):
+            tc = self.makeContainer("clip_%s_" % np.dtype(dtype).name, dtype)
+            tc.addTrace(trace, [0] * 16, [0] * 16, [0] * 16)
+            codes = np.clip(np.rint((trace[:7] + self.offset) / self.scale), lo, hi)
+            # Infinities are clipped to the limits, NaN is stored as code 0
+            codes = np.concatenate((codes, [0, lo, hi]))
+            codes[-1] = hi
+            np.testing.assert_array_equal(tc.traces[0], codes)
+            np.testing.assert_array_equal(tc.getTrace(0), codes * self.scale - self.offset)
+            tc.closeAll()
+            np.testing.assert_array_equal(self.reload(tc).getTrace(0), codes * self.scale - self.offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
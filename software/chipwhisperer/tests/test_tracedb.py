@@ -0,0 +1,66 @@
+import sqlite3
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.traces._tracedb import TraceDB, hexBytes
+
+
+class TestTraceDB(TestCase):
+
+    def makeDB(self, waveFormat='binary'):
+        tdb = TraceDB(sqlite3.connect(":memory:"), "traces", 'sqlite', waveFormat)
+        tdb.batchSize = 16
+        tdb.prefetch = 8
+        tdb.createTable()
+        return tdb
+
+    def test_roundTrip(self):
+        rng = np.random.RandomState(0)
+        waves = rng.randn(50, 33)
+        textins = rng.randint(0, 256, (50, 16)).astype(np.uint8)
+        textouts = rng.randint(0, 256, (50, 16)).astype(np.uint8)
+        key = rng.randint(0, 256, 16).astype(np.uint8)
+
+        for waveFormat, dtype in (('binary', np.float32), ('binary', np.float64), ('pickle', np.float64)):
+            tdb = self.makeDB(waveFormat)
+            for n in range(0, 50):
+                tdb.add(waves[n], textins[n], textouts[n], key, dtype=dtype)
+            self.assertEqual(tdb.numTraces(), 50)
+            self.assertEqual(tdb.numPoints(), 33)
+
+            w, ti, to, k = tdb.read(10, 45)
+            np.testing.assert_array_equal(w, waves[10:45].astype(dtype))
+            self.assertEqual(w.dtype, dtype)
+            np.testing.assert_array_equal(ti, textins[10:45])
+            np.testing.assert_array_equal(to, textouts[10:45])
+            np.testing.assert_array_equal(k, np.tile(key, (35, 1)))
+
+            for n in (0, 7, 8, 49, 3):
+                w, ti, to, k = tdb.get(n)
+                np.testing.assert_array_equal(w, waves[n].astype(dtype))
+                np.testing.assert_array_equal(ti, textins[n])
+
+    def test_missingText(self):
+        tdb = self.makeDB()
+        tdb.add(np.zeros(4), [1, 2], None, [3, 4])
+        tdb.add(np.ones(4), [5, 6], [7, 8], [3, 4])
+        tdb.add(np.ones(4), [9, 10], None, [3, 4])
+
+        textouts = tdb.read(0, 3)[2]
+        self.assertEqual([list(t) for t in textouts], [[], [7, 8], []])
+        np.testing.assert_array_equal(tdb.read(0, 3)[1], [[1, 2], [5, 6], [9, 10]])
+        self.assertEqual(list(tdb.get(1)[2]), [7, 8])
+        self.assertEqual(list(tdb.get(2)[2]), [])
+
+    def test_hexBytes(self):
+        np.testing.assert_array_equal(hexBytes(["00FF", "1020"]), [[0, 255], [16, 32]])
+        self.assertEqual(hexBytes(["", ""]).shape, (2, 0))
+        self.assertEqual(hexBytes([]).shape, (0, 0))
+        rows = hexBytes(["", "0102", "03"])
+        self.assertEqual([list(r) for r in rows], [[], [1, 2], [3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
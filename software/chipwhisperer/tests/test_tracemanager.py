@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from chipwhisperer.common.api.ProjectFormat import ProjectFormat
+from chipwhisperer.common.api.TraceManager import TraceManager
+from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+
+
+def makeSegment(directory, prefix, traces):
+    """Save traces as a native segment in directory and return it, unloaded"""
+    seg = TraceContainerNative()
+    seg.config.setConfigFilename(os.path.join(directory, "config_%s.cfg" % prefix))
+    seg.config.setAttr("prefix", prefix)
+    seg.setKnownKey(np.zeros(16, dtype=np.uint8))
+    for i, t in enumerate(traces):
+        seg.addTrace(t, [i % 256] * 16, [(i + 1) % 256] * 16, [0] * 16)
+    seg.closeAll()
+    seg.unloadAllTraces()
+    return seg
+
+
+class TestSegmentPool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.traces = [rng.rand(10, 20) for i in range(3)]
+        self.tm = TraceManager()
+        for i, traces in enumerate(self.traces):
+            self.tm.appendSegment(makeSegment(self.directory, "seg%d_" % i, traces))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_poolLimit(self):
+        self.tm.setSegmentPoolSize(maxSegments=1)
+        for n in (0, 15, 25, 5):
+            self.assertTrue(np.array_equal(self.tm.getTrace(n), self.traces[n // 10][n % 10]))
+            self.assertEqual(self.tm.getSegmentStats()['open'], 1)
+
+    def test_unloadedOutsidePool(self):
+        #Segments unloaded by someone else (e.g. after a capture) are loaded again on the next read
+        self.assertTrue(np.array_equal(self.tm.getTrace(12), self.traces[1][2]))
+        opens = self.tm.getSegmentStats()['opens']
+        for seg in self.tm.traceSegments:
+            seg.unloadAllTraces()
+        self.assertTrue(np.array_equal(self.tm.getTrace(13), self.traces[1][3]))
+        self.assertTrue(np.array_equal(self.tm.getTraces(8, 12), np.concatenate((self.traces[0][8:], self.traces[1][:2]))))
+        self.assertEqual(self.tm.getSegmentStats()['opens'], opens + 2)
+
+
+
+class TestSegmentIndex(TestCase):
+    """Reopening a saved project with the segment index, against loading every segment config"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.projectfile = os.path.join(self.directory, "project.cwp")
+        rng = np.random.RandomState(1)
+        self.traces = [rng.rand(10, 20), rng.rand(15, 20)]
+
+        proj = ProjectFormat()
+        proj.setFilename(self.projectfile)
+        proj.traceManager().appendSegment(makeSegment(self.directory, "seg0_", self.traces[0]))
+
+        # A segment of scaled integer samples, with a sample rate
+        seg = TraceContainerNative()
+        seg.config.setConfigFilename(os.path.join(self.directory, "config_seg1_.cfg"))
+        seg.config.setAttr("prefix", "seg1_")
+        seg.config.setAttr("scopeSampleRate", 29538459)
+        seg.setSampleScaling(1.0 / 4096, 0.0, np.int16)
+        seg.setKnownKey(np.zeros(16, dtype=np.uint8))
+        for t in self.traces[1]:
+            seg.addTrace(t, [0] * 16, [0] * 16, [0] * 16)
+        seg.closeAll()
+        proj.traceManager().appendSegment(seg)
+        proj.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        proj = ProjectFormat()
+        proj.load(self.projectfile)
+        return proj.traceManager()
+
+    def fullLoad(self, segment):
+        full = TraceContainerNative()
+        full.config.loadTrace(segment.config.configFilename())
+        return full
+
+    def assertMatchesFullLoad(self, tm):
+        self.assertEqual(tm.numTraces(), 25)
+        self.assertEqual(tm.numPoints(), 20)
+        self.assertEqual(tm.getSampleRate(), 29538459)
+        self.assertEqual([t.mappedRange for t in tm.traceSegments], [[0, 9], [10, 24]])
+        for seg in tm.traceSegments:
+            full = self.fullLoad(seg)
+            for attr in TraceManager.indexAttrs:
+                self.assertEqual(str(seg.config.attr(attr)), str(full.config.attr(attr)), attr)
+            # Segments read from their config only know their dtype once loaded, the index keeps it
+            if seg.config.isDeferred():
+                full.loadAllTraces(None, None)
+                self.assertEqual(np.dtype(seg.tracedtype), full.traces.dtype)
+        np.testing.assert_array_equal(tm.getTraces(0, 10), self.traces[0])
+        np.testing.assert_allclose(tm.getTraces(10, 25), self.traces[1], atol=1.0 / 8192)
+
+    def test_deferred(self):
+        tm = self.reopen()
+        self.assertEqual([t.config.isDeferred() for t in tm.traceSegments], [True, True])
+        self.assertEqual([t.sampleScale for t in tm.traceSegments], [None, 1.0 / 4096])
+        self.assertMatchesFullLoad(tm)
+        # Reading the traces doesn't need the config files either
+        self.assertEqual([t.config.isDeferred() for t in tm.traceSegments], [True, True])
+
+    def test_touchedSegment(self):
+        cfg = os.path.join(self.directory, "config_seg1_.cfg")
+        mtime = os.stat(cfg).st_mtime
+        os.utime(cfg, (mtime + 10, mtime + 10))
+        tm = self.reopen()
+        self.assertEqual([t.config.isDeferred() for t in tm.traceSegments], [True, False])
+        self.assertMatchesFullLoad(tm)
+
+    def test_corruptIndex(self):
+        with open(TraceManager._segmentIndexFilename(self.projectfile), "w") as f:
+            f.write('{"version": 1, "segments": {"config_seg0_.cfg"')
+        tm = self.reopen()
+        self.assertEqual([t.config.isDeferred() for t in tm.traceSegments], [False, False])
+        self.assertMatchesFullLoad(tm)
+
+    def test_writeDeferred(self):
+        tm = self.reopen()
+        seg0, seg1 = tm.traceSegments
+
+        # setAttr() reads the file first, so the other attributes are those of the file and not the defaults
+        seg0.config.setAttr("notes", "changed")
+        self.assertFalse(seg0.config.isDeferred())
+        self.assertEqual(seg0.config.attr("notes"), "changed")
+        self.assertEqual(int(seg0.config.attr("numTraces")), 10)
+        seg0.config.saveTrace()
+        full = self.fullLoad(seg0)
+        self.assertEqual(full.config.attr("notes"), "changed")
+        self.assertEqual(int(full.config.attr("numTraces")), 10)
+        self.assertEqual(full.config.attr("prefix"), "seg0_")
+
+        seg1.config.syncFile()
+        self.assertFalse(seg1.config.isDeferred())
+        self.assertEqual(int(seg1.config.config["Trace Config"]["numTraces"]), 15)
+        self.assertEqual(float(seg1.config.attr("sampleScale")), 1.0 / 4096)
+
+
+if __name__ == '__main__':
+    unittest.main()